@@ -0,0 +1,201 @@
+import operator
+
+from components.errors import Abort, RTError
+from components.interpeter import RTResult, MAX_NUMBER, MIN_NUMBER, overflow_error, too_many_variables, variables_full
+from components.number import Number
+from components.parser import node_methods
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT
+)
+
+UNSET = object()
+
+ARITHMETIC = {
+    PLUS: operator.add,
+    MINUS: operator.sub,
+    MUL: operator.mul,
+}
+
+COMPARISONS = {
+    EE: operator.eq,
+    NE: operator.ne,
+    LT: operator.lt,
+    GT: operator.gt,
+    LTE: operator.le,
+    GTE: operator.ge,
+}
+
+
+class ClosureCompiler:
+    def __init__(self):
+        self.compile_methods = node_methods(self, 'compile')
+        self.invariant_cells = {}
+
+    def compile(self, node):
+        evaluate = self.visit(node)
+
+        def program(context):
+            res = RTResult()
+            try:
+                value = evaluate(context)
+            except Abort as abort:
+                return res.failure(abort.error)
+            if value is None:
+                return res.success(None)
+            return res.success(Number(value).set_context(context).set_pos(node.pos_start, node.pos_end))
+
+        return program
+
+    def visit(self, node):
+        node_type_name = type(node).__name__
+        method = self.compile_methods.get(node_type_name, self.no_compile_method)
+        return method(node)
+
+    def no_compile_method(self, node):
+        raise ValueError(f'No compile_{type(node).__name__} method defined')
+
+    @staticmethod
+    def compile_number_node(node):
+        value = node.tok.value
+        return lambda context: value
+
+    @staticmethod
+    def compile_var_access_node(node):
+        var_name = node.var_name_tok.value
+
+        def evaluate(context):
+            value = context.symbol_table.get(var_name)
+            if value is None:
+                raise Abort(RTError(node.pos_start, node.pos_end, f"'{var_name}' is not defined", context))
+            return value.value
+
+        return evaluate
+
+    def compile_var_assign_node(self, node):
+        var_name = node.var_name_tok.value
+        value_node = self.visit(node.value_node)
+        pos_start, pos_end = node.value_node.pos_start, node.value_node.pos_end
+
+        def evaluate(context):
+            value = value_node(context)
+            if variables_full(context.symbol_table):
+                raise Abort(too_many_variables(context))
+            number = None if value is None else Number(value).set_context(context).set_pos(pos_start, pos_end)
+            context.symbol_table.set(var_name, number)
+            return value
+
+        return evaluate
+
+    def compile_bin_op_node(self, node):
+        left = self.visit(node.left_node)
+        right = self.visit(node.right_node)
+        op_type = node.op_tok.type
+        max_number, min_number = MAX_NUMBER, MIN_NUMBER
+
+        if op_type in ARITHMETIC:
+            operation = ARITHMETIC[op_type]
+
+            def evaluate(context):
+                result = operation(left(context), right(context))
+                if result > max_number or result < min_number:
+                    raise Abort(overflow_error(result, node.pos_start, node.pos_end))
+                return result
+
+        elif op_type == DIV:
+            def evaluate(context):
+                dividend = left(context)
+                divisor = right(context)
+                if divisor == 0:
+                    raise Abort(RTError(
+                        node.right_node.pos_start, node.right_node.pos_end,
+                        'Division by zero',
+                        context
+                    ))
+                result = dividend / divisor
+                if result > max_number or result < min_number:
+                    raise Abort(overflow_error(result, node.pos_start, node.pos_end))
+                return result
+
+        elif op_type in COMPARISONS:
+            comparison = COMPARISONS[op_type]
+
+            def evaluate(context):
+                return int(comparison(left(context), right(context)))
+
+        elif node.op_tok.matches(KEYWORD, 'AND'):
+            def evaluate(context):
+                # both operands are always evaluated, like the tree interpreter does
+                left_value, right_value = left(context), right(context)
+                return int(left_value and right_value)
+
+        elif node.op_tok.matches(KEYWORD, 'OR'):
+            def evaluate(context):
+                left_value, right_value = left(context), right(context)
+                return int(left_value or right_value)
+
+        else:
+            raise ValueError(f'Unknown binary operator {node.op_tok}')
+
+        return evaluate
+
+    def compile_unary_op_node(self, node):
+        operand = self.visit(node.node)
+
+        if node.op_tok.type == MINUS:
+            return lambda context: -operand(context)
+        if node.op_tok.matches(KEYWORD, 'NOT'):
+            return lambda context: 1 if operand(context) == 0 else 0
+        return operand
+
+    def compile_if_node(self, node):
+        cases = tuple((self.visit(condition), self.visit(expr)) for condition, expr in node.cases)
+        else_case = self.visit(node.else_case) if node.else_case else None
+
+        def evaluate(context):
+            for condition, expr in cases:
+                if condition(context) != 0:
+                    return expr(context)
+            if else_case:
+                return else_case(context)
+            return None
+
+        return evaluate
+
+    def compile_while_node(self, node):
+        condition = self.visit(node.condition_node)
+        body = self.visit(node.body_node)
+        cells = tuple(self.invariant_cell(invariant) for invariant in node.invariants)
+
+        def evaluate(context):
+            for cell in cells:
+                cell[0] = UNSET
+            while condition(context) != 0:
+                body(context)
+
+        return evaluate
+
+    def invariant_cell(self, node):
+        if node not in self.invariant_cells:
+            self.invariant_cells[node] = [UNSET]
+        return self.invariant_cells[node]
+
+    def compile_invariant_node(self, node):
+        inner = self.visit(node.node)
+        cell = self.invariant_cell(node)
+
+        def evaluate(context):
+            if cell[0] is UNSET:
+                cell[0] = inner(context)
+            return cell[0]
+
+        return evaluate
@@ -0,0 +1,471 @@
+import struct
+import sys
+from array import array
+
+from components.closures import ARITHMETIC, COMPARISONS
+from components.errors import Abort, RTError
+from components.interpeter import RTResult, MAX_NUMBER, MIN_NUMBER, overflow_error, too_many_variables, variables_full
+from components.number import Number
+from components.loop_invariants import InvariantNode
+from components.parser import Node, NumberNode, VarAccessNode, VarAssignNode, BinOpNode, UnaryOpNode, IfNode, WhileNode
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT,
+    INT,
+    FLOAT,
+    IDENTIFIER
+)
+from components.tokenizer import Position, Token
+
+# node kinds; the first five are straight-line: they evaluate every child once, in order
+NUMBER, VARIABLE, ASSIGN, BINARY, UNARY, IF, WHILE, INVARIANT = range(8)
+STRAIGHT = frozenset((NUMBER, VARIABLE, ASSIGN, BINARY, UNARY))
+
+# operator codes: arithmetic first, then comparisons, then the logic keywords
+OPERATORS = (PLUS, MINUS, MUL, DIV, EE, NE, LT, GT, LTE, GTE, 'AND', 'OR', 'NOT')
+OPERATOR_CODES = {operator: code for code, operator in enumerate(OPERATORS)}
+FUNCTIONS = tuple(ARITHMETIC.get(operator) or COMPARISONS.get(operator) for operator in OPERATORS)
+ADD, SUBTRACT, MULTIPLY, DIVIDE = range(4)
+AND, OR, NOT = OPERATOR_CODES['AND'], OPERATOR_CODES['OR'], OPERATOR_CODES['NOT']
+
+# operator tokens for rebuilt trees: nothing reads a binary operator's position, so one token each will do
+OPERATOR_TOKENS = tuple(Token(KEYWORD, operator) if operator in {'AND', 'OR', 'NOT'} else Token(operator)
+                        for operator in OPERATORS)
+
+# the serialized form: a header, then every column in turn, little-endian
+MAGIC = b'CTRE'
+FORMAT_VERSION = 1  # bumped whenever the layout, or the trees the parser builds, change
+HEADER = struct.Struct('<4sH5I')  # magic, version, nodes, links, ints, floats, bytes of names
+BIG_ENDIAN = sys.byteorder == 'big'
+
+# what an entry on CompactInterpreter's work stack does, like StackInterpreter's
+EVALUATE, OPERATE, NEGATE, STORE, TEST, LOOP, AGAIN, DISCARD, REMEMBER = range(9)
+
+
+class CompactTree:
+    """A parsed tree as parallel typed arrays, one entry per node, children before their parent, so
+    the root is the last entry and a node's subtree is the run of entries from low[index] to index.
+
+    kinds, ops and low say what each node is; arg is the constant or name index of a NUMBER,
+    VARIABLE or ASSIGN, the left operand of a BINARY, and the offset in links of an IF's
+    (case count, conditions and expressions, else or -1) or a WHILE's (condition, body, invariant
+    count, invariants). Any other operand is the entry just before its node. offsets holds each
+    node's source offsets, start and end, turned into Positions only for an error or a value that
+    keeps its span."""
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('b')
+        self.ops = array('b')
+        self.straight = array('b')
+        self.arg = array('i')
+        self.low = array('i')
+        self.offsets = array('i')
+        self.links = array('i')
+        self.constants = []
+        self.names = []
+        self.spans = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def nbytes(self):
+        # the arrays' buffers; constants and names are shared by every node that uses them
+        return sum(column.itemsize * len(column) for column in self.columns())
+
+    @classmethod
+    def from_node(cls, node):
+        # iterative, so a tree deeper than the recursion limit flattens too
+        tree = cls(edge_token(node, 'FIRST').source)
+        constants, names, invariants = {}, {}, {}
+        flattened = []
+        pending = [(node, False)]
+        while pending:
+            node, expanded = pending.pop()
+            children = node_children(node)
+            if children and not expanded:
+                pending.append((node, True))
+                pending.extend((child, False) for child in reversed(children))
+                continue
+
+            first = len(flattened) - len(children)
+            placed = flattened[first:]
+            del flattened[first:]
+            flattened.append((node, tree.add(node, placed, constants, names, invariants)))
+        return tree
+
+    def add(self, node, placed, constants, names, invariants):
+        # appends node, whose children are already in as the (child, index) pairs placed, and returns
+        # its index
+        index = len(self.kinds)
+        children = [child_index for _, child_index in placed]
+        node_type = type(node).__name__
+        op = arg = 0
+
+        if node_type == 'NumberNode':
+            kind = NUMBER
+            arg = pool_index(constants, self.constants, (type(node.tok.value), node.tok.value), node.tok.value)
+        elif node_type == 'VarAccessNode':
+            kind = VARIABLE
+            arg = pool_index(names, self.names, node.var_name_tok.value, node.var_name_tok.value)
+        elif node_type == 'VarAssignNode':
+            kind = ASSIGN
+            arg = pool_index(names, self.names, node.var_name_tok.value, node.var_name_tok.value)
+        elif node_type == 'BinOpNode':
+            kind, op, arg = BINARY, operator_code(node.op_tok), children[0]
+        elif node_type == 'UnaryOpNode':
+            kind, op = UNARY, operator_code(node.op_tok)
+        elif node_type == 'IfNode':
+            kind, arg = IF, len(self.links)
+            self.links.append(len(node.cases))
+            self.links.extend(children)
+            if not node.else_case:
+                self.links.append(-1)
+        elif node_type == 'WhileNode':
+            kind, arg = WHILE, len(self.links)
+            self.links.extend(children)
+            self.links.append(len(node.invariants))
+            self.links.extend(invariants[id(invariant)] for invariant in node.invariants)
+        elif node_type == 'InvariantNode':
+            kind = INVARIANT
+            invariants[id(node)] = index
+        else:
+            raise ValueError(f'No compact form of {node_type}')
+
+        self.kinds.append(kind)
+        self.ops.append(op)
+        self.arg.append(arg)
+        self.low.append(self.low[children[0]] if children else index)
+        self.straight.append(kind in STRAIGHT and all(self.straight[child] for child in children))
+        self.offsets.extend((self.edge_offset(node, placed, 'FIRST'), self.edge_offset(node, placed, 'LAST')))
+        return index
+
+    def edge_offset(self, node, placed, side):
+        # where node starts or ends: a child's offset if node starts or ends with one, so a node costs
+        # the same however deep its edge token lies
+        part = getattr(node, getattr(node, side))
+        end = side == 'LAST'
+        for child, child_index in placed:
+            if child is part:
+                return self.offsets[2 * child_index + end]
+        token = edge_token(part, side)
+        return token.end if end else token.start
+
+    def span(self, index):
+        # the Positions a node starts and ends at, built the first time they are asked for
+        span = self.spans.get(index)
+        if span is None:
+            span = self.spans[index] = (Position(self.offsets[2 * index], txt=self.source),
+                                        Position(self.offsets[2 * index + 1], txt=self.source))
+        return span
+
+    def columns(self):
+        return (self.kinds, self.ops, self.straight, self.arg, self.low, self.offsets, self.links)
+
+    def to_bytes(self):
+        # raises OverflowError for an int constant too big for 64 bits
+        ints = array('q', (value for value in self.constants if isinstance(value, int)))
+        floats = array('d', (value for value in self.constants if not isinstance(value, int)))
+        types = array('b', (not isinstance(value, int) for value in self.constants))
+        names = '\0'.join(self.names).encode('utf-8')
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, len(self.kinds), len(self.links), len(ints), len(floats),
+                             len(names))]
+        for column in self.columns() + (types, ints, floats):
+            parts.append(little_endian(array(column.typecode, column) if BIG_ENDIAN else column).tobytes())
+        parts.append(names)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, source):
+        # the inverse of to_bytes for a tree of source; raises ValueError if data isn't one
+        if len(data) < HEADER.size:
+            raise ValueError('Too short for a compact tree')
+        magic, version, nodes, links, ints, floats, names = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Not a compact tree of this version')
+
+        tree = cls(source)
+        types, int_values, float_values = array('b'), array('q'), array('d')
+        counts = (nodes,) * 5 + (2 * nodes, links, ints + floats, ints, floats)
+        position = HEADER.size
+        for column, count in zip(tree.columns() + (types, int_values, float_values), counts):
+            end = position + count * column.itemsize
+            column.frombytes(data[position:end])
+            little_endian(column)
+            position = end
+        if position + names != len(data):
+            raise ValueError('Compact tree of the wrong size')
+
+        int_values, float_values = iter(int_values), iter(float_values)
+        tree.constants = [next(float_values) if is_float else next(int_values) for is_float in types]
+        tree.names = str(data[position:], 'utf-8').split('\0') if names else []
+        return tree
+
+    def to_node(self):
+        # the tree of Nodes this was flattened from, with tokens that keep the same spans
+        source, offsets, arg, links = self.source, self.offsets, self.arg, self.links
+        nodes = []
+        for index, kind in enumerate(self.kinds):
+            start = offsets[2 * index]
+            if kind == NUMBER:
+                value = self.constants[arg[index]]
+                node = NumberNode(Token.spanning(INT if isinstance(value, int) else FLOAT, value, start,
+                                                 offsets[2 * index + 1], source))
+            elif kind == VARIABLE:
+                node = VarAccessNode(Token.spanning(IDENTIFIER, self.names[arg[index]], start, offsets[2 * index + 1],
+                                                    source))
+            elif kind == ASSIGN:
+                name = self.names[arg[index]]
+                node = VarAssignNode(Token.spanning(IDENTIFIER, name, start, start + len(name), source), nodes[-1])
+            elif kind == BINARY:
+                node = BinOpNode(nodes[arg[index]], OPERATOR_TOKENS[self.ops[index]], nodes[-1])
+            elif kind == UNARY:
+                op_tok = OPERATOR_TOKENS[self.ops[index]]
+                op_end = start + (len(op_tok.value) if op_tok.value else 1)
+                node = UnaryOpNode(Token.spanning(op_tok.type, op_tok.value, start, op_end, source), nodes[-1])
+            elif kind == IF:
+                first, count = arg[index] + 1, links[arg[index]]
+                cases = [(nodes[links[first + 2 * case]], nodes[links[first + 2 * case + 1]]) for case in range(count)]
+                else_case = links[first + 2 * count]
+                node = IfNode(cases, nodes[else_case] if else_case >= 0 else None)
+            elif kind == WHILE:
+                first = arg[index]
+                invariants = tuple(nodes[invariant] for invariant in links[first + 3:first + 3 + links[first + 2]])
+                node = WhileNode(nodes[links[first]], nodes[links[first + 1]], invariants)
+            else:
+                node = InvariantNode(nodes[-1])
+            nodes.append(node)
+        return nodes[-1]
+
+
+def little_endian(column):
+    # swaps column in place between the machine's byte order and the little-endian serialized one
+    if BIG_ENDIAN:
+        column.byteswap()
+    return column
+
+
+def node_children(node):
+    # the nodes a node evaluates, in the order CompactTree lays them out
+    node_type = type(node).__name__
+    if node_type == 'BinOpNode':
+        return [node.left_node, node.right_node]
+    if node_type in {'UnaryOpNode', 'InvariantNode'}:
+        return [node.node]
+    if node_type == 'VarAssignNode':
+        return [node.value_node]
+    if node_type == 'IfNode':
+        children = [part for case in node.cases for part in case]
+        return children + [node.else_case] if node.else_case else children
+    if node_type == 'WhileNode':
+        return [node.condition_node, node.body_node]
+    return []
+
+
+def edge_token(node, side):
+    # the token a node starts or ends with, found without building its Positions
+    while isinstance(node, Node):
+        node = getattr(node, getattr(node, side))
+    return node
+
+
+def pool_index(indices, values, key, value):
+    # the index of value in values, appended the first time it is seen
+    index = indices.get(key)
+    if index is None:
+        index = indices[key] = len(values)
+        values.append(value)
+    return index
+
+
+def operator_code(tok):
+    code = OPERATOR_CODES.get(tok.value if tok.type == KEYWORD else tok.type)
+    if code is None:
+        raise ValueError(f'Unknown operator {tok}')
+    return code
+
+
+class CompactInterpreter:
+    # Evaluates a CompactTree on plain ints and floats, like UnboxedInterpreter. A straight-line
+    # subtree runs as one pass over its run of entries with a value stack; what has IF, WHILE or
+    # invariants below it goes through a work stack, so nesting needs no Python frame per level.
+
+    def __init__(self):
+        self.invariant_values = {}
+
+    def run(self, tree, context):
+        res = RTResult()
+        try:
+            value = self.evaluate(tree, len(tree) - 1, context)
+        except Abort as abort:
+            return res.failure(abort.error)
+        return res.success(None if value is None else Number.box(value))
+
+    def evaluate(self, tree, index, context):
+        work = [(EVALUATE, index, 0)]
+        values = []
+        while work:
+            action, index, step = work.pop()
+            if action == EVALUATE:
+                if tree.straight[index]:
+                    self.scan(tree, index, context, values)
+                else:
+                    self.expand(tree, index, context, work, values)
+            elif action == OPERATE:
+                right = values.pop()
+                values[-1] = self.operate(tree, index, values[-1], right, context)
+            elif action == NEGATE:
+                values[-1] = unary(tree.ops[index], values[-1])
+            elif action == STORE:
+                values[-1] = self.assign(tree, index, values[-1], context)
+            elif action == TEST:
+                if values.pop() != 0:
+                    work.append((EVALUATE, tree.links[tree.arg[index] + 2 + 2 * step], 0))
+                else:
+                    self.case(tree, index, context, work, values, step=step + 1)
+            elif action == LOOP:
+                if values.pop() != 0:
+                    work.extend(((AGAIN, index, 0), (DISCARD, index, 0), (EVALUATE, tree.links[tree.arg[index] + 1], 0)))
+                else:
+                    values.append(None)
+            elif action == AGAIN:
+                self.iterate(tree, index, context, work, values)
+            elif action == DISCARD:
+                values.pop()
+            else:
+                self.invariant_values[index] = values[-1]
+        return values.pop()
+
+    def scan(self, tree, index, context, values):
+        # evaluates the straight-line subtree ending at index, its entries in order
+        kinds, ops, arg, constants = tree.kinds, tree.ops, tree.arg, tree.constants
+        for entry in range(tree.low[index], index + 1):
+            kind = kinds[entry]
+            if kind == NUMBER:
+                values.append(constants[arg[entry]])
+            elif kind == VARIABLE:
+                values.append(self.lookup(tree, entry, context))
+            elif kind == BINARY:
+                right = values.pop()
+                values[-1] = self.operate(tree, entry, values[-1], right, context)
+            elif kind == UNARY:
+                values[-1] = unary(ops[entry], values[-1])
+            else:
+                values[-1] = self.assign(tree, entry, values[-1], context)
+
+    def expand(self, tree, index, context, work, values):
+        # pushes what evaluating a node with control flow below it takes, operands last
+        kind = tree.kinds[index]
+        if kind == BINARY:
+            work.extend(((OPERATE, index, 0), (EVALUATE, index - 1, 0), (EVALUATE, tree.arg[index], 0)))
+        elif kind == UNARY:
+            work.extend(((NEGATE, index, 0), (EVALUATE, index - 1, 0)))
+        elif kind == ASSIGN:
+            work.extend(((STORE, index, 0), (EVALUATE, index - 1, 0)))
+        elif kind == IF:
+            self.case(tree, index, context, work, values)
+        elif kind == WHILE:
+            start = tree.arg[index]
+            for invariant in tree.links[start + 3:start + 3 + tree.links[start + 2]]:
+                self.invariant_values.pop(invariant, None)
+            self.iterate(tree, index, context, work, values)
+        elif index in self.invariant_values:
+            values.append(self.invariant_values[index])
+        else:
+            work.extend(((REMEMBER, index, 0), (EVALUATE, index - 1, 0)))
+
+    def case(self, tree, index, context, work, values, *, step=0):
+        # tries the IF at index from its step-th case on, then its else case; straight-line
+        # conditions are tested right away, the others on the work stack
+        links, start = tree.links, tree.arg[index]
+        while step < links[start]:
+            condition = links[start + 1 + 2 * step]
+            if not tree.straight[condition]:
+                work.extend(((TEST, index, step), (EVALUATE, condition, 0)))
+                return
+            self.scan(tree, condition, context, values)
+            if values.pop() != 0:
+                work.append((EVALUATE, links[start + 2 + 2 * step], 0))
+                return
+            step += 1
+
+        else_case = links[start + 1 + 2 * links[start]]
+        if else_case >= 0:
+            work.append((EVALUATE, else_case, 0))
+        else:
+            values.append(None)
+
+    def iterate(self, tree, index, context, work, values):
+        # runs the WHILE at index from its next test of the condition on; while the condition and
+        # the body are both straight-line the iterations stay in this loop
+        condition, body = tree.links[tree.arg[index]], tree.links[tree.arg[index] + 1]
+        if not tree.straight[condition]:
+            work.extend(((LOOP, index, 0), (EVALUATE, condition, 0)))
+            return
+        scan = self.scan
+        while True:
+            scan(tree, condition, context, values)
+            if values.pop() == 0:
+                values.append(None)
+                return
+            if not tree.straight[body]:
+                work.extend(((AGAIN, index, 0), (DISCARD, index, 0), (EVALUATE, body, 0)))
+                return
+            scan(tree, body, context, values)
+            values.pop()
+
+    @staticmethod
+    def lookup(tree, index, context):
+        name = tree.names[tree.arg[index]]
+        value = context.symbol_table.get(name)
+        if value is None:
+            pos_start, pos_end = tree.span(index)
+            raise Abort(RTError(pos_start, pos_end, f"'{name}' is not defined", context))
+        return value.value
+
+    @staticmethod
+    def assign(tree, index, value, context):
+        if variables_full(context.symbol_table):
+            raise Abort(too_many_variables(context))
+        number = None if value is None else Number(value).set_context(context).set_pos(*tree.span(index - 1))
+        context.symbol_table.set(tree.names[tree.arg[index]], number)
+        return value
+
+    @staticmethod
+    def operate(tree, index, left, right, context):
+        code = tree.ops[index]
+        if code == DIVIDE:
+            if right == 0:
+                raise Abort(RTError(*tree.span(index - 1), 'Division by zero', context))
+            result = left / right
+        elif code < DIVIDE:
+            result = FUNCTIONS[code](left, right)
+        elif code == AND:
+            return int(left and right)
+        elif code == OR:
+            return int(left or right)
+        else:
+            return int(FUNCTIONS[code](left, right))
+
+        if result > MAX_NUMBER or result < MIN_NUMBER:
+            raise Abort(overflow_error(result, *tree.span(index)))
+        return result
+
+
+def unary(code, value):
+    if code == SUBTRACT:
+        return -value
+    if code == NOT:
+        return 1 if value == 0 else 0
+    return value
+
@@ -0,0 +1,187 @@
+from components.parser import node_methods
+from components.resolver import SlotResolver
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT
+)
+
+# Every instruction occupies two slots in the flat code list: opcode, argument
+# Arithmetic opcodes are contiguous, then comparisons/logic, so the VM can range-check them
+LOAD_CONST = 0
+LOAD_NAME = 1
+ADD = 2
+SUB = 3
+MUL_OP = 4
+DIV_OP = 5
+EQ_OP = 6
+NE_OP = 7
+LT_OP = 8
+GT_OP = 9
+LTE_OP = 10
+GTE_OP = 11
+AND_OP = 12
+OR_OP = 13
+STORE_NAME = 14
+NEG = 15
+NOT_OP = 16
+POP = 17
+JUMP = 18
+POP_JUMP_IF_FALSE = 19
+LOAD_INVARIANT = 20
+STORE_INVARIANT = 21
+RESET_INVARIANT = 22
+
+BINARY_OPCODES = {
+    PLUS: ADD,
+    MINUS: SUB,
+    MUL: MUL_OP,
+    DIV: DIV_OP,
+    EE: EQ_OP,
+    NE: NE_OP,
+    LT: LT_OP,
+    GT: GT_OP,
+    LTE: LTE_OP,
+    GTE: GTE_OP,
+}
+
+KEYWORD_OPCODES = {
+    'AND': AND_OP,
+    'OR': OR_OP,
+}
+
+
+class Bytecode:
+    def __init__(self):
+        self.code = []
+        self.constants = []
+        self.names = []
+        self.positions = []  # (pos_start, pos_end) per instruction, used for error reporting
+        self.invariant_slots = {}
+        self.invariant_ends = []  # where execution continues when an invariant slot is already filled
+        self.resolver = None
+
+    def emit(self, opcode, arg=0, node=None):
+        self.code.append(opcode)
+        self.code.append(arg)
+        self.positions.append((node.pos_start, node.pos_end) if node else (None, None))
+        return len(self.code) - 2
+
+    def patch(self, index, arg):
+        self.code[index + 1] = arg
+
+    def add_constant(self, value):
+        for idx, constant in enumerate(self.constants):
+            if constant == value and type(constant) is type(value):
+                return idx
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def add_name(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def add_invariant(self, node):
+        if node not in self.invariant_slots:
+            self.invariant_slots[node] = len(self.invariant_ends)
+            self.invariant_ends.append(None)
+        return self.invariant_slots[node]
+
+    def position_at(self, pc):
+        return self.positions[pc // 2]
+
+
+class Compiler:
+    def __init__(self):
+        self.bytecode = None
+        self.compile_methods = node_methods(self, 'compile')
+
+    def compile(self, node):
+        self.bytecode = Bytecode()
+        self.visit(node)
+        self.bytecode.resolver = SlotResolver(self.bytecode.names)
+        return self.bytecode
+
+    def visit(self, node):
+        node_type_name = type(node).__name__
+        method = self.compile_methods.get(node_type_name, self.no_compile_method)
+        method(node)
+
+    def no_compile_method(self, node):
+        raise ValueError(f'No compile_{type(node).__name__} method defined')
+
+    def compile_number_node(self, node):
+        self.bytecode.emit(LOAD_CONST, self.bytecode.add_constant(node.tok.value), node)
+
+    def compile_var_access_node(self, node):
+        self.bytecode.emit(LOAD_NAME, self.bytecode.add_name(node.var_name_tok.value), node)
+
+    def compile_var_assign_node(self, node):
+        self.visit(node.value_node)
+        self.bytecode.emit(STORE_NAME, self.bytecode.add_name(node.var_name_tok.value), node)
+
+    def compile_bin_op_node(self, node):
+        self.visit(node.left_node)
+        self.visit(node.right_node)
+
+        if node.op_tok.type == KEYWORD:
+            opcode = KEYWORD_OPCODES.get(node.op_tok.value)
+        else:
+            opcode = BINARY_OPCODES.get(node.op_tok.type)
+        if opcode is None:
+            raise ValueError(f'Unknown binary operator {node.op_tok}')
+
+        # division by zero is reported on the right operand, as Number.dived_by does
+        self.bytecode.emit(opcode, 0, node.right_node if opcode == DIV_OP else node)
+
+    def compile_unary_op_node(self, node):
+        self.visit(node.node)
+        if node.op_tok.type == MINUS:
+            self.bytecode.emit(NEG, 0, node)
+        elif node.op_tok.matches(KEYWORD, 'NOT'):
+            self.bytecode.emit(NOT_OP, 0, node)
+
+    def compile_if_node(self, node):
+        end_jumps = []
+        for condition, expr in node.cases:
+            self.visit(condition)
+            next_case = self.bytecode.emit(POP_JUMP_IF_FALSE, 0, condition)
+            self.visit(expr)
+            end_jumps.append(self.bytecode.emit(JUMP))
+            self.bytecode.patch(next_case, len(self.bytecode.code))
+
+        if node.else_case:
+            self.visit(node.else_case)
+        else:
+            self.bytecode.emit(LOAD_CONST, self.bytecode.add_constant(None))
+
+        for jump in end_jumps:
+            self.bytecode.patch(jump, len(self.bytecode.code))
+
+    def compile_while_node(self, node):
+        for invariant in node.invariants:
+            self.bytecode.emit(RESET_INVARIANT, self.bytecode.add_invariant(invariant))
+        loop_start = len(self.bytecode.code)
+        self.visit(node.condition_node)
+        exit_jump = self.bytecode.emit(POP_JUMP_IF_FALSE, 0, node.condition_node)
+        self.visit(node.body_node)
+        self.bytecode.emit(POP)
+        self.bytecode.emit(JUMP, loop_start)
+        self.bytecode.patch(exit_jump, len(self.bytecode.code))
+        self.bytecode.emit(LOAD_CONST, self.bytecode.add_constant(None))
+
+    def compile_invariant_node(self, node):
+        slot = self.bytecode.add_invariant(node)
+        self.bytecode.emit(LOAD_INVARIANT, slot, node)
+        self.visit(node.node)
+        self.bytecode.emit(STORE_INVARIANT, slot, node)
+        self.bytecode.invariant_ends[slot] = len(self.bytecode.code)
@@ -7,24 +7,16 @@ class Error:
 
     def point_to_error(self):
         result = ''
-        text = self.pos_start.txt
-        start_idx = max(text.rfind('\n', 0, self.pos_start.idx), 0)
-        end_idx = text.find('\n', start_idx + 1)
-        if end_idx < 0:
-            end_idx = len(text)
+        source = self.pos_start.source
+        first_line, last_line = self.pos_start.ln, self.pos_end.ln
 
-        for i in range(self.pos_end.ln - self.pos_start.ln + 1):
-            line = text[start_idx:end_idx]
-            start_col = self.pos_start.col if i == 0 else 0
-            end_col = self.pos_end.col if i == self.pos_end.ln - self.pos_start.ln else len(line) - 1
+        for ln in range(first_line, last_line + 1):
+            line = source.line(ln)
+            start_col = self.pos_start.col if ln == first_line else 0
+            end_col = self.pos_end.col if ln == last_line else len(line) - 1
 
             result += line + '\n' + (' ' * start_col + '^' * (end_col - start_col))
 
-            start_idx = end_idx
-            end_idx = text.find('\n', start_idx + 1)
-            if end_idx < 0:
-                end_idx = len(text)
-
         return result.replace('\t', '')
 
     def as_string(self):
@@ -80,3 +72,35 @@ class TooManyNestedError(Error):
 class StackOverFlowError(Error):
     def __init__(self, pos_start, pos_end, details):
         super().__init__(pos_start, pos_end, 'StackOverFlowError', details)
+
+
+class BudgetExceededError(Error):
+    def __init__(self, pos_start, pos_end, details):
+        super().__init__(pos_start, pos_end, 'BudgetExceededError', details)
+
+
+class ErrorRecord:
+    # A picklable stand-in for an Error, to send errors between processes. The runtime context can't
+    # travel, so the message is rendered, traceback included, before the record is made.
+    def __init__(self, error_type, pos_start, pos_end, *, error_name, details, text):
+        self.error_type = error_type
+        self.pos_start = pos_start
+        self.pos_end = pos_end
+        self.error_name = error_name
+        self.details = details
+        self.text = text
+
+    @classmethod
+    def from_error(cls, error):
+        return cls(type(error).__name__, error.pos_start, error.pos_end,
+                   error_name=error.error_name, details=error.details, text=error.as_string())
+
+    def as_string(self):
+        return self.text
+
+
+class Abort(Exception):
+    # Carries an Error out of compiled code, where returning (result, error) pairs isn't an option
+    def __init__(self, error):
+        super().__init__(error.details)
+        self.error = error
@@ -0,0 +1,233 @@
+import threading
+from weakref import WeakKeyDictionary
+
+from components.loop_invariants import children
+from components.number import Number
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT
+)
+
+HOT_LOOP_THRESHOLD = 1000  # iterations of one WhileNode, counted per interpreter, before it is specialized
+FILENAME = '<hot loop>'
+VARIABLE_PREFIX = 'v_'
+SNAPSHOT_PREFIX = 's_'
+
+ARITHMETIC = {PLUS: '+', MINUS: '-', MUL: '*', DIV: '/'}
+COMPARISONS = {EE: '==', NE: '!=', LT: '<', GT: '>', LTE: '<=', GTE: '>='}
+UNSET = object()
+
+
+class Deoptimize(Exception):
+    pass
+
+
+class Unspecializable(Exception):
+    pass
+
+
+def deoptimize():
+    raise Deoptimize
+
+
+class LoopSpecializer:
+    """Compiles a WhileNode into a Python function for one set of variable types, e.g. all ints.
+
+    The function takes the variables' values, runs the loop on plain Python numbers and returns
+    (finished, values of the assigned variables). Guards check every arithmetic result against the
+    interpreter's bounds and every assigned value against its variable's type; when one fails, or a
+    division by zero comes up, the function returns the values from the start of that iteration,
+    so the generic path can run it again and report exactly what it would have."""
+
+    def __init__(self, types, min_number, max_number):
+        self.types = types
+        self.min_number = min_number
+        self.max_number = max_number
+        self.invariants = {}
+
+    def compile(self, node, variables, assigned):
+        condition = self.test(node.condition_node)
+        body = self.statement(node.body_node, '            ')
+        snapshot = ''.join(f'{SNAPSHOT_PREFIX}{name} = {VARIABLE_PREFIX}{name}; ' for name in assigned)
+        source = (
+            f"def __loop({', '.join(VARIABLE_PREFIX + name for name in variables)}):\n"
+            f"    {''.join(f'{slot} = ' for slot in self.invariants.values())}__unset\n"
+            f"    try:\n"
+            f"        while True:\n"
+            f"            {snapshot}pass\n"
+            f"            if not {condition}: break\n"
+            f"{body}"
+            f"    except (__Deoptimize, ZeroDivisionError):\n"
+            f"        return False, ({''.join(SNAPSHOT_PREFIX + name + ', ' for name in assigned)})\n"
+            f"    return True, ({''.join(VARIABLE_PREFIX + name + ', ' for name in assigned)})\n"
+        )
+
+        namespace = {
+            '__Deoptimize': Deoptimize, '__deoptimize': deoptimize, '__unset': UNSET,
+            '__and': lambda left, right: int(left and right), '__or': lambda left, right: int(left or right),
+        }
+        exec(compile(source, FILENAME, 'exec'), namespace)  # pylint: disable=exec-used
+        return namespace['__loop']
+
+    def statement(self, node, indent):
+        # a loop's body is its only statement; a nested loop becomes a nested Python loop
+        if type(node).__name__ != 'WhileNode':
+            return f'{indent}{self.expr(node)[0]}\n'
+        resets = ''.join(f'{self.invariant_slot(invariant)} = ' for invariant in node.invariants)
+        return (
+            (f'{indent}{resets}__unset\n' if resets else '') +
+            f'{indent}while {self.test(node.condition_node)}:\n' +
+            self.statement(node.body_node, indent + '    ')
+        )
+
+    def test(self, node):
+        if type(node).__name__ == 'BinOpNode' and node.op_tok.type in COMPARISONS:
+            (left, _), (right, _) = self.operand(node.left_node), self.operand(node.right_node)
+            return f'({left} {COMPARISONS[node.op_tok.type]} {right})'
+        return f'({self.operand(node)[0]} != 0)'
+
+    def operand(self, node):
+        source, value_type = self.expr(node)
+        if value_type is None:
+            # e.g. an IF without ELSE: the generic path decides what a missing value does here
+            raise Unspecializable(f'{node} may not be a number')
+        return source, value_type
+
+    def expr(self, node):
+        # (Python source, int or float, or None when the type isn't known)
+        node_type_name = type(node).__name__
+
+        if node_type_name == 'NumberNode':
+            return repr(node.tok.value), type(node.tok.value)
+        if node_type_name == 'VarAccessNode':
+            return VARIABLE_PREFIX + node.var_name_tok.value, self.types[node.var_name_tok.value]
+        if node_type_name == 'VarAssignNode':
+            var_name = node.var_name_tok.value
+            var_type = self.types[var_name]
+            value, value_type = self.expr(node.value_node)
+            if value_type is not var_type:
+                value = f'(__t if type(__t := {value}) is {var_type.__name__} else __deoptimize())'
+            return f'({VARIABLE_PREFIX}{var_name} := {value})', var_type
+        if node_type_name == 'BinOpNode':
+            return self.binary(node)
+        if node_type_name == 'UnaryOpNode':
+            operand, value_type = self.operand(node.node)
+            if node.op_tok.type == MINUS:
+                return f'(-{operand})', value_type
+            if node.op_tok.matches(KEYWORD, 'NOT'):
+                return f'(1 if {operand} == 0 else 0)', int
+            return operand, value_type
+        if node_type_name == 'IfNode':
+            source, value_type = self.expr(node.else_case) if node.else_case else ('None', None)
+            for condition, expr in reversed(node.cases):
+                case, case_type = self.expr(expr)
+                source = f'({case} if {self.test(condition)} else {source})'
+                value_type = value_type if case_type is value_type else None
+            return source, value_type
+        if node_type_name == 'InvariantNode':
+            inner, value_type = self.expr(node.node)
+            slot = self.invariant_slot(node)
+            return f'({slot} if {slot} is not __unset else ({slot} := {inner}))', value_type
+        raise Unspecializable(f'{node_type_name} can only be the body of a loop')
+
+    def binary(self, node):
+        op_type = node.op_tok.type
+        (left, left_type), (right, right_type) = self.operand(node.left_node), self.operand(node.right_node)
+
+        if op_type in ARITHMETIC:
+            value_type = int if op_type != DIV and left_type is int and right_type is int else float
+            return (
+                f'(__t if {self.min_number} <= (__t := {left} {ARITHMETIC[op_type]} {right}) <= {self.max_number} '
+                f'else __deoptimize())'
+            ), value_type
+        if op_type in COMPARISONS:
+            return f'(1 if {left} {COMPARISONS[op_type]} {right} else 0)', int
+        # both operands are always evaluated, so AND/OR go through a call instead of Python's short-circuiting
+        if node.op_tok.matches(KEYWORD, 'AND'):
+            return f'__and({left}, {right})', int
+        if node.op_tok.matches(KEYWORD, 'OR'):
+            return f'__or({left}, {right})', int
+        raise Unspecializable(f'Unknown binary operator {node.op_tok}')
+
+    def invariant_slot(self, node):
+        if node not in self.invariants:
+            self.invariants[node] = f'__i{len(self.invariants)}'
+        return self.invariants[node]
+
+
+class HotLoop:
+    # What one WhileNode needs to be specialized: the variables it reads or assigns, and its
+    # compiled functions per (variable types, bounds), None for those it can't be compiled for
+    def __init__(self, node):
+        self.variables = {}
+        self.assigned = {}
+        pending = [node]
+        while pending:
+            current = pending.pop()
+            node_type_name = type(current).__name__
+            if node_type_name == 'VarAccessNode':
+                self.variables[current.var_name_tok.value] = True
+            elif node_type_name == 'VarAssignNode':
+                self.variables[current.var_name_tok.value] = True
+                self.assigned[current.var_name_tok.value] = True
+            pending.extend(children(current))
+        self.specializations = {}
+
+    def specialization(self, node, types, min_number, max_number):
+        key = (types, min_number, max_number)
+        if key not in self.specializations:
+            try:
+                function = LoopSpecializer(dict(zip(self.variables, types)), min_number, max_number).compile(
+                    node, list(self.variables), list(self.assigned)
+                )
+            except (Unspecializable, SyntaxError, RecursionError):
+                # SyntaxError and RecursionError: too deeply nested for Python's own compiler
+                function = None
+            self.specializations[key] = function
+        return self.specializations[key]
+
+
+hot_loops = WeakKeyDictionary()
+hot_loops_lock = threading.Lock()
+
+
+def run_hot_loop(node, context, min_number, max_number):
+    """Runs the rest of the WhileNode node specialized for the types its variables hold now.
+
+    Returns True once the loop has finished. False means it wasn't run, or a guard sent it back,
+    with the symbol table as it was at the start of the iteration that failed: either way the
+    generic path goes on from there."""
+    with hot_loops_lock:
+        loop = hot_loops.get(node)
+        if loop is None:
+            loop = hot_loops[node] = HotLoop(node)
+
+    symbol_table = context.symbol_table
+    values = []
+    for var_name in loop.variables:
+        number = symbol_table.get(var_name)
+        if number is None or type(number.value) not in (int, float):
+            return False
+        values.append(number.value)
+    if any(symbol_table.slot_of(var_name) is None for var_name in loop.assigned):
+        # assigning it would define a new name, which the generic path checks against the limit
+        return False
+
+    with hot_loops_lock:
+        function = loop.specialization(node, tuple(type(value) for value in values), min_number, max_number)
+    if function is None:
+        return False
+
+    finished, state = function(*values)
+    for var_name, value in zip(loop.assigned, state):
+        symbol_table.set(var_name, Number(value).set_context(context))
+    return finished
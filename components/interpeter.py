@@ -1,5 +1,7 @@
-from components.errors import RTError, TooManyVariablesError, StackOverFlowError
+from components.errors import Abort, RTError, TooManyVariablesError, StackOverFlowError
+from components.hot_loops import HOT_LOOP_THRESHOLD, run_hot_loop
 from components.number import Number
+from components.parser import node_methods
 from components.token_types import (
     GT,
     LTE,
@@ -16,24 +18,54 @@ from components.token_types import (
 from components.tokenizer import Position
 
 MAXIMUM_NUMBER_OF_VARIABLES = 3
+MAX_NUMBER = 2 ** 31 - 1
+MIN_NUMBER = -2 ** 31
+TOO_BIG = "Result is too big"
+TOO_SMALL = "Result is too small"
 
 
-class Interpreter:
-    MAX_NUMBER = 2 ** 31 - 1
-    MIN_NUMBER = -2 ** 31
+def variables_full(symbol_table):
+    # +2 because TRUE AND FALSE
+    return MAXIMUM_NUMBER_OF_VARIABLES + 2 <= len(symbol_table)
 
-    def __init__(self):
-        self.visit_methods = {
-            'NumberNode': self.visit_number_node,
-            'VarAccessNode': self.visit_var_access_node,
-            'VarAssignNode': self.visit_var_assign_node,
-            'BinOpNode': self.visit_bin_op_node,
-            'UnaryOpNode': self.visit_unary_op_node,
-            'IfNode': self.visit_if_node,
-            'WhileNode': self.visit_while_node,
-        }
+
+def too_many_variables(context):
+    return TooManyVariablesError(
+        Position(0, 0, 0, ''), Position(1, 0, 1, ''),
+        "Too Many Variables Assigned",
+        context=context
+    )
+
+
+def overflow_error(value, pos_start, pos_end):
+    return StackOverFlowError(pos_start, pos_end, TOO_BIG if value > MAX_NUMBER else TOO_SMALL)
+
+
+class Interpreter:
+    MAX_NUMBER = MAX_NUMBER
+    MIN_NUMBER = MIN_NUMBER
+
+    def __init__(self, profile=None):
+        self.visit_methods = node_methods(self, 'visit')
+        self.invariant_values = {}
+        self.loop_iterations = {}
+        # a profile counts every node visited, which a specialized loop doesn't visit
+        self.specialize_loops = profile is None
+        if profile is not None:
+            # wraps visit on this instance only, unprofiled interpreters keep the plain method
+            profile.attach(self)
+
+    def run(self, node, context):
+        res = RTResult()
+        try:
+            value = self.visit(node, context)
+        except Abort as abort:
+            return res.failure(abort.error)
+        return res.success(value)
 
     def visit(self, node, context):
+        # Returns the node's Number, or None, and raises Abort with the error that stops the program:
+        # only run wraps the outcome in an RTResult, so nodes that succeed check nothing on the way up
         node_type_name = type(node).__name__
         method = self.visit_methods.get(node_type_name, self.no_visit_method)
         return method(node, context)
@@ -43,60 +75,41 @@ class Interpreter:
 
     @staticmethod
     def visit_number_node(node, context):
-        return RTResult().success(
-            Number(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-        )
+        return Number(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
 
     @staticmethod
     def visit_var_access_node(node, context):
-        res = RTResult()
         var_name = node.var_name_tok.value
         value = context.symbol_table.get(var_name)
 
         if not value:
-            return res.failure(RTError(
+            raise Abort(RTError(
                 node.pos_start, node.pos_end,
                 f"'{var_name}' is not defined",
                 context
             ))
 
-        value = value.copy().set_pos(node.pos_start, node.pos_end)
-        return res.success(value)
+        return value.copy().set_pos(node.pos_start, node.pos_end)
 
     def visit_var_assign_node(self, node, context):
-        res = RTResult()
         var_name = node.var_name_tok.value
-        value = res.register(self.visit(node.value_node, context))
-        if res.error:
-            return res
-
-        if MAXIMUM_NUMBER_OF_VARIABLES + 2 <= len(context.symbol_table):
-            # +2 because TRUE AND FALSE
-            return res.failure(TooManyVariablesError(
-                Position(0, 0, 0, ''), Position(1, 0, 1, ''),
-                "Too Many Variables Assigned",
-                context=context
-            ))
+        value = self.visit(node.value_node, context)
+
+        if variables_full(context.symbol_table):
+            raise Abort(too_many_variables(context))
         context.symbol_table.set(var_name, value)
-        return res.success(value)
+        return value
 
     @classmethod
     def __limit_result(cls, result: Number):
         error = None
-        if result.value > cls.MAX_NUMBER:
-            error = StackOverFlowError(result.pos_start, result.pos_end, "Result is too big")
-        elif result.value < cls.MIN_NUMBER:
-            error = StackOverFlowError(result.pos_start, result.pos_end, "Result is too small")
+        if result.value > cls.MAX_NUMBER or result.value < cls.MIN_NUMBER:
+            error = overflow_error(result.value, result.pos_start, result.pos_end)
         return result, error
 
     def visit_bin_op_node(self, node, context):
-        res = RTResult()
-        left = res.register(self.visit(node.left_node, context))
-        if res.error:
-            return res
-        right = res.register(self.visit(node.right_node, context))
-        if res.error:
-            return res
+        left = self.visit(node.left_node, context)
+        right = self.visit(node.right_node, context)
 
         operations = {
             PLUS: left.added_to,
@@ -114,7 +127,7 @@ class Interpreter:
         if node.op_tok.type in operations:
             result, error = operations[node.op_tok.type](right)
             if not error:
-                result, error = self.__limit_result(result)
+                result, error = self.__limit_result(result.set_pos(node.pos_start, node.pos_end))
         elif node.op_tok.matches(KEYWORD, 'AND'):
             result, error = left.anded_by(right)
         elif node.op_tok.matches(KEYWORD, 'OR'):
@@ -124,64 +137,56 @@ class Interpreter:
             result = None
 
         if error:
-            return res.failure(error)
-        return res.success(result.set_pos(node.pos_start, node.pos_end))  # 3+5=>8
+            raise Abort(error)
+        return result.set_pos(node.pos_start, node.pos_end)  # 3+5=>8
 
     def visit_unary_op_node(self, node, context):
-        res = RTResult()
-        number = res.register(self.visit(node.node, context))
-        if res.error:
-            return res
-
+        number = self.visit(node.node, context)
         error = None
 
         if node.op_tok.type == MINUS:
-            number, error = number.multed_by(Number(-1))
+            number, error = number.negated()
         elif node.op_tok.matches(KEYWORD, 'NOT'):
             number, error = number.notted()
 
         if error:
-            return res.failure(error)
-        return res.success(number.set_pos(node.pos_start, node.pos_end))
+            raise Abort(error)
+        return number.set_pos(node.pos_start, node.pos_end)
 
     def visit_if_node(self, node, context):
-        res = RTResult()
-
         for condition, expr in node.cases:
-            condition_value = res.register(self.visit(condition, context))
-            if res.error:
-                return res
-
-            if condition_value.is_true():
-                expr_value = res.register(self.visit(expr, context))
-                if res.error:
-                    return res
-                return res.success(expr_value)
+            if self.visit(condition, context).is_true():
+                return self.visit(expr, context)
 
         if node.else_case:
-            else_value = res.register(self.visit(node.else_case, context))
-            if res.error:
-                return res
-            return res.success(else_value)
-
-        return res.success(None)
+            return self.visit(node.else_case, context)
+        return None
 
     def visit_while_node(self, node, context):
-        res = RTResult()
-
-        while True:
-            condition = res.register(self.visit(node.condition_node, context))
-            if res.error:
-                return res
-
-            if not condition.is_true():
+        for invariant in node.invariants:
+            self.invariant_values.pop(invariant, None)
+
+        # Once a loop has run HOT_LOOP_THRESHOLD iterations in this interpreter, the rest of it runs
+        # specialized for the types its variables hold, until a guard hands it back to this generic loop
+        previous = self.loop_iterations.get(node, 0)
+        hot_at = max(1, HOT_LOOP_THRESHOLD - previous) if self.specialize_loops else -1
+        iterations = 0
+        while self.visit(node.condition_node, context).is_true():
+            self.visit(node.body_node, context)
+            iterations += 1
+
+            if iterations == hot_at and not variables_full(context.symbol_table) and \
+                    run_hot_loop(node, context, self.MIN_NUMBER, self.MAX_NUMBER):
                 break
 
-            res.register(self.visit(node.body_node, context))
-            if res.error:
-                return res
+        self.loop_iterations[node] = previous + iterations
+
+    def visit_invariant_node(self, node, context):
+        if node not in self.invariant_values:
+            self.invariant_values[node] = self.visit(node.node, context)
 
-        return res.success(None)
+        value = self.invariant_values[node]
+        return value.copy() if value is not None else None
 
 
 class RTResult:
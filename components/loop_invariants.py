@@ -0,0 +1,115 @@
+from components.parser import Node, BinOpNode, UnaryOpNode, VarAssignNode, IfNode, WhileNode
+
+HOISTABLE = ('BinOpNode', 'UnaryOpNode', 'IfNode')
+
+
+class InvariantNode(Node):
+    # A subexpression of a loop whose value can't change while the loop runs. It is evaluated the
+    # first time the loop reaches it, and that value is reused until the owning WhileNode starts again.
+    FIRST = LAST = 'node'
+
+    def __init__(self, node):
+        self.node = node
+
+    def __repr__(self):
+        return f'[{self.node}]'
+
+
+class LoopInvariantHoister:
+    def __init__(self):
+        self.variables = {}
+        self.pure = {}
+
+    def hoist(self, node):
+        node_type_name = type(node).__name__
+        if node_type_name == 'WhileNode':
+            return self.hoist_while_node(node)
+        return self.rebuild(node, self.hoist)
+
+    def hoist_while_node(self, node):
+        assigned = self.assigned_in(node)
+        invariants = []
+
+        def rewrite(child):
+            if self.is_invariant(child, assigned):
+                invariant = InvariantNode(child)
+                invariants.append(invariant)
+                return invariant
+            if isinstance(child, WhileNode):
+                # outer invariants inside a nested loop are already replaced, now its own ones
+                return self.hoist_while_node(WhileNode(rewrite(child.condition_node), rewrite(child.body_node)))
+            return self.rebuild(child, rewrite)
+
+        condition_node = rewrite(node.condition_node)
+        body_node = rewrite(node.body_node)
+        if not invariants:
+            return WhileNode(condition_node, body_node) if condition_node is not node.condition_node or \
+                body_node is not node.body_node else node
+        return WhileNode(condition_node, body_node, tuple(invariants))
+
+    @staticmethod
+    def rebuild(node, transform):
+        if isinstance(node, VarAssignNode):
+            value_node = transform(node.value_node)
+            return node if value_node is node.value_node else VarAssignNode(node.var_name_tok, value_node)
+        if isinstance(node, BinOpNode):
+            left, right = transform(node.left_node), transform(node.right_node)
+            if left is node.left_node and right is node.right_node:
+                return node
+            return BinOpNode(left, node.op_tok, right)
+        if isinstance(node, UnaryOpNode):
+            operand = transform(node.node)
+            return node if operand is node.node else UnaryOpNode(node.op_tok, operand)
+        if isinstance(node, IfNode):
+            return IfNode(
+                [(transform(condition), transform(expr)) for condition, expr in node.cases],
+                transform(node.else_case) if node.else_case else None
+            )
+        if isinstance(node, WhileNode):
+            return WhileNode(transform(node.condition_node), transform(node.body_node), node.invariants)
+        return node
+
+    def is_invariant(self, node, assigned):
+        return type(node).__name__ in HOISTABLE and self.is_pure(node) and not self.variables_of(node) & assigned
+
+    def is_pure(self, node):
+        key = id(node)
+        if key not in self.pure:
+            self.pure[key] = type(node).__name__ not in ('VarAssignNode', 'WhileNode') and \
+                all(self.is_pure(child) for child in children(node))
+        return self.pure[key]
+
+    def variables_of(self, node):
+        key = id(node)
+        if key not in self.variables:
+            if type(node).__name__ == 'VarAccessNode':
+                self.variables[key] = frozenset((node.var_name_tok.value,))
+            else:
+                self.variables[key] = frozenset().union(*(self.variables_of(child) for child in children(node)))
+        return self.variables[key]
+
+    def assigned_in(self, node):
+        assigned = set()
+        pending = [node]
+        while pending:
+            current = pending.pop()
+            if type(current).__name__ == 'VarAssignNode':
+                assigned.add(current.var_name_tok.value)
+            pending.extend(children(current))
+        return assigned
+
+
+def children(node):
+    node_type_name = type(node).__name__
+    if node_type_name == 'BinOpNode':
+        return [node.left_node, node.right_node]
+    if node_type_name in {'UnaryOpNode', 'InvariantNode'}:
+        return [node.node]
+    if node_type_name == 'VarAssignNode':
+        return [node.value_node]
+    if node_type_name == 'IfNode':
+        cases = [child for case in node.cases for child in case]
+        return cases + [node.else_case] if node.else_case else cases
+    if node_type_name == 'WhileNode':
+        return [node.condition_node, node.body_node]
+    return []
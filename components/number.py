@@ -1,13 +1,26 @@
 from components.errors import RTError
 
 
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 256
+
+
 class Number:
+    __slots__ = ('value', 'context', 'pos_start', 'pos_end')
+
     def __init__(self, value):
         self.context = None
         self.pos_end = None
         self.pos_start = None
         self.value = value
 
+    @staticmethod
+    def box(value):
+        # Shared instances for the values programs produce most, like the 0/1 of comparisons
+        if isinstance(value, int) and SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+            return SMALL_INTS[value - SMALL_INT_MIN]
+        return Number(value)
+
     def set_pos(self, pos_start=None, pos_end=None):
         self.pos_start = pos_start
         self.pos_end = pos_end
@@ -84,6 +97,9 @@ class Number:
             return Number(int(self.value or other.value)).set_context(self.context), None
         return None
 
+    def negated(self):
+        return Number(-self.value).set_context(self.context), None
+
     def notted(self):
         return Number(1 if self.value == 0 else 0).set_context(self.context), None
 
@@ -98,3 +114,27 @@ class Number:
 
     def __repr__(self):
         return str(self.value)
+
+
+class InternedNumber(Number):
+    # Shared, so it is never changed in place: attaching a position or context gives a fresh Number
+    __slots__ = ()
+
+    def set_pos(self, pos_start=None, pos_end=None):
+        if pos_start is None and pos_end is None:
+            return self
+        return Number(self.value).set_pos(pos_start, pos_end)
+
+    def set_context(self, context=None):
+        if context is None:
+            return self
+        return Number(self.value).set_context(context)
+
+    def __reduce__(self):
+        # unpickles to the shared instance again
+        return Number.box, (self.value,)
+
+
+SMALL_INTS = tuple(InternedNumber(value) for value in range(SMALL_INT_MIN, SMALL_INT_MAX + 1))
+Number.FALSE = SMALL_INTS[0 - SMALL_INT_MIN]
+Number.TRUE = SMALL_INTS[1 - SMALL_INT_MIN]
@@ -0,0 +1,180 @@
+from components.interpeter import MAX_NUMBER, MIN_NUMBER
+from components.loop_invariants import LoopInvariantHoister
+from components.parser import NumberNode, BinOpNode, UnaryOpNode, VarAssignNode, IfNode, WhileNode
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    INT,
+    FLOAT,
+    LT
+)
+from components.tokenizer import Token
+
+FOLDABLE = {
+    PLUS: lambda left, right: left + right,
+    MINUS: lambda left, right: left - right,
+    MUL: lambda left, right: left * right,
+    DIV: lambda left, right: left / right,
+    EE: lambda left, right: int(left == right),
+    NE: lambda left, right: int(left != right),
+    LT: lambda left, right: int(left < right),
+    GT: lambda left, right: int(left > right),
+    LTE: lambda left, right: int(left <= right),
+    GTE: lambda left, right: int(left >= right),
+}
+LIMITED = (PLUS, MINUS, MUL, DIV)
+COMPARISONS = (EE, NE, LT, GT, LTE, GTE)
+
+
+def is_constant(node):
+    return isinstance(node, NumberNode)
+
+
+def is_boolean(node):
+    # Nodes that can only evaluate to 0 or 1
+    if isinstance(node, BinOpNode):
+        return node.op_tok.type in COMPARISONS or node.op_tok.type == KEYWORD
+    if isinstance(node, UnaryOpNode):
+        return node.op_tok.matches(KEYWORD, 'NOT')
+    return is_constant(node) and node.tok.value in {0, 1}
+
+
+def is_identity(node, value):
+    return is_constant(node) and node.tok.value == value and not isinstance(node.tok.value, float)
+
+
+def in_range(node):
+    # Dropping a checked +0 or *1 is only safe when the kept operand can't overflow on its own
+    if is_constant(node):
+        return MIN_NUMBER <= node.tok.value <= MAX_NUMBER
+    if isinstance(node, BinOpNode):
+        return node.op_tok.type in LIMITED or node.op_tok.type in COMPARISONS
+    if isinstance(node, UnaryOpNode):
+        return node.op_tok.matches(KEYWORD, 'NOT')
+    return False
+
+
+class Optimizer:
+    """Rewrites an AST into a cheaper equivalent one: constant folding, algebraic identities and
+    pruning of IF branches with constant conditions. Input nodes are never mutated, since parsed
+    trees are shared through the parse cache. Constant expressions that would overflow or divide
+    by zero are left as they are, so they still fail at run time with the usual error."""
+
+    def __init__(self):
+        self.optimize_methods = {
+            'VarAssignNode': self.optimize_var_assign_node,
+            'BinOpNode': self.optimize_bin_op_node,
+            'UnaryOpNode': self.optimize_unary_op_node,
+            'IfNode': self.optimize_if_node,
+            'WhileNode': self.optimize_while_node,
+        }
+
+    def optimize(self, node):
+        method = self.optimize_methods.get(type(node).__name__)
+        return method(node) if method else node
+
+    @staticmethod
+    def constant(value, node):
+        return NumberNode(Token(INT if isinstance(value, int) else FLOAT, value, node.pos_start, node.pos_end))
+
+    def optimize_var_assign_node(self, node):
+        value_node = self.optimize(node.value_node)
+        if value_node is node.value_node:
+            return node
+        return VarAssignNode(node.var_name_tok, value_node)
+
+    def optimize_bin_op_node(self, node):
+        left = self.optimize(node.left_node)
+        right = self.optimize(node.right_node)
+        op_type = node.op_tok.type
+
+        if is_constant(left) and is_constant(right):
+            folded = self.fold(node, left.tok.value, right.tok.value)
+            if folded is not None:
+                return folded
+
+        if op_type in (PLUS, MINUS, MUL):
+            identity = 1 if op_type == MUL else 0
+            if is_identity(right, identity) and in_range(left):
+                return left
+            if op_type != MINUS and is_identity(left, identity) and in_range(right):
+                return right
+
+        if left is node.left_node and right is node.right_node:
+            return node
+        return BinOpNode(left, node.op_tok, right)
+
+    def fold(self, node, left, right):
+        op_type = node.op_tok.type
+        if op_type in FOLDABLE:
+            if op_type == DIV and right == 0:
+                return None
+            value = FOLDABLE[op_type](left, right)
+            if op_type in LIMITED and not MIN_NUMBER <= value <= MAX_NUMBER:
+                return None
+        elif node.op_tok.matches(KEYWORD, 'AND'):
+            value = int(left and right)
+        elif node.op_tok.matches(KEYWORD, 'OR'):
+            value = int(left or right)
+        else:
+            return None
+        return self.constant(value, node)
+
+    def optimize_unary_op_node(self, node):
+        operand = self.optimize(node.node)
+
+        if node.op_tok.type == PLUS:
+            return operand
+        if node.op_tok.type == MINUS and is_constant(operand):
+            return self.constant(-operand.tok.value, node)
+        if node.op_tok.matches(KEYWORD, 'NOT'):
+            if is_constant(operand):
+                return self.constant(1 if operand.tok.value == 0 else 0, node)
+            # NOT NOT e is e only when e is already 0 or 1
+            if isinstance(operand, UnaryOpNode) and operand.op_tok.matches(KEYWORD, 'NOT') and is_boolean(operand.node):
+                return operand.node
+
+        if operand is node.node:
+            return node
+        return UnaryOpNode(node.op_tok, operand)
+
+    def optimize_if_node(self, node):
+        cases = []
+        else_case = node.else_case
+
+        for condition, expr in node.cases:
+            condition = self.optimize(condition)
+            if is_constant(condition):
+                if condition.tok.value == 0:
+                    continue
+                # an always-true condition ends the chain: its expression is the else branch now
+                else_case = expr
+                break
+            cases.append((condition, self.optimize(expr)))
+        else_case = self.optimize(else_case) if else_case else None
+
+        if not cases:
+            if else_case:
+                return else_case
+            # nothing can run, but the node must still evaluate to no value
+            return node
+        return IfNode(cases, else_case)
+
+    def optimize_while_node(self, node):
+        condition_node = self.optimize(node.condition_node)
+        body_node = self.optimize(node.body_node)
+        if condition_node is node.condition_node and body_node is node.body_node:
+            return node
+        return WhileNode(condition_node, body_node, node.invariants)
+
+
+def optimize_ast(node):
+    return LoopInvariantHoister().hoist(Optimizer().optimize(node))
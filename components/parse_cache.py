@@ -0,0 +1,185 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from components.compact import CompactTree, FORMAT_VERSION
+from components.tokenizer import Source
+
+DEFAULT_CAPACITY = 1024
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# a cache file: the digest of the source it was parsed from, a CRC-32 of the rest, then the tree
+ENTRY_HEADER = struct.Struct('<32sI')
+
+
+class ParseCache:
+    """LRU cache from source text to its parse outcome, an (ast, error) pair.
+
+    Failed parses are cached too, so resubmitting a broken program doesn't lex it again.
+    The byte limit is accounted in source bytes, which grows with the size of the AST.
+    One cache can be shared by many threads: every operation holds the cache's lock.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_bytes=DEFAULT_MAX_BYTES):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, text):
+        return text in self.entries
+
+    def get(self, text):
+        with self.lock:
+            entry = self.entries.get(text)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(text)
+            self.hits += 1
+            return entry
+
+    def put(self, text, node, error):
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes or self.capacity <= 0:
+            return
+
+        with self.lock:
+            if text in self.entries:
+                self.bytes -= size
+                del self.entries[text]
+
+            self.entries[text] = (node, error)
+            self.bytes += size
+            while len(self.entries) > self.capacity or self.bytes > self.max_bytes:
+                old_text, _ = self.entries.popitem(last=False)
+                self.bytes -= len(old_text.encode('utf-8'))
+                self.evictions += 1
+
+    def clear(self):
+        # drops every entry and starts the hit/miss/eviction counters over
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def source_digest(text):
+    # the key of a source text: its SHA-256 together with the version of the serialized trees, so
+    # an interpreter that builds other trees never reads the files of an older one
+    return hashlib.sha256(f'{FORMAT_VERSION}:'.encode('ascii') + text.encode('utf-8')).digest()
+
+
+class DiskCache:
+    """ParseCache's get and put over a directory of serialized trees, one file per source text
+    named after source_digest, so parses outlive the process: a restarted worker reads a script's
+    tree back as a CompactTree instead of lexing and parsing it again.
+
+    Files are checked against the digest and CRC-32 they were written with, and a corrupt, truncated
+    or stale one is deleted and counted as rebuilt, so the next put writes it afresh. Only successful
+    parses are written, and a tree CompactTree can't hold, e.g. with an int constant beyond 64 bits,
+    is only kept in memory. Trees loaded or put once stay in memory, an LRU ParseCache of their own."""
+
+    def __init__(self, directory, memory=None):
+        self.directory = directory
+        self.memory = ParseCache() if memory is None else memory
+        self.loads = 0
+        self.writes = 0
+        self.rebuilt = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, text):
+        return os.path.join(self.directory, source_digest(text).hex() + '.tree')
+
+    def get(self, text):
+        entry = self.memory.get(text)
+        if entry is not None:
+            return entry
+        node = self.load(text)
+        if node is None:
+            return None
+        self.memory.put(text, node, None)
+        return node, None
+
+    def load(self, text):
+        path = self.path(text)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            if len(data) < ENTRY_HEADER.size:
+                raise ValueError('Truncated cache entry')
+            digest, checksum = ENTRY_HEADER.unpack_from(data)
+            payload = memoryview(data)[ENTRY_HEADER.size:]
+            if digest != source_digest(text) or checksum != zlib.crc32(payload):
+                raise ValueError('Corrupt or stale cache entry')
+            node = CompactTree.from_bytes(payload, Source(text)).to_node()
+        except (ValueError, IndexError, StopIteration):
+            with self.lock:
+                self.rebuilt += 1
+            remove(path)
+            return None
+
+        with self.lock:
+            self.loads += 1
+        return node
+
+    def put(self, text, node, error):
+        self.memory.put(text, node, error)
+        if error is not None:
+            return
+        try:
+            payload = CompactTree.from_node(node).to_bytes()
+        except (ValueError, OverflowError):
+            return
+
+        # written under a temporary name and renamed into place, so a reader never sees half a file
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                entry.write(ENTRY_HEADER.pack(source_digest(text), zlib.crc32(payload)))
+                entry.write(payload)
+            os.replace(temporary, self.path(text))
+        except OSError:
+            remove(temporary)
+            return
+        with self.lock:
+            self.writes += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.memory.stats(), loads=self.loads, writes=self.writes, rebuilt=self.rebuilt)
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,3 +1,5 @@
+from functools import cached_property, lru_cache
+
 from components.token_types import (
     GT,
     LTE,
@@ -11,6 +13,7 @@ from components.token_types import (
     LPAREN,
     RPAREN,
     EOF,
+    NEWLINE,
     KEYWORD,
     IDENTIFIER,
     EQ,
@@ -18,363 +21,343 @@ from components.token_types import (
     FLOAT,
     LT
 )
-from components.errors import InvalidSyntaxError
+from components.errors import Abort, InvalidSyntaxError
+
+# how tightly each binary operator binds, AND and OR being the loosest; 0 ends an expression
+BINDING_POWERS = {EE: 2, NE: 2, LT: 2, GT: 2, LTE: 2, GTE: 2, PLUS: 3, MINUS: 3, MUL: 4, DIV: 4}
+LOGIC_KEYWORDS = frozenset(('AND', 'OR'))
+LOGIC_POWER = 1
+PREFIX_POWER = 5
+NUMBER_TYPES = frozenset((INT, FLOAT))
+SIGNS = frozenset((PLUS, MINUS))
+
+# what an operand may start with where it starts: a whole expr, a compare_expr or a factor
+EXPR, COMPARE, FACTOR = 'expr', 'compare_expr', 'factor'
+EXPECTED = {
+    EXPR: "Expected 'VAR', int, float, identifier, '+', '-', '(' or 'NOT'",
+    COMPARE: "Expected int, float, identifier, '+', '-', '(' or 'NOT'",
+    FACTOR: "Expected int, float, identifier, '+', '-', '('",
+}
+
+# frames waiting for an operand: the first three are complete once it has been parsed, the others
+# go on with the tokens after it
+BINARY, PREFIX, ASSIGN = 'binary', 'prefix', 'assign'
+GROUP, IF_CONDITION, IF_CASE, IF_ELSE, WHILE_CONDITION, WHILE_BODY = \
+    'group', 'if_condition', 'if_case', 'if_else', 'while_condition', 'while_body'
+REDUCIBLE = frozenset((BINARY, PREFIX, ASSIGN))
+
+
+def binding_power(tok):
+    if tok.type == KEYWORD:
+        return LOGIC_POWER if tok.value in LOGIC_KEYWORDS else 0
+    return BINDING_POWERS.get(tok.type, 0)
 
 
 class Parser:
+    # Expressions are parsed by precedence climbing driven by BINDING_POWERS, on an explicit stack of
+    # frames instead of one call per grammar level: each frame is an operator or construct waiting for
+    # the operand being parsed, as (kind, binding power, *parts). Nesting depth is bounded by memory,
+    # not by the recursion limit. A syntax error is raised as Abort and only turned into a ParseResult
+    # by parse and parse_program, so the success path builds no result objects.
     def __init__(self, tokens):
+        # tokens can be any iterable ending with EOF, e.g. a lexer's token generator: the parser only
+        # looks one token ahead, so it pulls them one by one and never needs the whole list
         self.current_tok = None
-        self.tokens = tokens
+        self.tokens = iter(tokens)
         self.tok_idx = -1
         self.advance()
 
     def advance(self):
         self.tok_idx += 1
-        if self.tok_idx < len(self.tokens):
-            self.current_tok = self.tokens[self.tok_idx]
+        self.current_tok = next(self.tokens, self.current_tok)
         return self.current_tok
 
     def parse(self):
-        res = self.expr()
-        if not res.error and self.current_tok.type != EOF:
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected '+', '-', '*', '/', '^', '==', '!=', '<', '>', <=', '>=', 'AND' or 'OR'"
-            ))
-        return res
-
-    def if_expr(self):
         res = ParseResult()
-        cases = []
-        else_case = None
-
-        def parse_branch(keyword):
-            """Parses a single if/elif branch and returns a tuple of (condition, expression) or None on failure."""
-            if not self.current_tok.matches(KEYWORD, keyword):
-                error_msg = f"Expected '{keyword}'"
-                return res.failure(InvalidSyntaxError(
-                    self.current_tok.pos_start, self.current_tok.pos_end, error_msg
-                )), None
-
-            res.register_advancement()
-            self.advance()
-
-            condition = res.register(self.expr())
-            if res.error:
-                return res, None
-
-            if not self.current_tok.matches(KEYWORD, 'THEN'):
-                return res.failure(InvalidSyntaxError(
-                    self.current_tok.pos_start, self.current_tok.pos_end, "Expected 'THEN'"
-                )), None
-
-            res.register_advancement()
-            self.advance()
-
-            expr = res.register(self.expr())
-            if res.error:
-                return res, None
-
-            return res, (condition, expr)
-
-        # Parse the initial if condition
-        initial_res, initial_case = parse_branch('IF')
-        if initial_res.error:
-            return initial_res
-        cases.append(initial_case)
-
-        # Parse any elif conditions
-        while self.current_tok.matches(KEYWORD, 'ELIF'):
-            elif_res, elif_case = parse_branch('ELIF')
-            if elif_res.error:
-                return elif_res
-            cases.append(elif_case)
-
-        # Parse else case
-        if self.current_tok.matches(KEYWORD, 'ELSE'):
-            res.register_advancement()
-            self.advance()
-
-            else_case = res.register(self.expr())
-            if res.error:
-                return res
-
-        return res.success(IfNode(cases, else_case))
+        try:
+            node = self.expr()
+            if self.current_tok.type != EOF:
+                self.fail("Expected '+', '-', '*', '/', '^', '==', '!=', '<', '>', <=', '>=', 'AND' or 'OR'")
+        except Abort as abort:
+            return res.failure(abort.error)
+        return res.success(node)
 
-    def while_expr(self):
+    def parse_program(self):
+        # statements separated by NEWLINE tokens; the node is the list of statement nodes
         res = ParseResult()
-
-        def advance_and_register():
-            res.register_advancement()
+        statements = []
+        try:
+            self.skip_newlines()
+            while self.current_tok.type != EOF:
+                statements.append(self.expr())
+                if self.current_tok.type not in {NEWLINE, EOF}:
+                    self.fail("Expected ';', newline, '+', '-', '*', '/', '==', '!=', '<', '>', <=', '>=', 'AND' or 'OR'")
+                self.skip_newlines()
+        except Abort as abort:
+            return res.failure(abort.error)
+        return res.success(statements)
+
+    def fail(self, details):
+        # a syntax error at the current token
+        raise Abort(InvalidSyntaxError(self.current_tok.pos_start, self.current_tok.pos_end, details))
+
+    def skip_newlines(self):
+        while self.current_tok.type == NEWLINE:
             self.advance()
 
-        if not self.current_tok.matches(KEYWORD, 'WHILE'):
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected 'WHILE'"
-            ))
-
-        advance_and_register()
-        condition = res.register(self.expr())
-        if res.error:
-            return res
-
-        if not self.current_tok.matches(KEYWORD, 'THEN'):
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected 'THEN'"
-            ))
-
-        advance_and_register()
-        body = res.register(self.expr())
-        if res.error:
-            return res
-
-        return res.success(WhileNode(condition, body))
-
-    def atom(self):
-        res = ParseResult()
+    def expr(self):
+        frames = []
+        start = EXPR
+        while True:
+            node = self.operand(frames, start)
+            if node is None:
+                start = self.opened(frames)
+                continue
+
+            node, start = self.operator(frames, node)
+            if start is None:
+                return node
+
+    @staticmethod
+    def opened(frames):
+        # where the operand of the frame just pushed starts
+        kind, power = frames[-1][:2]
+        if kind == PREFIX:
+            return COMPARE if power == LOGIC_POWER else FACTOR
+        return EXPR
+
+    def operand(self, frames, start):
+        # parses an operand that is a single token and returns its node, or pushes the frame of one
+        # that has parts of its own and returns None
         tok = self.current_tok
 
-        if tok.type in (INT, FLOAT):
-            res.register_advancement()
+        if tok.type in NUMBER_TYPES:
             self.advance()
-            return res.success(NumberNode(tok))
-
+            return NumberNode(tok)
         if tok.type == IDENTIFIER:
-            res.register_advancement()
             self.advance()
-            return res.success(VarAccessNode(tok))
+            return VarAccessNode(tok)
 
-        if tok.type == LPAREN:
-            res.register_advancement()
+        if tok.type in SIGNS:
+            frames.append((PREFIX, PREFIX_POWER, tok))
+        elif start != FACTOR and tok.matches(KEYWORD, 'NOT'):
+            frames.append((PREFIX, LOGIC_POWER, tok))
+        elif start == EXPR and tok.matches(KEYWORD, 'VAR'):
             self.advance()
-            expr = res.register(self.expr())
-            if res.error:
-                return res
-            if self.current_tok.type == RPAREN:
-                res.register_advancement()
-                self.advance()
-                return res.success(expr)
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected ')'"
-            ))
-
-        if tok.matches(KEYWORD, 'IF'):
-            if_expr = res.register(self.if_expr())
-            if res.error:
-                return res
-            return res.success(if_expr)
-
-        if tok.matches(KEYWORD, 'WHILE'):
-            while_expr = res.register(self.while_expr())
-            if res.error:
-                return res
-            return res.success(while_expr)
-
-        return res.failure(InvalidSyntaxError(
-            tok.pos_start, tok.pos_end,
-            "Expected int, float, identifier, '+', '-', '('"
-        ))
-
-    def factor(self):
-        res = ParseResult()
-        tok = self.current_tok
-
-        if tok.type in (PLUS, MINUS):
-            res.register_advancement()
+            if self.current_tok.type != IDENTIFIER:
+                self.fail("Expected identifier")
+            var_name = self.current_tok
             self.advance()
-            factor = res.register(self.factor())
-            if res.error:
-                return res
-            return res.success(UnaryOpNode(tok, factor))
-
-        return self.bin_op(self.atom, (), self.factor)
-
-    def term(self):
-        return self.bin_op(self.factor, (MUL, DIV))
-
-    def arith_expr(self):
-        return self.bin_op(self.term, (PLUS, MINUS))
+            if self.current_tok.type != EQ:
+                self.fail("Expected '='")
+            frames.append((ASSIGN, 0, var_name))
+        elif tok.type == LPAREN:
+            frames.append((GROUP, 0))
+        elif tok.matches(KEYWORD, 'IF'):
+            frames.append((IF_CONDITION, 0, []))
+        elif tok.matches(KEYWORD, 'WHILE'):
+            frames.append((WHILE_CONDITION, 0))
+        else:
+            self.fail(EXPECTED[start])
 
-    def compare_expr(self):
-        res = ParseResult()
+        self.advance()
+        return None
+
+    def operator(self, frames, node):
+        # Folds node into the frames it completes and goes on after it. Returns the node and where
+        # the next operand starts, or None for the start once the expression is over.
+        while True:
+            tok = self.current_tok
+            power = binding_power(tok)
+            frame = frames[-1] if frames else None
+
+            if frame is not None and frame[0] in REDUCIBLE and frame[1] >= power:
+                frames.pop()
+                if frame[0] == BINARY:
+                    node = BinOpNode(frame[2], frame[3], node)
+                elif frame[0] == PREFIX:
+                    node = UnaryOpNode(frame[2], node)
+                else:
+                    node = VarAssignNode(frame[2], node)
+                continue
+
+            if power:
+                frames.append((BINARY, power, node, tok))
+                self.advance()
+                return None, COMPARE if power == LOGIC_POWER else FACTOR
+            if frame is None:
+                return node, None
+
+            node, start = self.close(frames, node)
+            if start is not None:
+                return node, start
+
+    def close(self, frames, node):
+        # node ends a part of the construct in frames[-1]: returns the construct's node if that
+        # was its last part, or where the next part starts
+        kind = frames[-1][0]
+        tok = self.current_tok
 
-        if self.current_tok.matches(KEYWORD, 'NOT'):
-            op_tok = self.current_tok
-            res.register_advancement()
+        if kind == GROUP:
+            if tok.type != RPAREN:
+                self.fail("Expected ')'")
+            frames.pop()
             self.advance()
+            return node, None
 
-            node = res.register(self.compare_expr())
-            if res.error:
-                return res
-            return res.success(UnaryOpNode(op_tok, node))
-
-        node = res.register(self.bin_op(self.arith_expr, (EE, NE, LT, GT, LTE, GTE)))
-
-        if res.error:
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected int, float, identifier, '+', '-', '(' or 'NOT'"
-            ))
-
-        return res.success(node)
-
-    def expr(self):
-        res = ParseResult()
-
-        def advance_with_registration():
-            res.register_advancement()
+        if kind in {IF_CONDITION, WHILE_CONDITION}:
+            if not tok.matches(KEYWORD, 'THEN'):
+                self.fail("Expected 'THEN'")
+            frames[-1] = (IF_CASE, 0, frames[-1][2], node) if kind == IF_CONDITION else (WHILE_BODY, 0, node)
             self.advance()
+            return None, EXPR
+
+        frame = frames.pop()
+        if kind == WHILE_BODY:
+            return WhileNode(frame[2], node), None
+        if kind == IF_ELSE:
+            return IfNode(frame[2], node), None
+
+        cases = frame[2]
+        cases.append((frame[3], node))
+        if tok.matches(KEYWORD, 'ELIF'):
+            frames.append((IF_CONDITION, 0, cases))
+        elif tok.matches(KEYWORD, 'ELSE'):
+            frames.append((IF_ELSE, 0, cases))
+        else:
+            return IfNode(cases, None), None
+        self.advance()
+        return None, EXPR
 
-        if self.current_tok.matches(KEYWORD, 'VAR'):
-            advance_with_registration()
 
-            if self.current_tok.type != IDENTIFIER:
-                return res.failure(InvalidSyntaxError(
-                    self.current_tok.pos_start, self.current_tok.pos_end,
-                    "Expected identifier"
-                ))
+class Node:
+    # Positions are only built when asked for: FIRST and LAST name the parts a node starts and ends
+    # with, followed down to the tokens, which build their Positions lazily too, and then kept
+    FIRST = LAST = None
 
-            var_name = self.current_tok
-            advance_with_registration()
+    @cached_property
+    def pos_start(self):
+        return edge(self, 'FIRST', 'pos_start')
 
-            if self.current_tok.type != EQ:
-                return res.failure(InvalidSyntaxError(
-                    self.current_tok.pos_start, self.current_tok.pos_end,
-                    "Expected '='"
-                ))
-
-            advance_with_registration()
-            expr = res.register(self.expr())
-            if res.error:
-                return res
-            return res.success(VarAssignNode(var_name, expr))
-
-        # Attempt to parse a binary operation if not parsing a variable assignment
-        node = res.register(self.bin_op(self.compare_expr, ((KEYWORD, 'AND'), (KEYWORD, 'OR'))))
-
-        if res.error:
-            return res.failure(InvalidSyntaxError(
-                self.current_tok.pos_start, self.current_tok.pos_end,
-                "Expected 'VAR', int, float, identifier, '+', '-', '(' or 'NOT'"
-            ))
+    @cached_property
+    def pos_end(self):
+        return edge(self, 'LAST', 'pos_end')
 
-        return res.success(node)
 
-    def bin_op(self, func_a, ops=(), func_b=None):
-        if func_b is None:
-            func_b = func_a
+def edge(node, side, attribute):
+    # iterative, so a position high up a deep tree doesn't need a frame per level to find
+    node = getattr(node, getattr(node, side))
+    while isinstance(node, Node) and attribute not in node.__dict__:
+        node = getattr(node, getattr(node, side))
+    return getattr(node, attribute)
 
-        res = ParseResult()
-        left = res.register(func_a())
-        if res.error:
-            return res
 
-        while self.current_tok.type in ops or (self.current_tok.type, self.current_tok.value) in ops:
-            op_tok = self.current_tok
-            res.register_advancement()
-            self.advance()
-            right = res.register(func_b())
-            if res.error:
-                return res
-            left = BinOpNode(left, op_tok, right)
+class NumberNode(Node):
+    FIRST = LAST = 'tok'
 
-        return res.success(left)
-
-
-class NumberNode:
     def __init__(self, tok):
         self.tok = tok
 
-        self.pos_start = self.tok.pos_start
-        self.pos_end = self.tok.pos_end
-
     def __repr__(self):
         return f'{self.tok}'
 
 
-class VarAccessNode:
+class VarAccessNode(Node):
+    FIRST = LAST = 'var_name_tok'
+
     def __init__(self, var_name_tok):
         self.var_name_tok = var_name_tok
 
-        self.pos_start = self.var_name_tok.pos_start
-        self.pos_end = self.var_name_tok.pos_end
 
+class VarAssignNode(Node):
+    FIRST, LAST = 'var_name_tok', 'value_node'
 
-class VarAssignNode:
     def __init__(self, var_name_tok, value_node):
         self.var_name_tok = var_name_tok
         self.value_node = value_node
 
-        self.pos_start = self.var_name_tok.pos_start
-        self.pos_end = self.value_node.pos_end
 
+class BinOpNode(Node):
+    FIRST, LAST = 'left_node', 'right_node'
 
-class BinOpNode:
     def __init__(self, left_node, op_tok, right_node):
         self.left_node = left_node
         self.op_tok = op_tok
         self.right_node = right_node
 
-        self.pos_start = self.left_node.pos_start
-        self.pos_end = self.right_node.pos_end
-
     def __repr__(self):
         return f'({self.left_node}, {self.op_tok}, {self.right_node})'
 
 
-class UnaryOpNode:
+class UnaryOpNode(Node):
+    FIRST, LAST = 'op_tok', 'node'
+
     def __init__(self, op_tok, node):
         self.op_tok = op_tok
         self.node = node
 
-        self.pos_start = self.op_tok.pos_start
-        self.pos_end = node.pos_end
-
     def __repr__(self):
         return f'({self.op_tok}, {self.node})'
 
 
-class IfNode:
+class IfNode(Node):
+    FIRST, LAST = 'first_condition', 'last_part'
+
     def __init__(self, cases, else_case):
         self.cases = cases
         self.else_case = else_case
 
-        self.pos_start = self.cases[0][0].pos_start
-        self.pos_end = (self.else_case or self.cases[len(self.cases) - 1][0]).pos_end
+    @property
+    def first_condition(self):
+        return self.cases[0][0]
+
+    @property
+    def last_part(self):
+        return self.else_case or self.cases[len(self.cases) - 1][0]
 
 
-class WhileNode:
-    def __init__(self, condition_node, body_node):
+class WhileNode(Node):
+    FIRST, LAST = 'condition_node', 'body_node'
+
+    def __init__(self, condition_node, body_node, invariants=()):
         self.condition_node = condition_node
         self.body_node = body_node
+        self.invariants = invariants  # InvariantNodes to recompute each time the loop starts
+
+
+NODE_METHODS = {
+    'NumberNode': 'number_node',
+    'VarAccessNode': 'var_access_node',
+    'VarAssignNode': 'var_assign_node',
+    'BinOpNode': 'bin_op_node',
+    'UnaryOpNode': 'unary_op_node',
+    'IfNode': 'if_node',
+    'WhileNode': 'while_node',
+    'InvariantNode': 'invariant_node',
+}
+
 
-        self.pos_start = self.condition_node.pos_start
-        self.pos_end = self.body_node.pos_end
+@lru_cache(maxsize=None)
+def method_names(prefix):
+    # built once per prefix: CPython's attribute cache keeps every name string it is looked up with,
+    # so fresh names on every call would fill it up one interpreter at a time
+    return tuple((name, f'{prefix}_{method}') for name, method in NODE_METHODS.items())
+
+
+def node_methods(handler, prefix):
+    # maps every node type's name to handler's method for it, e.g. 'IfNode' to handler.visit_if_node
+    return {name: getattr(handler, method) for name, method in method_names(prefix)}
 
 
 class ParseResult:
     def __init__(self):
         self.error = None
         self.node = None
-        self.advance_count = 0
-
-    def register_advancement(self):
-        self.advance_count += 1
-
-    def register(self, res):
-        self.advance_count += res.advance_count
-        if res.error:
-            self.error = res.error
-        return res.node
 
     def success(self, node):
         self.node = node
         return self
 
     def failure(self, error):
-        if not self.error or self.advance_count == 0:
-            self.error = error
+        self.error = error
         return self
@@ -0,0 +1,97 @@
+import time
+
+
+class NodeStats:
+    __slots__ = ('calls', 'total_time', 'self_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0  # total_time minus the time spent in child nodes
+
+    def add(self, total_time, self_time):
+        self.calls += 1
+        self.total_time += total_time
+        self.self_time += self_time
+
+
+class Profile:
+    """Call counts and cumulative/self times per node type and per source span, and iteration
+    counts per WHILE loop, gathered by an Interpreter created with Interpreter(profile=...).
+
+    Spans are (node type, start, end) with positions as (line, column) counted from 1, the end
+    being the span's last character.
+    Profiling works by replacing visit on that one interpreter instance, so the Interpreter class
+    and every interpreter created without a profile run exactly the code they did before."""
+
+    def __init__(self):
+        self.by_type = {}
+        self.by_span = {}
+        self.loop_iterations = {}
+        self.loop_bodies = {}
+        self.spans = {}
+        self.child_times = [0.0]
+
+    def attach(self, interpreter):
+        generic_visit = interpreter.visit
+
+        def visit(node, context):
+            node_type = type(node).__name__
+            node_span = self.spans.get(id(node))
+            if node_span is None:
+                node_span = self.spans[id(node)] = span(node)
+            if node_type == 'WhileNode':
+                self.loop_bodies[id(node.body_node)] = node_span
+                self.loop_iterations.setdefault(node_span, 0)
+            if id(node) in self.loop_bodies:
+                self.loop_iterations[self.loop_bodies[id(node)]] += 1
+
+            self.child_times.append(0.0)
+            start = time.perf_counter()
+            try:
+                return generic_visit(node, context)
+            finally:
+                # also when the node raises the error that stops the program, to keep child_times balanced
+                elapsed = time.perf_counter() - start
+                child_time = self.child_times.pop()
+                self.child_times[-1] += elapsed
+
+                if node_type not in self.by_type:
+                    self.by_type[node_type] = NodeStats()
+                self.by_type[node_type].add(elapsed, elapsed - child_time)
+                if node_span not in self.by_span:
+                    self.by_span[node_span] = NodeStats()
+                self.by_span[node_span].add(elapsed, elapsed - child_time)
+
+        interpreter.visit = visit
+
+    @property
+    def total_time(self):
+        return self.child_times[0]
+
+    def report(self, sort='self_time', limit=20):
+        # sort: 'self_time', 'total_time' or 'calls'
+        lines = [f'{"node type":<28}{"calls":>10}{"total ms":>12}{"self ms":>12}']
+        for node_type, stats in sorted(self.by_type.items(), key=lambda item: -getattr(item[1], sort)):
+            lines.append(format_row(node_type, stats))
+
+        lines += ['', f'{"source span":<28}{"calls":>10}{"total ms":>12}{"self ms":>12}']
+        spans = sorted(self.by_span.items(), key=lambda item: -getattr(item[1], sort))
+        for (node_type, (start_ln, start_col), (end_ln, end_col)), stats in spans[:limit]:
+            lines.append(format_row(f'{node_type} {start_ln}:{start_col}-{end_ln}:{end_col}', stats))
+
+        if self.loop_iterations:
+            lines += ['', f'{"WHILE loop":<28}{"iterations":>10}']
+            for (_, (start_ln, start_col), (end_ln, end_col)), iterations in sorted(
+                    self.loop_iterations.items(), key=lambda item: -item[1]):
+                lines.append(f'{f"{start_ln}:{start_col}-{end_ln}:{end_col}":<28}{iterations:>10}')
+        return '\n'.join(lines)
+
+
+def span(node):
+    return (type(node).__name__, (node.pos_start.ln + 1, node.pos_start.col + 1),
+            (node.pos_end.ln + 1, node.pos_end.col))
+
+
+def format_row(label, stats):
+    return f'{label:<28}{stats.calls:>10}{stats.total_time * 1000:>12.3f}{stats.self_time * 1000:>12.3f}'
@@ -0,0 +1,16 @@
+class SlotResolver:
+    # Links the names of one compiled program to slot indexes of an array-backed symbol table.
+    # The links are an inline cache: slots never move once allocated, so they only need rebuilding
+    # when another table is used or the table (or one of its parents) has defined a new name since.
+    def __init__(self, names):
+        self.names = names
+        self.symbol_table = None
+        self.version = -1
+        self.slots = []
+
+    def resolve(self, symbol_table):
+        if symbol_table is not self.symbol_table or symbol_table.version != self.version:
+            self.slots = [symbol_table.slot_of(name) for name in self.names]
+            self.symbol_table = symbol_table
+            self.version = symbol_table.version
+        return self.slots
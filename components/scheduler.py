@@ -0,0 +1,178 @@
+import time
+from collections import deque
+
+from components.errors import Abort, BudgetExceededError
+from components.interpeter import RTResult
+from components.number import Number
+from components.unboxed import UnboxedInterpreter
+
+DEFAULT_SLICE_STEPS = 1000
+
+
+class ResumableInterpreter(UnboxedInterpreter):
+    # UnboxedInterpreter as generators: every node visited is one step, and once pause_at steps
+    # are reached the evaluation yields, to be resumed with send() where it stopped. The step budget
+    # is checked at the same point, so counting costs one comparison per node.
+    def __init__(self, step_budget=None):
+        super().__init__()
+        self.step_budget = step_budget
+        self.steps = 0
+        self.pause_at = 0
+        self.visit_methods.update({
+            'VarAssignNode': self.visit_var_assign_node,
+            'BinOpNode': self.visit_bin_op_node,
+            'UnaryOpNode': self.visit_unary_op_node,
+            'IfNode': self.visit_if_node,
+            'WhileNode': self.visit_while_node,
+            'InvariantNode': self.visit_invariant_node,
+        })
+
+    def start(self, node, context):
+        # a generator that yields at every pause and returns the RTResult
+        res = RTResult()
+        try:
+            value = yield from self.visit(node, context)
+        except Abort as abort:
+            return res.failure(abort.error)
+        return res.success(None if value is None else Number.box(value))
+
+    def resume_for(self, steps):
+        self.pause_at = self.steps + steps
+        if self.step_budget is not None:
+            self.pause_at = min(self.pause_at, self.step_budget + 1)
+
+    def visit(self, node, context):
+        self.steps += 1
+        if self.steps >= self.pause_at:
+            if self.step_budget is not None and self.steps > self.step_budget:
+                raise Abort(BudgetExceededError(
+                    node.pos_start, node.pos_end, f"Step budget of {self.step_budget} steps used up"
+                ))
+            # the scheduler sends a reason to stop instead of going on, once the program's time is up
+            reason = yield
+            if reason:
+                raise Abort(BudgetExceededError(node.pos_start, node.pos_end, reason))
+
+        node_type = type(node).__name__
+        if node_type == 'NumberNode':
+            return node.tok.value
+        if node_type == 'VarAccessNode':
+            return self.visit_var_access_node(node, context)
+        return (yield from self.visit_methods[node_type](node, context))
+
+    def visit_var_assign_node(self, node, context):
+        value = yield from self.visit(node.value_node, context)
+        return self.assign(node, value, context)
+
+    def visit_bin_op_node(self, node, context):
+        left = yield from self.visit(node.left_node, context)
+        right = yield from self.visit(node.right_node, context)
+        return self.operate(node, left, right, context)
+
+    def visit_unary_op_node(self, node, context):
+        value = yield from self.visit(node.node, context)
+        return self.unary(node, value)
+
+    def visit_if_node(self, node, context):
+        for condition, expr in node.cases:
+            if (yield from self.visit(condition, context)) != 0:
+                return (yield from self.visit(expr, context))
+        if node.else_case:
+            return (yield from self.visit(node.else_case, context))
+        return None
+
+    def visit_while_node(self, node, context):
+        for invariant in node.invariants:
+            self.invariant_values.pop(invariant, None)
+        while (yield from self.visit(node.condition_node, context)) != 0:
+            yield from self.visit(node.body_node, context)
+
+    def visit_invariant_node(self, node, context):
+        if node not in self.invariant_values:
+            self.invariant_values[node] = yield from self.visit(node.node, context)
+        return self.invariant_values[node]
+
+
+class Task:
+    """One program under a Scheduler. time_budget is the wall-clock time, in seconds, the program
+    may spend running, summed over its slices; time spent waiting for other programs isn't counted.
+    Once finished, value and error hold what run() would have returned."""
+
+    def __init__(self, node, context, step_budget=None, time_budget=None):
+        self.interpreter = ResumableInterpreter(step_budget)
+        self.execution = self.interpreter.start(node, context)
+        self.time_budget = time_budget
+        self.elapsed = 0.0
+        self.started = False
+        self.result = None
+
+    @classmethod
+    def failed(cls, error):
+        # a program that can't start, e.g. one that doesn't parse, as an already finished task
+        task = cls(None, None)
+        task.result = RTResult().failure(error)
+        return task
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    @property
+    def value(self):
+        return self.result.value if self.result else None
+
+    @property
+    def error(self):
+        return self.result.error if self.result else None
+
+    @property
+    def steps(self):
+        return self.interpreter.steps
+
+    def resume(self, steps):
+        reason = None
+        if self.started and self.time_budget is not None and self.elapsed >= self.time_budget:
+            reason = f"Time budget of {self.time_budget}s used up"
+
+        self.interpreter.resume_for(steps)
+        start = time.perf_counter()
+        try:
+            self.execution.send(reason)
+        except StopIteration as finished:
+            self.result = finished.value
+        finally:
+            self.started = True
+            self.elapsed += time.perf_counter() - start
+
+
+class Scheduler:
+    """Interleaves many programs on one thread. Each ready task in turn runs for slice_steps
+    evaluation steps and goes to the back of the queue, so a long or endless program only delays
+    the others by a slice at a time, and is stopped with a BudgetExceededError once it uses up its
+    step or time budget."""
+
+    def __init__(self, slice_steps=DEFAULT_SLICE_STEPS):
+        self.slice_steps = slice_steps
+        self.ready = deque()
+
+    def __len__(self):
+        return len(self.ready)
+
+    def submit(self, node, context, step_budget=None, time_budget=None):
+        task = Task(node, context, step_budget, time_budget)
+        self.ready.append(task)
+        return task
+
+    def step(self):
+        # runs one slice of the next task; False once there is nothing left to run
+        if not self.ready:
+            return False
+        task = self.ready.popleft()
+        task.resume(self.slice_steps)
+        if not task.done:
+            self.ready.append(task)
+        return bool(self.ready)
+
+    def run(self):
+        while self.step():
+            pass
@@ -0,0 +1,81 @@
+from components.unboxed import UnboxedInterpreter
+
+# what an entry on the work stack does: evaluate its node, or finish one whose operands are on
+# the value stack
+EVALUATE, OPERATE, UNARY, ASSIGN, CASE, TEST, LOOP, DISCARD, REMEMBER = range(9)
+
+
+class StackInterpreter(UnboxedInterpreter):
+    # UnboxedInterpreter without recursion: the nodes still to evaluate and the operations waiting
+    # for their operands go on a work stack, and values on a value stack, so nesting depth is
+    # bounded by memory rather than the recursion limit, e.g. for long generated formulas.
+
+    def visit(self, node, context):
+        work = [(EVALUATE, node, 0)]
+        values = []
+        while work:
+            action, node, index = work.pop()
+            if action == EVALUATE:
+                self.expand(node, context, work, values)
+            elif action == OPERATE:
+                right = values.pop()
+                values[-1] = self.operate(node, values[-1], right, context)
+            elif action == UNARY:
+                values[-1] = self.unary(node, values[-1])
+            elif action == ASSIGN:
+                values[-1] = self.assign(node, values[-1], context)
+            elif action == CASE:
+                self.case(node, index, work, values)
+            elif action == TEST:
+                if values.pop() != 0:
+                    work.append((EVALUATE, node.cases[index][1], 0))
+                else:
+                    work.append((CASE, node, index + 1))
+            elif action == LOOP:
+                if values.pop() != 0:
+                    work.extend(((LOOP, node, 0), (EVALUATE, node.condition_node, 0),
+                                 (DISCARD, None, 0), (EVALUATE, node.body_node, 0)))
+                else:
+                    values.append(None)
+            elif action == DISCARD:
+                values.pop()
+            else:
+                self.invariant_values[node] = values[-1]
+        return values.pop()
+
+    def expand(self, node, context, work, values):
+        # pushes what evaluating node takes, operands last so they are evaluated first
+        node_type = type(node).__name__
+        if node_type == 'NumberNode':
+            values.append(node.tok.value)
+        elif node_type == 'VarAccessNode':
+            values.append(self.visit_var_access_node(node, context))
+        elif node_type == 'BinOpNode':
+            work.extend(((OPERATE, node, 0), (EVALUATE, node.right_node, 0), (EVALUATE, node.left_node, 0)))
+        elif node_type == 'UnaryOpNode':
+            work.extend(((UNARY, node, 0), (EVALUATE, node.node, 0)))
+        elif node_type == 'VarAssignNode':
+            work.extend(((ASSIGN, node, 0), (EVALUATE, node.value_node, 0)))
+        elif node_type == 'IfNode':
+            self.case(node, 0, work, values)
+        elif node_type == 'WhileNode':
+            for invariant in node.invariants:
+                self.invariant_values.pop(invariant, None)
+            work.extend(((LOOP, node, 0), (EVALUATE, node.condition_node, 0)))
+        elif node_type == 'InvariantNode':
+            if node in self.invariant_values:
+                values.append(self.invariant_values[node])
+            else:
+                work.extend(((REMEMBER, node, 0), (EVALUATE, node.node, 0)))
+        else:
+            raise ValueError(f'No visit_{node_type} method defined')
+
+    @staticmethod
+    def case(node, index, work, values):
+        # tries the index-th case of an IfNode, then its else case
+        if index < len(node.cases):
+            work.extend(((TEST, node, index), (EVALUATE, node.cases[index][0], 0)))
+        elif node.else_case:
+            work.append((EVALUATE, node.else_case, 0))
+        else:
+            values.append(None)
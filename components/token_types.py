@@ -15,6 +15,7 @@ LT = 'LT'                    # less than X<Y
 GT = 'GT'                    # greater than X>Y
 LTE = 'LTE'                  # less than equals X<=Y
 GTE = 'GTE'                  # greater than equals X>=Y
+NEWLINE = 'NEWLINE'          # ; or a line break between statements
 EOF = 'EOF'                  # END OF FILE
 
 
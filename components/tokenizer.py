@@ -1,4 +1,6 @@
+import re
 import string
+from bisect import bisect_right
 from collections import defaultdict
 
 from components.token_types import (
@@ -19,6 +21,7 @@ from components.token_types import (
     EQ,
     INT,
     FLOAT,
+    NEWLINE,
     LT
 )
 from components.errors import (
@@ -28,6 +31,7 @@ from components.errors import (
 )
 
 MAXIMUM_TIMES_NESTED = 3
+DEFAULT_CHUNK_SIZE = 64 * 1024
 KEYWORDS = [
     'VAR',
     'AND',
@@ -42,17 +46,46 @@ KEYWORDS = [
 
 
 class Token:
+    # Keeps its span as two offsets; the Position objects are only built if someone asks for them
+    __slots__ = ('type', 'value', 'start', 'end', 'source', 'pos_start_cache', 'pos_end_cache')
+
     def __init__(self, type_, value=None, pos_start=None, pos_end=None):
         self.type = type_
         self.value = value
+        self.start = self.end = self.source = None
+        self.pos_start_cache = pos_start
+        self.pos_end_cache = pos_end
 
         if pos_start:
-            self.pos_start = pos_start.copy()
-            self.pos_end = pos_start.copy()
-            self.pos_end.advance()
+            self.source = pos_start.source
+            self.start = pos_start.idx
+            self.end = pos_end.idx if pos_end else pos_start.idx + 1
+        elif pos_end:
+            self.source = pos_end.source
+            self.end = pos_end.idx
+
+    @classmethod
+    def spanning(cls, type_, value, start, end, source):
+        token = cls.__new__(cls)
+        token.type, token.value, token.start, token.end, token.source = type_, value, start, end, source
+        token.pos_start_cache = token.pos_end_cache = None
+        return token
 
-        if pos_end:
-            self.pos_end = pos_end.copy()
+    @property
+    def pos_start(self):
+        if self.pos_start_cache is None:
+            if self.start is None:
+                raise AttributeError('pos_start')
+            self.pos_start_cache = Position(self.start, txt=self.source)
+        return self.pos_start_cache
+
+    @property
+    def pos_end(self):
+        if self.pos_end_cache is None:
+            if self.end is None:
+                raise AttributeError('pos_end')
+            self.pos_end_cache = Position(self.end, txt=self.source)
+        return self.pos_end_cache
 
     def matches(self, type_, value):
         return self.type == type_ and self.value == value
@@ -66,13 +99,19 @@ class Token:
 class Lexer:
     def __init__(self, text):
         self.text = text
-        self.pos = Position(-1, 0, -1, text)
+        self.source = Source(text)
+        self.idx = -1
         self.current_char = None
         self.advance()
 
+    @property
+    def pos(self):
+        # Positions are only made where a token or error needs one, the lexer itself moves an offset
+        return Position(self.idx, txt=self.source)
+
     def advance(self):
-        self.pos.advance(self.current_char)
-        self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
+        self.idx += 1
+        self.current_char = self.text[self.idx] if self.idx < len(self.text) else None
 
     def add_token_with_advance(self, token_type):
         token = Token(token_type, pos_start=self.pos)
@@ -109,7 +148,7 @@ class Lexer:
             elif self.current_char == '>':
                 collected_tokens.append(self.make_greater_than())
             else:
-                start_position = self.pos.copy()
+                start_position = self.pos
                 character = self.current_char
                 self.advance()
                 return [], IllegalCharError(start_position, self.pos, f"'{character}'")
@@ -126,38 +165,36 @@ class Lexer:
             if token.value in {"WHILE", "IF"}:
                 counter_if_while[token.value] += 1
             if counter_if_while[token.value] >= MAXIMUM_TIMES_NESTED:
-                return TooManyNestedError(self.pos.copy(), self.pos, f"'{token.value}'")
+                return TooManyNestedError(self.pos, self.pos, f"'{token.value}'")
         return None
 
     def make_number(self):
-        number_string = ''
         decimal_point_count = 0
-        start_position = self.pos.copy()
+        start_position = self.pos
 
         while self.current_char is not None and self.current_char in f'{string.digits}.':
             if self.current_char == '.' and decimal_point_count == 1:
                 break
             decimal_point_count += self.current_char == '.'
-            number_string += self.current_char
             self.advance()
+        number_string = self.text[start_position.idx:self.idx]
 
         if decimal_point_count == 0:
             return Token(INT, int(number_string), start_position, self.pos)
         return Token(FLOAT, float(number_string), start_position, self.pos)
 
     def make_identifier(self):
-        id_str = ''
-        pos_start = self.pos.copy()
+        pos_start = self.pos
 
         while self.current_char is not None and self.current_char in f"{string.ascii_letters}_{string.digits}":
-            id_str += self.current_char
             self.advance()
+        id_str = self.text[pos_start.idx:self.idx]
 
         tok_type = KEYWORD if id_str in KEYWORDS else IDENTIFIER
         return Token(tok_type, id_str, pos_start, self.pos)
 
     def make_not_equals(self):
-        pos_start = self.pos.copy()
+        pos_start = self.pos
         self.advance()
 
         if self.current_char == '=':
@@ -169,7 +206,7 @@ class Lexer:
 
     def make_equals(self):
         tok_type = EQ
-        pos_start = self.pos.copy()
+        pos_start = self.pos
         self.advance()
 
         if self.current_char == '=':
@@ -180,7 +217,7 @@ class Lexer:
 
     def make_less_than(self):
         tok_type = LT
-        pos_start = self.pos.copy()
+        pos_start = self.pos
         self.advance()
 
         if self.current_char == '=':
@@ -191,7 +228,7 @@ class Lexer:
 
     def make_greater_than(self):
         tok_type = GT
-        pos_start = self.pos.copy()
+        pos_start = self.pos
         self.advance()
 
         if self.current_char == '=':
@@ -201,20 +238,209 @@ class Lexer:
         return Token(tok_type, pos_start=pos_start, pos_end=self.pos)
 
 
+# Group numbers double as the token kind, so the lexer can dispatch on match.lastindex.
+# Statement separators are only tokens in program mode; otherwise the group can never match.
+TOKEN_TEMPLATE = (
+    r'[ \t]*(?:'
+    r'([-+*/()]|[=!<>]=|[=<>])'
+    r'|([A-Za-z][A-Za-z0-9_]*)'
+    r'|([0-9]+\.[0-9]*)'
+    r'|([0-9]+)'
+    r'|(!)'
+    r'|({separator})'
+    r'|(.)'
+    r'|$)'
+)
+TOKEN_PATTERN = re.compile(TOKEN_TEMPLATE.format(separator='(?!)'), re.DOTALL)
+PROGRAM_PATTERN = re.compile(TOKEN_TEMPLATE.format(separator=r';|\r?\n'), re.DOTALL)
+# bytes versions, to lex memory-mapped files in place
+BYTES_PATTERN = re.compile(TOKEN_PATTERN.pattern.encode(), re.DOTALL)
+BYTES_PROGRAM_PATTERN = re.compile(PROGRAM_PATTERN.pattern.encode(), re.DOTALL)
+OPERATOR, IDENTIFIER_GROUP, DECIMAL, INTEGER, BANG, SEPARATOR, ILLEGAL = range(1, 8)
+OPERATORS = {
+    '+': PLUS, '-': MINUS, '*': MUL, '/': DIV, '(': LPAREN, ')': RPAREN,
+    '=': EQ, '==': EE, '!=': NE, '<': LT, '<=': LTE, '>': GT, '>=': GTE,
+}
+OPERATORS.update({sign.encode(): tok_type for sign, tok_type in OPERATORS.items()})
+KEYWORD_SET = frozenset(KEYWORDS)
+NESTED_KEYWORDS = ('IF', 'WHILE')
+
+
+class RegexLexer:
+    # Same tokens and errors as Lexer, from one pass of a compiled master regex. The nesting
+    # limit is counted on the way, but reported only once the whole text lexed without errors.
+    # In program mode ';' and newlines become NEWLINE tokens, and the nesting limit applies to each
+    # statement. text can also be bytes or an mmap, which is lexed without copying it into a str.
+    def __init__(self, text, source=None, program=False):
+        self.text = text
+        self.source = source or Source(text)
+        self.program = program
+        self.error = None
+
+    def generate_tokens(self):
+        collected_tokens = list(self.iter_tokens())
+        if self.error:
+            return [], self.error
+        return collected_tokens, None
+
+    def iter_tokens(self):
+        # Yields tokens as they are matched and always finishes with EOF. On a lex error it stops
+        # early at the offending character and leaves the error in self.error.
+        text, source = self.text, self.source
+        is_str = isinstance(text, str)
+        if is_str:
+            pattern = PROGRAM_PATTERN if self.program else TOKEN_PATTERN
+        else:
+            pattern = BYTES_PROGRAM_PATTERN if self.program else BYTES_PATTERN
+        spanning = Token.spanning
+        nested_counts = {'IF': 0, 'WHILE': 0}
+        nested_error = None
+
+        for match in pattern.finditer(text):
+            kind = match.lastindex
+            if kind is None:
+                # only trailing whitespace was left
+                break
+
+            start, end = match.span(kind)
+            if kind == OPERATOR:
+                yield spanning(OPERATORS[match.group(kind)], None, start, end, source)
+            elif kind == IDENTIFIER_GROUP:
+                id_str = match.group(kind)
+                if not is_str:
+                    id_str = id_str.decode('ascii')
+                if id_str in KEYWORD_SET:
+                    yield spanning(KEYWORD, id_str, start, end, source)
+                    if id_str in nested_counts:
+                        nested_counts[id_str] += 1
+                        if nested_counts[id_str] >= MAXIMUM_TIMES_NESTED and nested_error is None:
+                            nested_error = f"'{id_str}'"
+                else:
+                    yield spanning(IDENTIFIER, id_str, start, end, source)
+            elif kind == INTEGER:
+                yield spanning(INT, int(match.group(kind)), start, end, source)
+            elif kind == DECIMAL:
+                yield spanning(FLOAT, float(match.group(kind)), start, end, source)
+            elif kind == SEPARATOR:
+                if nested_error:
+                    yield self.stop(TooManyNestedError(Position(start, txt=source), Position(start, txt=source),
+                                                       nested_error))
+                    return
+                nested_counts = {'IF': 0, 'WHILE': 0}
+                yield spanning(NEWLINE, None, start, end, source)
+            elif kind == BANG:
+                # Lexer steps over the character after '!' before failing
+                yield self.stop(ExpectedCharError(Position(start, txt=source), Position(start + 2, txt=source),
+                                                  "'=' (after '!')"))
+                return
+            else:
+                character = match.group(kind)
+                if not is_str:
+                    character = character.decode('utf-8', 'replace')
+                yield self.stop(IllegalCharError(Position(start, txt=source), Position(end, txt=source),
+                                                 f"'{character}'"))
+                return
+
+        end_of_text = Position(len(text), txt=source)
+        if nested_error:
+            self.error = TooManyNestedError(end_of_text, end_of_text, nested_error)
+        yield Token(EOF, pos_start=end_of_text)
+
+    def stop(self, error):
+        # keeps error and gives the EOF token that ends the stream where the error starts
+        self.error = error
+        return Token(EOF, pos_start=error.pos_start)
+
+
+def stream_lines(reader, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Reads a text file object chunk by chunk and yields (line number, line), without the newline.
+    # Only the line being assembled is kept, so memory is bounded by the longest line.
+    pending = ''
+    ln = 0
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield ln, line.rstrip('\r')
+            ln += 1
+    if pending:
+        yield ln, pending.rstrip('\r')
+
+
+class Source:
+    # The program text plus an index of where each line starts, built the first time a line is asked for.
+    # first_line numbers the text's lines from somewhere inside a bigger file, for streamed input.
+    __slots__ = ('text', 'first_line', 'line_starts_cache')
+
+    def __init__(self, text, first_line=0):
+        self.text = text
+        self.first_line = first_line
+        self.line_starts_cache = None
+
+    @property
+    def line_starts(self):
+        if self.line_starts_cache is None:
+            starts = [0]
+            separator = '\n' if isinstance(self.text, str) else b'\n'
+            newline = self.text.find(separator)
+            while newline >= 0:
+                starts.append(newline + 1)
+                newline = self.text.find(separator, newline + 1)
+            self.line_starts_cache = starts
+        return self.line_starts_cache
+
+    def line_col(self, idx):
+        line_starts = self.line_starts
+        ln = max(bisect_right(line_starts, idx) - 1, 0)
+        return self.first_line + ln, idx - line_starts[ln]
+
+    def line(self, ln):
+        ln -= self.first_line
+        line_starts = self.line_starts
+        if ln >= len(line_starts):
+            return ''
+        end = line_starts[ln + 1] - 1 if ln + 1 < len(line_starts) else len(self.text)
+        line = self.text[line_starts[ln]:end]
+        return line if isinstance(line, str) else line.decode('utf-8', 'replace')
+
+
 class Position:
-    def __init__(self, idx, ln, col, txt):
+    # An offset into a Source; line and column are worked out from the line index when first needed
+    __slots__ = ('idx', 'source', 'ln_cache', 'col_cache')
+
+    def __init__(self, idx, ln=None, col=None, txt=''):
         self.idx = idx
-        self.ln = ln
-        self.col = col
-        self.txt = txt
+        self.source = txt if isinstance(txt, Source) else Source(txt)
+        self.ln_cache = ln
+        self.col_cache = col
+
+    @property
+    def ln(self):
+        if self.ln_cache is None:
+            self.ln_cache, self.col_cache = self.source.line_col(self.idx)
+        return self.ln_cache
+
+    @property
+    def col(self):
+        if self.col_cache is None:
+            self.ln_cache, self.col_cache = self.source.line_col(self.idx)
+        return self.col_cache
+
+    @property
+    def txt(self):
+        return self.source.text
 
     def advance(self, current_char=None):
         self.idx += 1
-        self.col += 1
 
-        if current_char == '\n':
-            self.ln += 1
-            self.col = 0
+        if self.ln_cache is not None:
+            self.col_cache += 1
+            if current_char == '\n':
+                self.ln_cache += 1
+                self.col_cache = 0
 
     def copy(self):
-        return Position(self.idx, self.ln, self.col, self.txt)
+        return Position(self.idx, self.ln_cache, self.col_cache, self.source)
@@ -0,0 +1,413 @@
+import ast
+
+from components.errors import Abort, RTError
+from components.interpeter import (
+    RTResult, MAX_NUMBER, MIN_NUMBER, MAXIMUM_NUMBER_OF_VARIABLES, overflow_error, too_many_variables
+)
+from components.number import Number
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT
+)
+
+FILENAME = '<transpiled>'
+VARIABLE_PREFIX = 'v_'  # keeps user identifiers such as `if` or `None` from clashing with Python
+HELPERS = ('__symbols', '__get', '__overflow', '__too_many', '__and', '__or', '__writeback', '__unset')
+
+ARITHMETIC = {
+    PLUS: ast.Add,
+    MINUS: ast.Sub,
+    MUL: ast.Mult,
+    DIV: ast.Div,
+}
+
+COMPARISONS = {
+    EE: ast.Eq,
+    NE: ast.NotEq,
+    LT: ast.Lt,
+    GT: ast.Gt,
+    LTE: ast.LtE,
+    GTE: ast.GtE,
+}
+
+
+def name(identifier, store=False):
+    return ast.Name(id=identifier, ctx=ast.Store() if store else ast.Load())
+
+
+def statements(source):
+    # Parsed snippets lose their own line numbers, so they get located on the AST node they belong to
+    body = ast.parse(source).body
+    for statement in body:
+        for child in ast.walk(statement):
+            if 'lineno' in child._attributes:
+                child.lineno = child.end_lineno = None
+    return body
+
+
+def compare(left, op, right):
+    return ast.Compare(left=left, ops=[op()], comparators=[right])
+
+
+def locate(py_node, line):
+    for child in ast.walk(py_node):
+        if 'lineno' in child._attributes and getattr(child, 'lineno', None) is None:
+            child.lineno = child.end_lineno = line
+            child.col_offset = child.end_col_offset = 0
+    return py_node
+
+
+def unary(node, operand):
+    if node.op_tok.type == MINUS:
+        return ast.UnaryOp(op=ast.USub(), operand=operand)
+    if node.op_tok.matches(KEYWORD, 'NOT'):
+        return ast.IfExp(
+            test=compare(operand, ast.Eq, ast.Constant(value=0)),
+            body=ast.Constant(value=1), orelse=ast.Constant(value=0)
+        )
+    return operand
+
+
+def may_be_none(node):
+    node_type_name = type(node).__name__
+    if node_type_name == 'WhileNode':
+        return True
+    if node_type_name == 'IfNode':
+        return node.else_case is None or may_be_none(node.else_case) or \
+            any(may_be_none(expr) for _, expr in node.cases)
+    if node_type_name == 'VarAssignNode':
+        return may_be_none(node.value_node)
+    if node_type_name == 'InvariantNode':
+        return may_be_none(node.node)
+    return False
+
+
+class TranspiledProgram:
+    def __init__(self, function, nodes, assigned):
+        self.function = function
+        self.nodes = nodes
+        self.assigned = assigned
+
+    def node_at(self, exception):
+        # Every generated Python node carries the line number of the AST node it came from
+        traceback, line = exception.__traceback__, None
+        while traceback:
+            if traceback.tb_frame.f_code.co_filename == FILENAME:
+                line = traceback.tb_lineno
+            traceback = traceback.tb_next
+        return self.nodes[line] if line is not None else None
+
+    def run(self, context):
+        res = RTResult()
+        symbol_table = context.symbol_table
+
+        def overflow(value, line):
+            node = self.nodes[line]
+            raise Abort(overflow_error(value, node.pos_start, node.pos_end))
+
+        def too_many():
+            raise Abort(too_many_variables(context))
+
+        def writeback(scope):
+            for var_name in self.assigned:
+                if VARIABLE_PREFIX + var_name in scope:
+                    symbol_table.set(var_name, Number(scope[VARIABLE_PREFIX + var_name]).set_context(context))
+                elif scope.get(f'__none_{var_name}'):
+                    symbol_table.set(var_name, None)
+
+        try:
+            value = self.function(
+                symbol_table.slots, symbol_table.get, overflow, too_many,
+                lambda left, right: int(left and right),
+                lambda left, right: int(left or right),
+                writeback, object()
+            )
+        except Abort as abort:
+            return res.failure(abort.error)
+        except ZeroDivisionError as exception:
+            node = self.node_at(exception)
+            return res.failure(RTError(node.right_node.pos_start, node.right_node.pos_end, 'Division by zero', context))
+        except NameError as exception:
+            node = self.node_at(exception)
+            return res.failure(RTError(
+                node.pos_start, node.pos_end,
+                f"'{node.var_name_tok.value}' is not defined",
+                context
+            ))
+
+        if value is None:
+            return res.success(None)
+        return res.success(Number(value).set_context(context))
+
+
+class Transpiler:
+
+    def __init__(self):
+        self.nodes = [None, None]  # line 0 doesn't exist and line 1 is the function scaffolding
+        self.lines = {}
+        self.pure = {}
+        self.variables = {}
+        self.assigned = {}
+        self.nullable = {}
+        self.temp_count = 0
+        self.invariant_names = {}
+        self.expr_methods = {
+            'NumberNode': self.expr_number_node,
+            'VarAccessNode': self.expr_var_access_node,
+            'BinOpNode': self.expr_bin_op_node,
+            'UnaryOpNode': self.expr_unary_op_node,
+            'IfNode': self.expr_if_node,
+            'InvariantNode': self.expr_invariant_node,
+        }
+        self.lower_methods = {
+            'VarAssignNode': self.lower_var_assign_node,
+            'BinOpNode': self.lower_bin_op_node,
+            'UnaryOpNode': self.lower_unary_op_node,
+            'IfNode': self.lower_if_node,
+            'WhileNode': self.lower_while_node,
+        }
+
+    def compile(self, node):
+        body = self.lower(node, '__result')
+        prologue = statements('__size = len(__symbols)')
+        for var_name in self.variables:
+            prologue += statements(
+                f"__v = __get('{var_name}')\n"
+                f"if __v is not None: {VARIABLE_PREFIX}{var_name} = __v.value"
+            )
+        for var_name in self.assigned:
+            prologue += statements(f"__new_{var_name} = '{var_name}' not in __symbols")
+        for var_name in self.nullable:
+            prologue += statements(f"__none_{var_name} = False")
+
+        function = ast.FunctionDef(
+            name='__program',
+            args=ast.arguments(
+                posonlyargs=[], args=[ast.arg(arg=helper) for helper in HELPERS],
+                kwonlyargs=[], kw_defaults=[], defaults=[]
+            ),
+            body=prologue + [ast.Try(
+                body=body + [ast.Return(value=name('__result'))],
+                handlers=[], orelse=[],
+                finalbody=[ast.Expr(value=ast.Call(
+                    func=name('__writeback'), args=[ast.Call(func=name('locals'), args=[], keywords=[])], keywords=[]
+                ))]
+            )],
+            decorator_list=[], returns=None, type_params=[]
+        )
+        module = ast.Module(body=[function], type_ignores=[])
+        locate(module, 1)
+
+        namespace = {}
+        exec(compile(module, FILENAME, 'exec'), namespace)  # pylint: disable=exec-used
+        return TranspiledProgram(namespace['__program'], self.nodes, list(self.assigned))
+
+    def line(self, node):
+        key = id(node)
+        if key not in self.lines:
+            self.lines[key] = len(self.nodes)
+            self.nodes.append(node)
+        return self.lines[key]
+
+    def new_temp(self):
+        self.temp_count += 1
+        return f'__t{self.temp_count}'
+
+    def is_pure(self, node):
+        # Pure subtrees neither assign nor loop, so they can become a single Python expression
+        key = id(node)
+        if key not in self.pure:
+            node_type_name = type(node).__name__
+            if node_type_name in {'VarAssignNode', 'WhileNode'}:
+                result = False
+            elif node_type_name == 'BinOpNode':
+                result = self.is_pure(node.left_node) and self.is_pure(node.right_node)
+            elif node_type_name in {'UnaryOpNode', 'InvariantNode'}:
+                result = self.is_pure(node.node)
+            elif node_type_name == 'IfNode':
+                result = all(self.is_pure(condition) and self.is_pure(expr) for condition, expr in node.cases) and \
+                    (node.else_case is None or self.is_pure(node.else_case))
+            else:
+                result = True
+            self.pure[key] = result
+        return self.pure[key]
+
+    # Expressions, for pure subtrees
+
+    def expr(self, node):
+        node_type_name = type(node).__name__
+        method = self.expr_methods.get(node_type_name)
+        if method is None:
+            raise ValueError(f'No expr_{node_type_name} method defined')
+        return locate(method(node), self.line(node))
+
+    @staticmethod
+    def expr_number_node(node):
+        return ast.Constant(value=node.tok.value)
+
+    def expr_var_access_node(self, node):
+        self.variables[node.var_name_tok.value] = True
+        return name(VARIABLE_PREFIX + node.var_name_tok.value)
+
+    def expr_bin_op_node(self, node):
+        return self.binary(node, self.expr(node.left_node), self.expr(node.right_node))
+
+    def binary(self, node, left, right):
+        op_type = node.op_tok.type
+
+        if op_type in ARITHMETIC:
+            # (__t if MIN <= (__t := left op right) <= MAX else __overflow(__t, line))
+            return ast.IfExp(
+                test=ast.Compare(
+                    left=ast.Constant(value=MIN_NUMBER),
+                    ops=[ast.LtE(), ast.LtE()],
+                    comparators=[
+                        ast.NamedExpr(target=name('__t', True), value=ast.BinOp(
+                            left=left, op=ARITHMETIC[op_type](), right=right
+                        )),
+                        ast.Constant(value=MAX_NUMBER)
+                    ]
+                ),
+                body=name('__t'),
+                orelse=ast.Call(
+                    func=name('__overflow'), args=[name('__t'), ast.Constant(value=self.line(node))], keywords=[]
+                )
+            )
+        if op_type in COMPARISONS:
+            return ast.IfExp(
+                test=compare(left, COMPARISONS[op_type], right), body=ast.Constant(value=1), orelse=ast.Constant(value=0)
+            )
+        # both operands are always evaluated, so AND/OR go through a call instead of Python's short-circuiting
+        if node.op_tok.matches(KEYWORD, 'AND'):
+            return ast.Call(func=name('__and'), args=[left, right], keywords=[])
+        if node.op_tok.matches(KEYWORD, 'OR'):
+            return ast.Call(func=name('__or'), args=[left, right], keywords=[])
+        raise ValueError(f'Unknown binary operator {node.op_tok}')
+
+    def expr_unary_op_node(self, node):
+        return unary(node, self.expr(node.node))
+
+    def expr_if_node(self, node):
+        result = self.expr(node.else_case) if node.else_case else ast.Constant(value=None)
+        for condition, expr in reversed(node.cases):
+            result = ast.IfExp(test=self.test(condition), body=self.expr(expr), orelse=result)
+        return result
+
+    def invariant_name(self, node):
+        if node not in self.invariant_names:
+            self.invariant_names[node] = f'__i{len(self.invariant_names)}'
+        return self.invariant_names[node]
+
+    def expr_invariant_node(self, node):
+        # (__i if __i is not __unset else (__i := expr)), reset to __unset before the owning loop
+        slot = self.invariant_name(node)
+        return ast.IfExp(
+            test=compare(name(slot), ast.IsNot, name('__unset')),
+            body=name(slot),
+            orelse=ast.NamedExpr(target=name(slot, True), value=self.expr(node.node))
+        )
+
+    def test(self, node):
+        # Truth test of a pure condition, without boxing comparisons into 0/1 first
+        if type(node).__name__ == 'BinOpNode' and node.op_tok.type in COMPARISONS:
+            return locate(compare(
+                self.expr(node.left_node), COMPARISONS[node.op_tok.type], self.expr(node.right_node)
+            ), self.line(node))
+        return locate(compare(self.expr(node), ast.NotEq, ast.Constant(value=0)), self.line(node))
+
+    # Statements, for subtrees that assign or loop
+
+    def lower(self, node, target):
+        if self.is_pure(node):
+            body = [ast.Assign(targets=[name(target, True)], value=self.expr(node))]
+        else:
+            body = self.lower_methods[type(node).__name__](node, target)
+        line = self.line(node)
+        for statement in body:
+            locate(statement, line)
+        return body
+
+    def lower_var_assign_node(self, node, target):
+        var_name = node.var_name_tok.value
+        self.variables[var_name] = True
+        self.assigned[var_name] = True
+        value = self.new_temp()
+        if may_be_none(node.value_node):
+            # a variable holding no value reads as undefined, so the local is unbound instead of None
+            self.nullable[var_name] = True
+            store = (
+                f"if {value} is None:\n"
+                f"    {VARIABLE_PREFIX}{var_name} = None\n"
+                f"    del {VARIABLE_PREFIX}{var_name}\n"
+                f"    __none_{var_name} = True\n"
+                f"else:\n"
+                f"    {VARIABLE_PREFIX}{var_name} = {value}\n"
+                f"    __none_{var_name} = False\n"
+            )
+        else:
+            store = f"{VARIABLE_PREFIX}{var_name} = {value}\n"
+        return self.lower(node.value_node, value) + statements(
+            f"if __size >= {MAXIMUM_NUMBER_OF_VARIABLES + 2}: __too_many()\n"  # +2 because TRUE AND FALSE
+            f"if __new_{var_name}:\n"
+            f"    __size += 1\n"
+            f"    __new_{var_name} = False\n"
+            f"{store}"
+            f"{target} = {value}"
+        )
+
+    def lower_bin_op_node(self, node, target):
+        left, right = self.new_temp(), self.new_temp()
+        return self.lower(node.left_node, left) + self.lower(node.right_node, right) + [
+            ast.Assign(targets=[name(target, True)], value=self.binary(node, name(left), name(right)))
+        ]
+
+    def lower_unary_op_node(self, node, target):
+        operand = self.new_temp()
+        return self.lower(node.node, operand) + [
+            ast.Assign(targets=[name(target, True)], value=unary(node, name(operand)))
+        ]
+
+    def lower_if_node(self, node, target):
+        if node.else_case:
+            body = self.lower(node.else_case, target)
+        else:
+            body = [ast.Assign(targets=[name(target, True)], value=ast.Constant(value=None))]
+
+        for condition, expr in reversed(node.cases):
+            if self.is_pure(condition):
+                body = [ast.If(test=self.test(condition), body=self.lower(expr, target), orelse=body)]
+            else:
+                condition_value = self.new_temp()
+                body = self.lower(condition, condition_value) + [ast.If(
+                    test=compare(name(condition_value), ast.NotEq, ast.Constant(value=0)),
+                    body=self.lower(expr, target), orelse=body
+                )]
+        return body
+
+    def lower_while_node(self, node, target):
+        body = self.lower(node.body_node, '__discard')
+        if self.is_pure(node.condition_node):
+            loop = ast.While(test=self.test(node.condition_node), body=body, orelse=[])
+        else:
+            condition_value = self.new_temp()
+            loop = ast.While(
+                test=ast.Constant(value=True),
+                body=self.lower(node.condition_node, condition_value) + [ast.If(
+                    test=compare(name(condition_value), ast.Eq, ast.Constant(value=0)), body=[ast.Break()], orelse=[]
+                )] + body,
+                orelse=[]
+            )
+        resets = [
+            ast.Assign(targets=[name(self.invariant_name(invariant), True)], value=name('__unset'))
+            for invariant in node.invariants
+        ]
+        return resets + [loop, ast.Assign(targets=[name(target, True)], value=ast.Constant(value=None))]
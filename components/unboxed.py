@@ -0,0 +1,131 @@
+from components.errors import Abort, RTError
+from components.interpeter import RTResult, MAX_NUMBER, MIN_NUMBER, overflow_error, too_many_variables, variables_full
+from components.number import Number
+from components.parser import node_methods
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT
+)
+
+
+class UnboxedInterpreter:
+    # Walks the tree like Interpreter, but on plain ints and floats: no RTResult or Number per node.
+    # Values are boxed into Numbers only where they leave the evaluator, in the symbol table and the result.
+
+    def __init__(self):
+        self.visit_methods = node_methods(self, 'visit')
+        self.invariant_values = {}
+
+    def run(self, node, context):
+        res = RTResult()
+        try:
+            value = self.visit(node, context)
+        except Abort as abort:
+            return res.failure(abort.error)
+        return res.success(None if value is None else Number.box(value))
+
+    def visit(self, node, context):
+        return self.visit_methods[type(node).__name__](node, context)
+
+    @staticmethod
+    def visit_number_node(node, _context):
+        return node.tok.value
+
+    @staticmethod
+    def visit_var_access_node(node, context):
+        value = context.symbol_table.get(node.var_name_tok.value)
+        if value is None:
+            raise Abort(RTError(node.pos_start, node.pos_end, f"'{node.var_name_tok.value}' is not defined", context))
+        return value.value
+
+    def visit_var_assign_node(self, node, context):
+        return self.assign(node, self.visit(node.value_node, context), context)
+
+    @staticmethod
+    def assign(node, value, context):
+        if variables_full(context.symbol_table):
+            raise Abort(too_many_variables(context))
+        number = None if value is None else \
+            Number(value).set_context(context).set_pos(node.value_node.pos_start, node.value_node.pos_end)
+        context.symbol_table.set(node.var_name_tok.value, number)
+        return value
+
+    def visit_bin_op_node(self, node, context):
+        left = self.visit(node.left_node, context)
+        return self.operate(node, left, self.visit(node.right_node, context), context)
+
+    def operate(self, node, left, right, context):
+        op_type = node.op_tok.type
+
+        if op_type == PLUS:
+            result = left + right
+        elif op_type == MINUS:
+            result = left - right
+        elif op_type == MUL:
+            result = left * right
+        elif op_type == DIV:
+            if right == 0:
+                raise Abort(RTError(node.right_node.pos_start, node.right_node.pos_end, 'Division by zero', context))
+            result = left / right
+        elif op_type == EE:
+            return int(left == right)
+        elif op_type == NE:
+            return int(left != right)
+        elif op_type == LT:
+            return int(left < right)
+        elif op_type == GT:
+            return int(left > right)
+        elif op_type == LTE:
+            return int(left <= right)
+        elif op_type == GTE:
+            return int(left >= right)
+        elif node.op_tok.matches(KEYWORD, 'AND'):
+            return int(left and right)
+        elif node.op_tok.matches(KEYWORD, 'OR'):
+            return int(left or right)
+        else:
+            return None
+
+        if result > MAX_NUMBER or result < MIN_NUMBER:
+            raise Abort(overflow_error(result, node.pos_start, node.pos_end))
+        return result
+
+    def visit_unary_op_node(self, node, context):
+        return self.unary(node, self.visit(node.node, context))
+
+    @staticmethod
+    def unary(node, value):
+        if node.op_tok.type == MINUS:
+            return -value
+        if node.op_tok.matches(KEYWORD, 'NOT'):
+            return 1 if value == 0 else 0
+        return value
+
+    def visit_if_node(self, node, context):
+        for condition, expr in node.cases:
+            if self.visit(condition, context) != 0:
+                return self.visit(expr, context)
+        if node.else_case:
+            return self.visit(node.else_case, context)
+        return None
+
+    def visit_while_node(self, node, context):
+        for invariant in node.invariants:
+            self.invariant_values.pop(invariant, None)
+        visit, condition_node, body_node = self.visit, node.condition_node, node.body_node
+        while visit(condition_node, context) != 0:
+            visit(body_node, context)
+
+    def visit_invariant_node(self, node, context):
+        if node not in self.invariant_values:
+            self.invariant_values[node] = self.visit(node.node, context)
+        return self.invariant_values[node]
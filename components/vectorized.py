@@ -0,0 +1,191 @@
+try:
+    import numpy as np
+except ImportError:  # only the vectorized evaluator needs NumPy
+    np = None
+
+from components.errors import RTError, StackOverFlowError
+from components.interpeter import MAX_NUMBER, MIN_NUMBER, TOO_BIG, TOO_SMALL
+from components.token_types import (
+    GT,
+    LTE,
+    GTE,
+    EE,
+    NE,
+    MUL,
+    PLUS,
+    MINUS,
+    DIV,
+    KEYWORD,
+    LT
+)
+
+COMPARISONS = {
+    EE: lambda left, right: left == right,
+    NE: lambda left, right: left != right,
+    LT: lambda left, right: left < right,
+    GT: lambda left, right: left > right,
+    LTE: lambda left, right: left <= right,
+    GTE: lambda left, right: left >= right,
+}
+
+
+class VectorResult:
+    def __init__(self, values, missing, errors):
+        self.values = values    # one value per row
+        self.missing = missing  # rows without a value: no IF case matched, or the row failed
+        self.errors = errors    # (error, row indexes) pairs; a row is in at most one of them
+
+    def __len__(self):
+        return len(self.values)
+
+
+class VectorizedEvaluator:
+    """Evaluates one expression for every row of a set of columns at once, with a NumPy array per
+    variable. Each row gets what the interpreter would give for those variable values: IF becomes
+    masked selects, comparisons and AND/OR give 0/1 ints, and the overflow and division checks become
+    masks. A row stops at its first error, as the interpreter does, and the error is reported with
+    the indexes of the rows it stopped. Assignments and WHILE loops have no column-wise form."""
+
+    def __init__(self):
+        if np is None:
+            raise ImportError('The vectorized evaluator needs NumPy')
+        self.visit_methods = {
+            'NumberNode': self.visit_number_node,
+            'VarAccessNode': self.visit_var_access_node,
+            'BinOpNode': self.visit_bin_op_node,
+            'UnaryOpNode': self.visit_unary_op_node,
+            'IfNode': self.visit_if_node,
+            'InvariantNode': self.visit_invariant_node,
+        }
+        self.columns = {}
+        self.context = None
+        self.rows = 0
+        self.failed = None
+        self.errors = []
+
+    def run(self, node, columns, context=None):
+        # Variables missing from columns are looked up in the context, as one value for every row
+        self.columns = {name: np.asarray(column) for name, column in columns.items()}
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns must have the same length')
+        self.rows = lengths.pop() if lengths else 1
+        self.context = context
+        self.failed = np.zeros(self.rows, dtype=bool)
+        self.errors = []
+
+        values, missing = self.visit(node, np.ones(self.rows, dtype=bool))
+        missing = self.failed if missing is None else missing | self.failed
+        return VectorResult(values, missing, self.errors)
+
+    def visit(self, node, active):
+        # active: the rows this node is evaluated for; errors on the other rows are ignored
+        method = self.visit_methods.get(type(node).__name__)
+        if method is None:
+            raise ValueError(f"{type(node).__name__} can't be evaluated column-wise")
+        return method(node, active)
+
+    def fail(self, rows, error):
+        rows = rows & ~self.failed
+        if rows.any():
+            self.failed |= rows
+            self.errors.append((error, np.flatnonzero(rows)))
+
+    def require_values(self, missing, active, node):
+        # the interpreter has no defined behaviour for arithmetic on no value either
+        if missing is not None and (missing & active & ~self.failed).any():
+            raise ValueError(f'Expression at {node.pos_start.idx} has no value in rows '
+                             f'{np.flatnonzero(missing & active & ~self.failed).tolist()}')
+
+    def visit_number_node(self, node, _active):
+        return np.full(self.rows, node.tok.value), None
+
+    def visit_var_access_node(self, node, active):
+        var_name = node.var_name_tok.value
+        if var_name in self.columns:
+            return self.columns[var_name], None
+
+        value = self.context.symbol_table.get(var_name) if self.context else None
+        if value is None:
+            self.fail(active, RTError(node.pos_start, node.pos_end, f"'{var_name}' is not defined", self.context))
+            return np.zeros(self.rows, dtype=np.int64), None
+        return np.full(self.rows, value.value), None
+
+    def visit_bin_op_node(self, node, active):
+        left, missing = self.visit(node.left_node, active)
+        self.require_values(missing, active, node.left_node)
+        right, missing = self.visit(node.right_node, active)
+        self.require_values(missing, active, node.right_node)
+        op_type = node.op_tok.type
+
+        if op_type in COMPARISONS:
+            return COMPARISONS[op_type](left, right).astype(np.int64), None
+        if node.op_tok.matches(KEYWORD, 'AND'):
+            return np.where(left != 0, truncated(right), 0), None
+        if node.op_tok.matches(KEYWORD, 'OR'):
+            return np.where(left != 0, truncated(left), truncated(right)), None
+
+        checked = None
+        if op_type == PLUS:
+            result = left + right
+        elif op_type == MINUS:
+            result = left - right
+        elif op_type == MUL:
+            result = left * right
+            if result.dtype.kind == 'i':
+                # int64 can wrap where Python ints don't, the float product can't miss an overflow
+                checked = left.astype(np.float64) * right
+        elif op_type == DIV:
+            zero = right == 0
+            self.fail(active & zero, RTError(
+                node.right_node.pos_start, node.right_node.pos_end, 'Division by zero', self.context
+            ))
+            result = np.true_divide(left, np.where(zero, 1, right))
+        else:
+            return np.zeros(self.rows, dtype=np.int64), np.ones(self.rows, dtype=bool)
+
+        checked = result if checked is None else checked
+        self.fail(active & (checked > MAX_NUMBER), StackOverFlowError(node.pos_start, node.pos_end, TOO_BIG))
+        self.fail(active & (checked < MIN_NUMBER), StackOverFlowError(node.pos_start, node.pos_end, TOO_SMALL))
+        return result, None
+
+    def visit_unary_op_node(self, node, active):
+        values, missing = self.visit(node.node, active)
+        self.require_values(missing, active, node.node)
+        if node.op_tok.type == MINUS:
+            return -values, None
+        if node.op_tok.matches(KEYWORD, 'NOT'):
+            return (values == 0).astype(np.int64), None
+        return values, None
+
+    def visit_if_node(self, node, active):
+        remaining = active & ~self.failed
+        values = np.zeros(self.rows, dtype=np.int64)
+        missing = np.ones(self.rows, dtype=bool)
+
+        branches = []
+        for condition, expr in node.cases:
+            condition_values, condition_missing = self.visit(condition, remaining)
+            self.require_values(condition_missing, remaining, condition)
+            taken = remaining & (condition_values != 0) & ~self.failed
+            remaining = remaining & ~taken & ~self.failed
+            branches.append((expr, taken))
+        if node.else_case:
+            branches.append((node.else_case, remaining))
+
+        for expr, taken in branches:
+            if not taken.any():
+                continue
+            branch_values, branch_missing = self.visit(expr, taken)
+            values = np.where(taken, branch_values, values)
+            missing[taken] = False if branch_missing is None else branch_missing[taken]
+        return values, missing
+
+    def visit_invariant_node(self, node, active):
+        # evaluated once per call anyway, so there is nothing to memoize
+        return self.visit(node.node, active)
+
+
+def truncated(values):
+    # int() of each value, as AND/OR give in the interpreter
+    return values if values.dtype.kind in 'iub' else np.trunc(values).astype(np.int64)
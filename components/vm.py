@@ -0,0 +1,144 @@
+from components.compiler import (
+    LOAD_CONST,
+    LOAD_NAME,
+    STORE_NAME,
+    ADD,
+    SUB,
+    MUL_OP,
+    DIV_OP,
+    EQ_OP,
+    NE_OP,
+    LT_OP,
+    GT_OP,
+    LTE_OP,
+    GTE_OP,
+    AND_OP,
+    OR_OP,
+    NEG,
+    NOT_OP,
+    POP,
+    JUMP,
+    POP_JUMP_IF_FALSE,
+    LOAD_INVARIANT,
+    STORE_INVARIANT,
+    RESET_INVARIANT
+)
+from components.errors import RTError
+from components.interpeter import RTResult, MAX_NUMBER, MIN_NUMBER, overflow_error, too_many_variables, variables_full
+from components.number import Number
+
+UNSET = object()
+
+
+class VirtualMachine:
+    def run(self, bytecode, context):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+        # one flat dispatch loop with everything it touches in locals: splitting it up would put a call
+        # back on every instruction, which is what the VM is there to avoid
+        res = RTResult()
+        code = bytecode.code
+        constants = bytecode.constants
+        names = bytecode.names
+        symbol_table = context.symbol_table
+        values = symbol_table.values
+        slots = list(bytecode.resolver.resolve(symbol_table))
+        max_number = MAX_NUMBER
+        min_number = MIN_NUMBER
+        invariant_ends = bytecode.invariant_ends
+        invariants = [UNSET] * len(invariant_ends)
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        end = len(code)
+
+        while pc < end:
+            opcode = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+
+            if opcode == LOAD_NAME:
+                slot = slots[arg]
+                value = values[slot] if slot is not None else None
+                if value is None:
+                    value = symbol_table.get(names[arg])
+                if value is None:
+                    pos_start, pos_end = bytecode.position_at(pc - 2)
+                    return res.failure(RTError(pos_start, pos_end, f"'{names[arg]}' is not defined", context))
+                push(value.value)
+            elif opcode == LOAD_CONST:
+                push(constants[arg])
+            elif opcode == POP_JUMP_IF_FALSE:
+                if pop() == 0:
+                    pc = arg
+            elif opcode == JUMP:
+                pc = arg
+            elif opcode <= DIV_OP:
+                right = pop()
+                left = stack[-1]
+                if opcode == ADD:
+                    result = left + right
+                elif opcode == SUB:
+                    result = left - right
+                elif opcode == MUL_OP:
+                    result = left * right
+                else:
+                    if right == 0:
+                        pos_start, pos_end = bytecode.position_at(pc - 2)
+                        return res.failure(RTError(pos_start, pos_end, 'Division by zero', context))
+                    result = left / right
+
+                if result > max_number or result < min_number:
+                    pos_start, pos_end = bytecode.position_at(pc - 2)
+                    return res.failure(overflow_error(result, pos_start, pos_end))
+                stack[-1] = result
+            elif opcode <= OR_OP:
+                right = pop()
+                left = stack[-1]
+                if opcode == EQ_OP:
+                    stack[-1] = int(left == right)
+                elif opcode == NE_OP:
+                    stack[-1] = int(left != right)
+                elif opcode == LT_OP:
+                    stack[-1] = int(left < right)
+                elif opcode == GT_OP:
+                    stack[-1] = int(left > right)
+                elif opcode == LTE_OP:
+                    stack[-1] = int(left <= right)
+                elif opcode == GTE_OP:
+                    stack[-1] = int(left >= right)
+                elif opcode == AND_OP:
+                    stack[-1] = int(left and right)
+                else:
+                    stack[-1] = int(left or right)
+            elif opcode == STORE_NAME:
+                if variables_full(symbol_table):
+                    return res.failure(too_many_variables(context))
+                value = stack[-1]
+                if value is not None:
+                    pos_start, pos_end = bytecode.position_at(pc - 2)
+                    value = Number(value).set_context(context).set_pos(pos_start, pos_end)
+                slot = slots[arg]
+                if slot is None:
+                    slot = slots[arg] = symbol_table.define(names[arg])
+                values[slot] = value
+            elif opcode == NEG:
+                stack[-1] = -stack[-1]
+            elif opcode == NOT_OP:
+                stack[-1] = 1 if stack[-1] == 0 else 0
+            elif opcode == POP:
+                pop()
+            elif opcode == LOAD_INVARIANT:
+                if invariants[arg] is not UNSET:
+                    push(invariants[arg])
+                    pc = invariant_ends[arg]
+            elif opcode == STORE_INVARIANT:
+                invariants[arg] = stack[-1]
+            elif opcode == RESET_INVARIANT:
+                invariants[arg] = UNSET
+            else:
+                raise ValueError(f'Unknown opcode {opcode}')
+
+        value = stack.pop() if stack else None
+        if value is None:
+            return res.success(None)
+        return res.success(Number(value).set_context(context))
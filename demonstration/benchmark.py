@@ -0,0 +1,189 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from components.interpeter import Interpreter
+from components.parser import Parser
+from components.tokenizer import RegexLexer
+from runner import Session
+
+MIN_SECONDS = 0.2   # each measurement repeats until it took at least this long
+MAX_REPEATS = 50
+RECURSION_LIMIT = 100000
+DEFAULT_THRESHOLD = 0.1
+
+
+class Workload:
+    def __init__(self, name, make_program, sizes, full_sizes, setup=lambda size: ()):
+        self.name = name
+        self.make_program = make_program
+        self.sizes = sizes
+        self.full_sizes = full_sizes
+        self.setup = setup  # statements run in the session first, e.g. to bind variables
+
+    def session(self, size):
+        session = Session(cache=False)
+        for statement in self.setup(size):
+            session.run(statement)
+        return session
+
+
+WORKLOADS = [
+    Workload('arithmetic_chain', lambda size: '1' + '+2-1' * size, [100, 500, 1000], [100, 1000, 10000, 20000]),
+    # parentheses nest the tree, which the tree interpreter walks a frame per level
+    Workload('deep_parentheses', lambda size: '(' * size + '1' + '+1)' * size, [10, 50, 100], [10, 50, 100, 150]),
+    Workload('if_elif_chain',
+             lambda size: 'IF x == 0 THEN 0' + ''.join(f' ELIF x == {i} THEN {i}' for i in range(1, size)) +
+                          ' ELSE IF x > 0 THEN x ELSE 0',
+             [10, 100, 1000], [10, 100, 1000, 10000], setup=lambda size: (f'VAR x = {size - 1}',)),
+    Workload('while_loop', lambda size: f'IF (VAR i = {size}) THEN WHILE i > 0 THEN VAR i = i - 1',
+             [10 ** 3, 10 ** 4], [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]),
+]
+
+
+def measure(operation):
+    # returns the run times of operation, repeated until MIN_SECONDS or MAX_REPEATS
+    times = []
+    while not times or (sum(times) < MIN_SECONDS and len(times) < MAX_REPEATS):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_memory(operation):
+    # tracemalloc walks the whole stack on every allocation, so this costs time quadratic in the
+    # recursion depth: fine at the default sizes, but worth skipping with --no-memory on --full runs
+    tracemalloc.start()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_workload(workload, size, engine='tree', memory=True):
+    text = workload.make_program(size)
+    tokens, error = RegexLexer(text).generate_tokens()
+    assert error is None, error.as_string()
+    node = Parser(tokens).parse().node
+
+    def interpret():
+        session = workload.session(size)
+        Interpreter().run(node, session.context)
+
+    def end_to_end():
+        _, run_error = workload.session(size).run(text, engine)
+        assert run_error is None, run_error.as_string()
+
+    phases = {
+        'lex': lambda: RegexLexer(text).generate_tokens(),
+        'parse': lambda: Parser(tokens).parse(),
+        'interpret': interpret,
+        'end_to_end': end_to_end,
+    }
+    results = []
+    for phase, operation in phases.items():
+        result = {
+            'workload': workload.name,
+            'size': size,
+            'phase': phase,
+            'engine': engine if phase == 'end_to_end' else 'tree',
+        }
+        try:
+            times = measure(operation)
+            peak_bytes = peak_memory(operation) if memory else None
+        except RecursionError:
+            # deeper than the recursive interpreter can go, even with the raised limit
+            result['skipped'] = 'RecursionError'
+        else:
+            result.update({
+                'repeats': len(times),
+                'min_s': min(times),
+                'median_s': statistics.median(times),
+                'ops_per_sec': 1 / statistics.median(times),
+                'peak_bytes': peak_bytes,
+            })
+        results.append(result)
+    return results
+
+
+def report_line(result):
+    line = f"{result['workload']:<18}{result['size']:>10} {result['phase']:<11}"
+    if 'skipped' in result:
+        return f"{line}{'skipped, ' + result['skipped']:>30}"
+    peak = '' if result['peak_bytes'] is None else f"{result['peak_bytes'] / 1024:>12.1f} KiB"
+    return f"{line}{result['median_s'] * 1000:>12.3f} ms{result['ops_per_sec']:>12.1f} ops/s{peak}"
+
+
+def run_suite(workloads=None, full=False, engine='tree', memory=True, report=print):
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, RECURSION_LIMIT))
+    results = []
+    try:
+        for workload in workloads or WORKLOADS:
+            for size in workload.full_sizes if full else workload.sizes:
+                for result in benchmark_workload(workload, size, engine, memory):
+                    report(report_line(result))
+                    results.append(result)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'engine': engine,
+            'full': full,
+            'memory': memory,
+        },
+        'results': results,
+    }
+
+
+def regressions(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # measurements whose median got more than threshold slower than in the baseline run
+    before = {(result['workload'], result['size'], result['phase'], result['engine']): result
+              for result in baseline['results']}
+    slower = []
+    for result in current['results']:
+        old = before.get((result['workload'], result['size'], result['phase'], result['engine']))
+        if old and 'median_s' in old and 'median_s' in result and \
+                result['median_s'] > old['median_s'] * (1 + threshold):
+            slower.append((result, result['median_s'] / old['median_s'] - 1))
+    return slower
+
+
+def main():
+    arguments = argparse.ArgumentParser(description='Benchmarks for the lexer, parser and interpreter')
+    arguments.add_argument('--full', action='store_true', help='include the largest sizes, up to 10^7 iterations')
+    arguments.add_argument('--engine', default='tree', help='engine for the end-to-end measurements')
+    arguments.add_argument('--no-memory', action='store_true', help="don't measure peak memory, which is slow")
+    arguments.add_argument('--workload', action='append', help='only run this workload (repeatable)')
+    arguments.add_argument('--output', help='save the results to this JSON file')
+    arguments.add_argument('--compare', help='flag regressions against the results in this JSON file')
+    arguments.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                           help='slowdown that counts as a regression, 0.1 being 10%%')
+    options = arguments.parse_args()
+
+    selected = [workload for workload in WORKLOADS if not options.workload or workload.name in options.workload]
+    suite = run_suite(selected, options.full, options.engine, not options.no_memory,
+                      lambda line: print(line, flush=True))
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as output:
+            json.dump(suite, output, indent=2)
+
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as baseline_file:
+            found = regressions(suite, json.load(baseline_file), options.threshold)
+        for slower, slowdown in found:
+            print(f"REGRESSION {slower['workload']} {slower['size']} {slower['phase']}: {slowdown:.0%} slower")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+from server import EvaluationServer, EvaluationClient, DEFAULT_HOST
+
+PROGRAMS = [
+    "6+3*2-1",
+    "IF 5==3 THEN 1 ELIF 5<3 THEN 2 ELSE 3",
+    "NOT 5<3 AND 2>=2",
+    "(1.5 + 2) * (3 - 4) / 2",
+]
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def client_load(client, requests, engine, latencies):
+    for i in range(requests):
+        start = time.perf_counter()
+        _, error = await client.evaluate(PROGRAMS[i % len(PROGRAMS)], engine)
+        latencies.append(time.perf_counter() - start)
+        assert error is None, error
+
+
+async def load_test(clients, requests, engine, *, host=DEFAULT_HOST, port=None, path=None):
+    server = None
+    if port is None and path is None:
+        # nothing to connect to given, so test a server of our own
+        server = EvaluationServer()
+        await server.start(DEFAULT_HOST, 0)
+        host, port = server.address[:2]
+
+    connections = [await EvaluationClient.connect(host, port, path) for _ in range(clients)]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client_load(client, requests, engine, latencies) for client in connections))
+    elapsed = time.perf_counter() - start
+    for client in connections:
+        await client.close()
+
+    print(f'{len(latencies)} requests from {clients} clients in {elapsed:.2f}s '
+          f'({len(latencies) / elapsed:.0f} requests/s)')
+    print(f'p50 {percentile(latencies, 0.5) * 1000:.2f}ms, p99 {percentile(latencies, 0.99) * 1000:.2f}ms, '
+          f'mean {statistics.mean(latencies) * 1000:.2f}ms')
+    if server:
+        print(f'{server.batches} batches, {server.requests / server.batches:.1f} requests per batch')
+        await server.close()
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Load test for server.EvaluationServer')
+    arguments.add_argument('--clients', type=int, default=50)
+    arguments.add_argument('--requests', type=int, default=200, help='requests per client')
+    arguments.add_argument('--engine', default='tree')
+    arguments.add_argument('--host', default=DEFAULT_HOST)
+    arguments.add_argument('--port', type=int, help='test a running server instead of an in-process one')
+    arguments.add_argument('--unix', help="a running server's Unix socket")
+    options = arguments.parse_args()
+    asyncio.run(load_test(options.clients, options.requests, options.engine, host=options.host, port=options.port,
+                          path=options.unix))
@@ -1,11 +1,74 @@
+import asyncio
+import json
+import io
+import os
+import threading
+import pickle
+import sys
+import tracemalloc
+
+import pytest
+
 from components.errors import (
     RTError,
     InvalidSyntaxError,
     TooManyVariablesError,
     TooManyNestedError,
-    StackOverFlowError
+    StackOverFlowError,
+    BudgetExceededError
 )
-from runner import run
+from components.number import Number
+from components.compact import CompactTree
+from components.compiler import Compiler
+from components.interpeter import Interpreter
+from components.scheduler import Scheduler
+from components.loop_invariants import InvariantNode
+from components.optimizer import Optimizer, optimize_ast
+from components.parse_cache import DiskCache, ParseCache
+from components.parser import Parser
+from components.token_types import INT, PLUS, EOF
+from components.tokenizer import Lexer, RegexLexer, Position, Source
+from components.vm import VirtualMachine
+from components.hot_loops import hot_loops, HOT_LOOP_THRESHOLD
+from server import EvaluationServer, EvaluationClient
+from demonstration import benchmark
+from demonstration.benchmark import Workload, run_suite, regressions
+from runner import run, run_many, Session, evaluate_columns, run_stream, run_program, run_file, parse, parse_cache, Context, SymbolTable, ENGINES, transpiled_programs, default_session, compact_trees
+
+
+def make_context():
+    # A fresh symbol table, so results don't depend on variables left behind by other tests
+    symbol_table = SymbolTable()
+    symbol_table.set("FALSE", Number.FALSE)
+    symbol_table.set("TRUE", Number.TRUE)
+    context = Context('<program>')
+    context.symbol_table = symbol_table
+    return context
+
+
+def run_isolated(text, engine='tree', context=None, optimize=False):
+    context = context or make_context()
+    node, error = parse(text, cache=False)
+    if error:
+        return None, error
+    if optimize:
+        node = optimize_ast(node)
+    result = ENGINES[engine](node, context)
+    return result.value, result.error
+
+
+PROGRAMS = [
+    "6+3*2-1",
+    "6/3",
+    "-(2+3)*4",
+    "NOT 5<3 AND 2>=2",
+    "1.5 AND 0 OR 2",
+    "IF 5==3 THEN 1 ELIF 5<3 THEN 2 ELSE 3",
+    "IF 0 THEN 1",
+    "VAR x=3",
+    "TRUE + FALSE",
+    "WHILE FALSE THEN 1",
+]
 
 
 class TestNumbersArithmetic:
@@ -98,12 +161,16 @@ class TestNumbersOperations:
 
 
 class TestVariable:
+    def setup_method(self):
+        # a session per test, so variables don't leak from one test into another
+        self.session = Session()
+
     def test_variable(self):
-        result, error = run("VAR x=3")
+        result, error = self.session.run("VAR x=3")
         assert result.value == 3, error
 
     def test_variable_error(self):
-        _, error = run("VAR 2")
+        _, error = self.session.run("VAR 2")
         assert isinstance(error, InvalidSyntaxError) and error.details == "Expected identifier"
 
 
@@ -130,36 +197,901 @@ class TestIf:
 
 
 class TestWhile:
+    def setup_method(self):
+        self.session = Session()
+
     def test_while(self):
-        run("VAR x=3")
-        _, error = run("WHILE x>0 THEN VAR x=x-1")
+        self.session.run("VAR x=3")
+        _, error = self.session.run("WHILE x>0 THEN VAR x=x-1")
         assert error is None
-        result, error = run("x")
+        result, error = self.session.run("x")
         assert result.value == 0, error
 
 
 class TestCustomError:
+    def setup_method(self):
+        self.session = Session()
+
     def test_too_many_variables_assigned(self):
-        run("VAR w=3")
-        run("VAR x=3")
-        run("VAR y=3")
-        _, error = run("VAR z=3")
+        self.session.run("VAR w=3")
+        self.session.run("VAR x=3")
+        self.session.run("VAR y=3")
+        _, error = self.session.run("VAR z=3")
         assert isinstance(error, TooManyVariablesError) and error.details == "Too Many Variables Assigned"
 
     def test_too_many_while_nested(self):
-        run("VAR x=3")
-        _, error = run("WHILE x>5 THEN WHILE x>3 THEN WHILE x>4 VAR x=x-1")
+        self.session.run("VAR x=3")
+        _, error = self.session.run("WHILE x>5 THEN WHILE x>3 THEN WHILE x>4 VAR x=x-1")
         assert isinstance(error, TooManyNestedError) and error.details == "'WHILE'"
 
     def test_too_many_if_nested(self):
-        run("VAR x=3")
-        _, error = run("IF x>5 THEN IF x>3 THEN IF x>4 VAR x=x-1")
+        self.session.run("VAR x=3")
+        _, error = self.session.run("IF x>5 THEN IF x>3 THEN IF x>4 VAR x=x-1")
         assert isinstance(error, TooManyNestedError) and error.details == "'IF'"
 
     def test_maximum_result(self):
-        _, error = run("2147483647 + 1")
+        _, error = self.session.run("2147483647 + 1")
         assert isinstance(error, StackOverFlowError) and error.details == "Result is too big"
+        assert error.as_string().endswith("2147483647 + 1\n^^^^^^^^^^^^^^")
 
     def test_minimum_result(self):
-        _, error = run("-2147483648 - 1")
+        _, error = self.session.run("-2147483648 - 1")
         assert isinstance(error, StackOverFlowError) and error.details == "Result is too small"
+
+
+class TestParseCache:
+    def test_hit_skips_parsing(self):
+        parse_cache.clear()
+        node, _ = parse("1+2*3")
+        assert parse("1+2*3")[0] is node
+        assert parse_cache.stats() == {'size': 1, 'bytes': 5, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+    def test_errors_are_cached(self):
+        parse_cache.clear()
+        _, error = parse("VAR 2")
+        assert "VAR 2" in parse_cache and parse("VAR 2")[1] is error
+
+    def test_capacity_eviction(self):
+        cache = ParseCache(capacity=2)
+        for text in ("1", "2", "3"):
+            cache.put(text, None, None)
+        assert "1" not in cache and len(cache) == 2 and cache.evictions == 1
+
+    def test_byte_limit_eviction(self):
+        cache = ParseCache(max_bytes=4)
+        cache.put("11", None, None)
+        cache.put("22", None, None)
+        cache.get("11")
+        cache.put("33", None, None)
+        assert "22" not in cache and "11" in cache and cache.bytes == 4
+
+
+class TestDiskCache:
+    def test_restart_loads_the_tree(self, tmp_path):
+        session = Session(cache=DiskCache(tmp_path))
+        assert session.run("VAR y = 6 * 7")[0].value == 42
+        restarted = DiskCache(tmp_path)
+        node, error = parse("VAR y = 6 * 7", restarted)
+        assert error is None and restarted.stats()['loads'] == 1 and restarted.stats()['writes'] == 0
+        assert Interpreter().run(node, make_context()).value.value == 42
+        _, error = Session(cache=DiskCache(tmp_path)).run("1 + (2 * nope)")
+        _, loaded_error = Session(cache=DiskCache(tmp_path)).run("1 + (2 * nope)")
+        assert loaded_error.pos_start.idx == error.pos_start.idx == 9 and loaded_error.pos_end.idx == 13
+
+    def test_corrupt_entries_are_rebuilt(self, tmp_path):
+        cache = DiskCache(tmp_path)
+        parse("1 + 2", cache)
+        path = tmp_path / os.path.basename(cache.path("1 + 2"))
+        data = path.read_bytes()
+        for damaged in (data[:-3], data[:-1] + bytes([data[-1] ^ 1]), b''):
+            path.write_bytes(damaged)
+            restarted = DiskCache(tmp_path)
+            assert restarted.get("1 + 2") is None and restarted.stats()['rebuilt'] == 1 and not path.exists()
+            assert parse("1 + 2", restarted)[0].op_tok.type == PLUS and path.read_bytes() == data
+
+    def test_errors_are_not_written(self, tmp_path):
+        cache = DiskCache(tmp_path)
+        _, error = parse("VAR 2", cache)
+        assert parse("VAR 2", cache)[1] is error and not os.listdir(tmp_path)
+
+    def test_round_trip(self):
+        node = optimize_ast(parse("WHILE x > a*2+1 THEN VAR x = IF NOT x THEN 0 ELSE x - 1.5", cache=False)[0])
+        data = CompactTree.from_node(node).to_bytes()
+        loaded = CompactTree.from_bytes(data, node.condition_node.left_node.var_name_tok.source).to_node()
+        assert CompactTree.from_node(loaded).to_bytes() == data and len(loaded.invariants) == 1
+        with pytest.raises(ValueError):
+            CompactTree.from_bytes(data[:4] + b'\xff' + data[5:], None)
+
+
+class TestOptimizer:
+    def test_constant_folding(self):
+        node, _ = parse("2*3+(x+1)*1-0", cache=False)
+        node = optimize_ast(node)
+        assert node.left_node.tok.value == 6
+        assert node.right_node.op_tok.type == 'PLUS'
+
+    def test_same_results(self):
+        for program in PROGRAMS + ["NOT NOT 5", "NOT NOT (3>2)", "+3 - -2", "1.5*1", "2.5 AND 0.5"]:
+            expected, _ = run_isolated(program)
+            result, error = run_isolated(program, optimize=True)
+            assert error is None, program
+            assert (result and result.value) == (expected and expected.value), program
+
+    def test_if_pruning(self):
+        node = Optimizer().optimize(parse("IF 1<0 THEN x ELIF 2>1 THEN 7 ELSE y", cache=False)[0])
+        assert node.tok.value == 7
+
+    def test_constant_errors_kept(self):
+        _, error = run_isolated("2147483647 + 1", optimize=True)
+        assert isinstance(error, StackOverFlowError) and error.details == "Result is too big"
+        _, error = run_isolated("6/(3-3)", optimize=True)
+        assert isinstance(error, RTError) and error.details == "Division by zero"
+        for program in ("2147483648+0", "0+2147483648", "2147483648*1", "(VAR x=3000000000) AND x*1"):
+            _, error = run_isolated(program, optimize=True)
+            assert isinstance(error, StackOverFlowError) and error.details == "Result is too big", program
+
+
+class TestLoopInvariants:
+    def test_guard_is_hoisted(self):
+        node = optimize_ast(parse("WHILE x > a*2+1 THEN VAR x=x-1", cache=False)[0])
+        assert isinstance(node.condition_node.right_node, InvariantNode)
+        assert node.invariants == (node.condition_node.right_node,)
+
+    def test_assigned_variables_stay(self):
+        node = optimize_ast(parse("WHILE x > a*2 THEN VAR a=a-1", cache=False)[0])
+        assert not node.invariants
+
+    def test_all_engines(self):
+        for engine in ENGINES:
+            context = make_context()
+            run_isolated("VAR a=3", engine, context)
+            run_isolated("VAR x=50", engine, context)
+            _, error = run_isolated("WHILE x > a*2+1 THEN VAR x=x-(a-2)", engine, context, True)
+            assert error is None, engine
+            result, error = run_isolated("x", engine, context)
+            assert result.value == 7, engine
+
+    def test_errors_keep_their_place(self):
+        for engine in ENGINES:
+            _, error = run_isolated("WHILE 1/0 > 0 THEN 1", engine, optimize=True)
+            assert isinstance(error, RTError) and error.details == "Division by zero", engine
+
+
+class TestSlotResolution:
+    def test_slots_follow_new_globals(self):
+        bytecode = Compiler().compile(parse("TRUE + y", cache=False)[0])
+        context = make_context()
+        result = VirtualMachine().run(bytecode, context)
+        assert isinstance(result.error, RTError)
+
+        context.symbol_table.set("y", Number(41))
+        result = VirtualMachine().run(bytecode, context)
+        assert result.value.value == 42, result.error
+
+    def test_shadowing_a_parent_name(self):
+        bytecode = Compiler().compile(parse("TRUE", cache=False)[0])
+        context = make_context()
+        child = SymbolTable()
+        child.parent = context.symbol_table
+        context.symbol_table = child
+        assert VirtualMachine().run(bytecode, context).value.value == 1
+
+        child.set("TRUE", Number(7))
+        assert VirtualMachine().run(bytecode, context).value.value == 7
+
+    def test_stores_allocate_slots(self):
+        context = make_context()
+        run_isolated("VAR x=1", 'vm', context)
+        assert context.symbol_table.values[context.symbol_table.slot_of("x")].value == 1
+        _, error = run_isolated("(VAR y=1) + (VAR z=1) + (VAR w=1)", 'vm', context)
+        assert isinstance(error, TooManyVariablesError)
+
+
+class TestNumberRepresentation:
+    def test_compact_numbers(self):
+        value = 10 ** 6
+        tracemalloc.start()
+        numbers = [Number(value) for _ in range(10000)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(numbers) == 10000 and size / 10000 < 100
+
+    def test_interned_numbers_are_not_changed(self):
+        boxed = Number.box(1)
+        assert boxed is Number.TRUE and Number.box(0) is Number.FALSE
+        assert boxed.set_context(make_context()) is not boxed and Number.TRUE.context is None
+
+    def test_unboxed_allocates_less(self):
+        node, _ = parse("1" + "+1" * 300, cache=False)
+        peaks = {}
+        for engine in ('tree', 'unboxed'):
+            context = make_context()
+            tracemalloc.start()
+            result = ENGINES[engine](node, context)
+            _, peaks[engine] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert result.value.value == 301
+        assert peaks['unboxed'] * 2 < peaks['tree']
+
+
+class TestPositions:
+    def test_line_and_column_from_offset(self):
+        source = Source("ab\ncd\n\nefg")
+        assert [Position(idx, txt=source).ln for idx in (0, 2, 3, 6, 8, 10)] == [0, 0, 1, 2, 3, 3]
+        assert Position(8, txt=source).col == 1 and source.line(3) == "efg"
+
+    def test_tokens_share_the_source(self):
+        tokens, _ = Lexer("12 + abc").generate_tokens()
+        assert tokens[0].pos_start.source is tokens[2].pos_end.source
+        assert (tokens[2].pos_start.idx, tokens[2].pos_end.idx) == (5, 8)
+
+    def test_error_rendering(self):
+        _, error = run_isolated("1 + (2 * nope)")
+        assert error.as_string().endswith("1 + (2 * nope)\n         ^^^^")
+
+    def test_node_positions_are_lazy(self):
+        tokens, _ = RegexLexer("VAR y = -(1 + 2) * 3").generate_tokens()
+        node = Parser(tokens).parse().node
+        assert all(token.pos_start_cache is None and token.pos_end_cache is None for token in tokens[:-1])
+        assert (node.pos_start.idx, node.pos_end.idx) == (4, 20) and node.value_node.left_node.pos_start.idx == 8
+
+    def test_positions_of_deep_trees(self):
+        node, _ = parse('1' + '+1' * 5000, cache=False)
+        assert (node.pos_start.idx, node.pos_end.idx) == (0, 10001)
+
+
+class TestParser:
+    EXPR_EXPECTED = "Expected 'VAR', int, float, identifier, '+', '-', '(' or 'NOT'"
+    COMPARE_EXPECTED = "Expected int, float, identifier, '+', '-', '(' or 'NOT'"
+    FACTOR_EXPECTED = "Expected int, float, identifier, '+', '-', '('"
+    SAMPLES = {
+        "VAR x = 12.5 * (y - 3) / -4": '(VAR x (DIV (MUL 12.5 (MINUS y 3)) (MINUS 4)))',
+        "NOT a == b AND NOT NOT c OR d < e <= f": '(OR (AND (NOT (EE a b)) (NOT (NOT c))) (LTE (LT d e) f))',
+        "IF a THEN (IF b THEN 1 ELSE 2) ELIF c THEN WHILE d THEN VAR d = d - 1":
+            '(IF a (IF b 1 2) c (WHILE d (VAR d (MINUS d 1))))',
+        "-(1 + 2) * +3 - 4 / 5": '(MINUS (MUL (MINUS (PLUS 1 2)) (PLUS 3)) (DIV 4 5))',
+        "": (EXPR_EXPECTED, 0),
+        ")": (EXPR_EXPECTED, 0),
+        "1 +": (FACTOR_EXPECTED, 3),
+        "1 AND )": (COMPARE_EXPECTED, 6),
+        "NOT )": (COMPARE_EXPECTED, 4),
+        "- NOT 1": (FACTOR_EXPECTED, 2),
+        "1 == NOT 2": (FACTOR_EXPECTED, 5),
+        "(1 2": ("Expected ')'", 3),
+        "IF 1 2": ("Expected 'THEN'", 5),
+        "WHILE 1 THEN": (EXPR_EXPECTED, 12),
+        "VAR 1": ("Expected identifier", 4),
+        "VAR x 1": ("Expected '='", 6),
+        "1 + VAR x = 2": (FACTOR_EXPECTED, 4),
+        "(VAR x = 1) 2": ("Expected '+', '-', '*', '/', '^', '==', '!=', '<', '>', <=', '>=', 'AND' or 'OR'", 12),
+        "IF 1 THEN 2 ELSE": (EXPR_EXPECTED, 16),
+    }
+
+    @staticmethod
+    def show(node):
+        # the tree as an s-expression, operators by token type
+        show = TestParser.show
+        node_type_name = type(node).__name__
+        if node_type_name == 'NumberNode':
+            return str(node.tok.value)
+        if node_type_name == 'VarAccessNode':
+            return node.var_name_tok.value
+        if node_type_name == 'VarAssignNode':
+            return f'(VAR {node.var_name_tok.value} {show(node.value_node)})'
+        if node_type_name == 'BinOpNode':
+            return f'({node.op_tok.value or node.op_tok.type} {show(node.left_node)} {show(node.right_node)})'
+        if node_type_name == 'UnaryOpNode':
+            return f'({node.op_tok.value or node.op_tok.type} {show(node.node)})'
+        if node_type_name == 'IfNode':
+            cases = ''.join(f' {show(condition)} {show(expr)}' for condition, expr in node.cases)
+            return f"(IF{cases}{' ' + show(node.else_case) if node.else_case else ''})"
+        return f'(WHILE {show(node.condition_node)} {show(node.body_node)})'
+
+    def test_trees_and_errors(self):
+        for text, expected in self.SAMPLES.items():
+            ast = Parser(RegexLexer(text).generate_tokens()[0]).parse()
+            assert (self.show(ast.node) if not ast.error else (ast.error.details, ast.error.pos_start.idx)) == \
+                expected, text
+
+    def test_deeper_than_the_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 2
+        text = '(' * depth + '1' + ')' * depth
+        node, error = parse(text, cache=False)
+        assert error is None and node.tok.value == 1
+        assert [(value.value, error) for value, error in run_program('1;' + text, 'stack')] == [(1, None)] * 2
+
+
+class TestRegexLexer:
+    SAMPLES = [
+        "VAR x = 12.5 * (y - 3) / 4",
+        "IF a >= 1 AND b != 2 THEN c ELIF NOT d THEN e <= 5 ELSE f == 6",
+        "1 + $",
+        "1 !x",
+        "a ! = b",
+        "IF 1 THEN IF 2 THEN IF 3 THEN 4",
+        "IF 1 THEN 2 ELSE $",
+        "1.2.3..4",
+        "x_1\t<\t>",
+    ]
+
+    @staticmethod
+    def outcome(lexer):
+        tokens, error = lexer.generate_tokens()
+        return (
+            [(tok.type, tok.value, tok.pos_start.idx, tok.pos_end.idx) for tok in tokens],
+            error and (error.error_name, error.details, error.pos_start.idx, error.pos_end.idx)
+        )
+
+    def test_same_tokens_and_errors_as_lexer(self):
+        for text in self.SAMPLES:
+            assert self.outcome(RegexLexer(text)) == self.outcome(Lexer(text)), text
+
+    def test_trailing_whitespace(self):
+        tokens, error = RegexLexer("1 + 2 \t").generate_tokens()
+        assert error is None and [tok.type for tok in tokens] == [INT, PLUS, INT, EOF]
+
+    def test_positions_are_lazy(self):
+        tokens, _ = RegexLexer("abc + 1").generate_tokens()
+        assert tokens[0].pos_start_cache is None
+        assert tokens[0].pos_start.col == 0 and tokens[2].pos_end.idx == 7
+
+
+class TestProgram:
+    def test_one_result_per_statement(self):
+        outcomes = run_program("VAR x = 2; x * 3\n\nx + nope;;\n  IF x THEN 7\n", context=make_context())
+        assert [result and result.value for result, _ in outcomes] == [2, 6, None, 7]
+        assert [type(error) for _, error in outcomes] == [type(None), type(None), RTError, type(None)]
+
+    def test_same_as_separate_runs(self):
+        for engine in ENGINES:
+            outcomes = run_program("\n".join(PROGRAMS), engine, context=make_context())
+            expected = [run_isolated(program) for program in PROGRAMS]
+            assert [(result and result.value, error) for result, error in outcomes] == \
+                   [(result and result.value, error) for result, error in expected], engine
+
+    def test_syntax_error_stops_everything(self):
+        context = make_context()
+        outcomes = run_program("VAR x = 1\nx +\nVAR x = 2", context=context)
+        assert len(outcomes) == 1 and isinstance(outcomes[0][1], InvalidSyntaxError)
+        assert outcomes[0][1].pos_start.ln == 1
+        assert context.symbol_table.get("x") is None
+
+    def test_nesting_limit_is_per_statement(self):
+        outcomes = run_program("IF 1 THEN 2; IF 1 THEN 3\nWHILE 0 THEN 1; WHILE 0 THEN 2", context=make_context())
+        assert [error for _, error in outcomes] == [None] * 4
+        _, error = run_program("IF 1 THEN IF 1 THEN IF 1 THEN 2; 3", context=make_context())[0]
+        assert isinstance(error, TooManyNestedError)
+
+    def test_run_file(self, tmp_path):
+        script = tmp_path / "script.txt"
+        script.write_text("VAR x = 4\r\nx * x\n1 / (x - 4)\n")
+        outcomes = run_file(script, context=make_context())
+        assert [result and result.value for result, _ in outcomes] == [4, 16, None]
+        assert outcomes[2][1].details == "Division by zero"
+        assert outcomes[2][1].as_string().endswith("1 / (x - 4)\n     ^^^^^")
+
+        script.write_text("")
+        assert not run_file(script)
+
+    def test_bytes_lex_like_text(self):
+        text = "VAR x_1 = 12.5 * (y - 3) / 4 >= 2; a != b\n$"
+        assert TestRegexLexer.outcome(RegexLexer(text.encode(), program=True)) == \
+               TestRegexLexer.outcome(RegexLexer(text, program=True))
+
+
+class TestRunMany:
+    BATCH = PROGRAMS + ["1/0", "nope", "2147483647+1", "1 +", "(VAR w=1) + (VAR x=2) + (VAR y=3) + (VAR z=4)"]
+
+    @staticmethod
+    def summary(outcomes):
+        return [(result and result.value, error and (error.error_name, error.details, error.pos_start.idx))
+                for result, error in outcomes]
+
+    def test_same_as_isolated_runs(self):
+        expected = self.summary(run_isolated(program) for program in self.BATCH)
+        assert self.summary(run_many(self.BATCH, workers=1)) == expected
+        assert self.summary(run_many(self.BATCH * 3, workers=2)) == expected * 3
+
+    def test_programs_do_not_share_variables(self):
+        assert self.summary(run_many(["VAR a = 1", "a"], workers=2, chunksize=2))[1][1][1] == "'a' is not defined"
+
+    def test_error_records_pickle(self):
+        (_, record), = run_many(["1 + (2 * nope)"], workers=1)
+        _, error = run_isolated("1 + (2 * nope)")
+        copy = pickle.loads(pickle.dumps(record))
+        assert copy.error_type == 'RTError' and copy.as_string() == error.as_string()
+        assert pickle.loads(pickle.dumps(Number.TRUE)) is Number.TRUE
+
+
+class TestVectorized:
+    FORMULA = "IF a>b AND c!=0 THEN a/c ELSE b"
+
+    def test_same_as_interpreter_per_row(self):
+        np = pytest.importorskip("numpy")
+        grid = np.array([(a, b, c) for a in (-3, 0, 2, 7) for b in (-1, 0, 5) for c in (-2, 0, 0.5, 3)])
+        columns = {'a': grid[:, 0], 'b': grid[:, 1], 'c': grid[:, 2]}
+        for text in (self.FORMULA, "NOT a < b OR c", "1.5 AND c", "(a - b) * c + TRUE", "IF a THEN b ELIF c THEN 1"):
+            result, error = evaluate_columns(text, columns, context=make_context())
+            assert error is None and not result.errors
+            for row, values in enumerate(grid.tolist()):
+                context = make_context()
+                for name, value in zip('abc', values):
+                    context.symbol_table.set(name, Number(value))
+                expected, _ = run_isolated(text, context=context)
+                if expected is None:
+                    assert result.missing[row], (text, row)
+                else:
+                    assert not result.missing[row] and result.values[row] == expected.value, (text, row)
+
+    def test_errors_report_rows(self):
+        np = pytest.importorskip("numpy")
+        columns = {'x': np.array([1, 0, 2147483647, 5, 3]), 'y': np.array([1, 0, 2, 1, 0])}
+        result, _ = evaluate_columns("x * y / y", columns, context=make_context())
+        (big, big_rows), (zero, zero_rows) = result.errors
+        assert big.details == "Result is too big" and big_rows.tolist() == [2]
+        assert zero.details == "Division by zero" and zero.pos_start.idx == 8 and zero_rows.tolist() == [1, 4]
+        assert result.missing.tolist() == [False, True, True, False, True]
+        assert result.values[[0, 3]].tolist() == [1, 5]
+
+    def test_untaken_branch_does_not_fail(self):
+        np = pytest.importorskip("numpy")
+        result, _ = evaluate_columns("IF x THEN 10 / x ELSE nope", {'x': np.array([2, 0])}, context=make_context())
+        (error, rows), = result.errors
+        assert error.details == "'nope' is not defined" and rows.tolist() == [1]
+        assert result.values[0] == 5
+
+
+class TestSession:
+    def test_module_functions_take_the_default_session_lock(self):
+        outcomes = []
+        with default_session.lock:
+            worker = threading.Thread(target=lambda: outcomes.append(run_program("1 + 1; 2 * 3")))
+            worker.start()
+            worker.join(0.2)
+            assert worker.is_alive() and not outcomes
+        worker.join()
+        assert [value.value for value, _ in outcomes[0]] == [2, 6]
+
+    def test_own_context_keeps_its_own_bytecode(self):
+        compiled = len(default_session.compiled_programs)
+        context = make_context()
+        assert [value.value for value, _ in run_program("VAR x = 4; x * x", 'vm', context=context)] == [4, 16]
+        assert len(default_session.compiled_programs) == compiled
+
+    def test_sessions_are_isolated(self):
+        first, second = Session(), Session()
+        first.run("VAR x = 1")
+        assert second.run("x")[1].details == "'x' is not defined"
+        assert first.run("x")[0].value == 1 and run("y")[1] is not None
+
+    def test_sessions_in_parallel_threads(self):
+        failures = []
+
+        def count_down(start, engine):
+            session = Session()
+            session.run(f"VAR x = {start}", engine)
+            for _ in range(20):
+                session.run("VAR x = x - 1", engine)
+            session.run("WHILE x > 0 THEN VAR x = x - 1", engine)
+            result, error = session.run("x", engine)
+            if error or result.value != 0:
+                failures.append((start, engine, error))
+
+        threads = [threading.Thread(target=count_down, args=(100 + i, engine))
+                   for i in range(4) for engine in ENGINES]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not failures
+
+    def test_shared_session(self):
+        session = Session()
+        session.run("VAR x = 0")
+        threads = [threading.Thread(target=lambda: [session.run("VAR x = x + 1", 'vm') for _ in range(200)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert session.run("x")[0].value == 1600
+
+    def test_program(self):
+        session = Session()
+        assert [result.value for result, _ in session.run_program("VAR x = 2; x * x", 'closure')] == [2, 4]
+        assert session.run("x")[0].value == 2
+
+
+class TestServer:
+    @staticmethod
+    def serve(scenario, path=None):
+        async def main():
+            server = EvaluationServer(workers=2)
+            await server.start(port=0, path=path)
+            host, port = (None, None) if path else server.address[:2]
+            client = await EvaluationClient.connect(host, port, path)
+            try:
+                return await scenario(server, client)
+            finally:
+                await client.close()
+                await server.close()
+        return asyncio.run(main())
+
+    def test_concurrent_requests_are_batched(self):
+        async def scenario(server, client):
+            outcomes = await asyncio.gather(*(client.evaluate(f"{i} * 2", engine) for i in range(40)
+                                              for engine in ('tree', 'vm')))
+            assert [value for value, _ in outcomes] == [i * 2 for i in range(40) for _ in range(2)]
+            assert server.batches < server.requests == 80
+        self.serve(scenario)
+
+    def test_errors_and_sessions(self, tmp_path):
+        async def scenario(server, client):
+            await client.evaluate("VAR x = 5", session='shared')
+            value, _ = await client.evaluate("x * 2", session='shared')
+            assert value == 10
+            _, error = await client.evaluate("x")
+            assert error['type'] == 'RTError' and error['details'] == "'x' is not defined"
+            _, error = await client.evaluate("1 / 0", engine='fast')
+            assert error['type'] == 'BadRequest'
+            _, error = await client.evaluate("1 + (2 * nope)", session='shared')
+            assert (error['start'], error['end']) == (9, 13) and error['text'].endswith("^^^^")
+            assert list(server.sessions) == ['shared']
+        self.serve(scenario, path=str(tmp_path / "server.sock"))
+
+    def test_slow_session_does_not_hold_up_others(self):
+        async def scenario(_, client):
+            await client.evaluate("VAR i = 300000", session='slow')
+            slow = asyncio.ensure_future(client.evaluate("WHILE i > 0 THEN VAR i = i - 1", 'unboxed', session='slow'))
+            fast = asyncio.ensure_future(client.evaluate("1 + 1", session='fast'))
+            done, _ = await asyncio.wait([slow, fast], return_when=asyncio.FIRST_COMPLETED)
+            assert done == {fast} and fast.result() == (2, None)
+            assert await slow == (None, None)
+        self.serve(scenario)
+
+    def test_answers_after_half_close(self):
+        async def scenario(server, _):
+            reader, writer = await asyncio.open_connection(*server.address[:2])
+            writer.write(b'{"id": 7, "program": "6 * 7"}\n')
+            writer.write_eof()
+            answer = json.loads(await reader.readline())
+            writer.close()
+            assert answer == {'id': 7, 'value': 42, 'error': None}
+        self.serve(scenario)
+
+    def test_named_sessions_are_capped(self):
+        async def scenario(server, client):
+            server.max_sessions = 2
+            for name in ('a', 'b', 'a', 'c'):
+                await client.evaluate("VAR x = 1", session=name)
+            assert list(server.sessions) == ['a', 'c']
+        self.serve(scenario)
+
+
+class TestScheduler:
+    def test_same_results_as_tree(self):
+        scheduler = Scheduler(slice_steps=3)
+        tasks = [Session().submit(scheduler, program) for program in TestRunMany.BATCH]
+        scheduler.run()
+        for program, task in zip(TestRunMany.BATCH, tasks):
+            expected, error = run_isolated(program)
+            assert (task.value and task.value.value) == (expected and expected.value), program
+            assert type(task.error) is type(error) and (task.error and task.error.details) == \
+                   (error and error.details), program
+
+    def test_step_budget(self):
+        scheduler = Scheduler()
+        session = Session()
+        session.run("VAR x = 1")
+        task = session.submit(scheduler, "WHILE x > 0 THEN VAR x = x + 0", step_budget=5000)
+        scheduler.run()
+        assert isinstance(task.error, BudgetExceededError) and task.steps == 5001
+        assert task.error.details == "Step budget of 5000 steps used up"
+
+    def test_time_budget(self):
+        scheduler = Scheduler()
+        task = Session().submit(scheduler, "WHILE 1 THEN 1", time_budget=0.05)
+        scheduler.run()
+        assert isinstance(task.error, BudgetExceededError) and 0.05 <= task.elapsed < 1
+
+    def test_endless_program_does_not_block_others(self):
+        scheduler = Scheduler(slice_steps=100)
+        endless = Session().submit(scheduler, "WHILE 1 THEN 1", step_budget=10 ** 9)
+        sessions = [Session() for _ in range(200)]
+        tasks = [session.submit(scheduler, "IF (VAR x = 50) THEN WHILE x > 0 THEN VAR x = x - 1")
+                 for session in sessions]
+        while not all(task.done for task in tasks):
+            scheduler.step()
+        assert not endless.done and all(task.error is None for task in tasks)
+        assert all(session.run("x")[0].value == 0 for session in sessions)
+
+    def test_parse_error(self):
+        task = Session().submit(Scheduler(), "1 +")
+        assert task.done and isinstance(task.error, InvalidSyntaxError)
+
+
+class TestProfiler:
+    def test_counts_and_times(self):
+        session = Session()
+        session.run("VAR x = 30")
+        _, error, profile = session.profile("WHILE x > 0 THEN VAR x = IF x > 10 THEN x - 2 ELSE x - 1")
+        assert error is None
+        assert profile.by_type['WhileNode'].calls == 1 and profile.by_type['IfNode'].calls == 20
+        assert profile.by_type['VarAssignNode'].calls == 20 and profile.by_type['BinOpNode'].calls == 61
+        assert profile.loop_iterations == {('WhileNode', (1, 7), (1, 56)): 20}
+        assert profile.by_span[('BinOpNode', (1, 7), (1, 11))].calls == 21
+        loop = profile.by_type['WhileNode']
+        assert loop.total_time == profile.total_time and 0 < loop.self_time < loop.total_time
+
+    def test_nested_loops(self):
+        session = Session()
+        session.run("VAR x = 3")
+        session.run("VAR y = 0")
+        _, _, profile = session.profile("WHILE x > 0 THEN WHILE (VAR x = x - 1) + 1 > 1 THEN VAR y = y + 1")
+        assert sorted(profile.loop_iterations.values()) == [1, 2]
+
+    def test_report(self):
+        _, _, profile = Session().profile("IF 1 + 2 > 2 THEN 3 * 4")
+        lines = profile.report(sort='calls').splitlines()
+        assert lines[0].split() == ['node', 'type', 'calls', 'total', 'ms', 'self', 'ms']
+        assert lines[1].split()[:2] == ['NumberNode', '5'] and 'IfNode 1:4-1:12' in profile.report()
+
+    def test_error_stops_the_profile(self):
+        _, error, profile = Session().profile("1 + (2 * nope)")
+        assert isinstance(error, RTError) and error.details == "'nope' is not defined"
+        assert profile.by_type['VarAccessNode'].calls == 1 and profile.by_type['BinOpNode'].calls == 2
+        assert profile.by_span[('BinOpNode', (1, 1), (1, 13))].total_time == profile.total_time
+
+    def test_unprofiled_interpreter_is_untouched(self):
+        assert Interpreter().visit.__func__ is Interpreter.visit
+
+
+class TestHotLoops:
+    @staticmethod
+    def outcome(setup, text, specialize):
+        session = Session(cache=False)
+        for statement in setup:
+            session.run(statement)
+        node, _ = parse(text, cache=False)
+        interpreter = Interpreter()
+        interpreter.specialize_loops = specialize
+        result = interpreter.run(node, session.context)
+        variables = {name: session.symbol_table.get(name).value for name in session.symbol_table.slots}
+        return result.error.as_string() if result.error else None, variables, node
+
+    def run_both(self, setup, text):
+        # (error text, variables, node) of a run with hot loop specialization, checked against one without
+        error, variables, node = self.outcome(setup, text, True)
+        assert (error, variables) == self.outcome(setup, text, False)[:2]
+        return error, variables, node
+
+    def test_specialized_for_ints(self):
+        _, variables, node = self.run_both(['VAR i = 5000', 'VAR s = 0'], 'WHILE i > 0 THEN VAR s = s + (VAR i = i - 1) * 2')
+        assert variables['i'] == 0 and variables['s'] == 4999 * 5000 and isinstance(variables['s'], int)
+        assert [function is not None for function in hot_loops[node].specializations.values()] == [True]
+
+    def test_short_loops_stay_generic(self):
+        _, variables, node = self.run_both(['VAR i = 10'], 'WHILE i > 0 THEN VAR i = i - 1')
+        assert variables['i'] == 0 and node not in hot_loops and HOT_LOOP_THRESHOLD > 10
+
+    def test_guards_fall_back(self):
+        error, variables, _ = self.run_both(['VAR i = 0'], 'WHILE 1 THEN VAR i = i + 1000000')
+        assert error.startswith('StackOverFlowError: Result is too big') and variables['i'] == 2147000000
+        _, variables, _ = self.run_both(['VAR x = 0'], 'WHILE x < 3000 THEN VAR x = IF x == 2000 THEN x + 0.5 ELSE x + 1')
+        assert variables['x'] == 3000.5
+        error, variables, _ = self.run_both(['VAR i = 1500'], 'WHILE i > -5 THEN VAR j = 10 / (VAR i = i - 1)')
+        assert 'Division by zero' in error and variables['i'] == 0
+
+    def test_nested_loops_and_logic(self):
+        _, variables, _ = self.run_both(
+            ['VAR i = 3000', 'VAR j = 0'], 'WHILE i > 0 THEN VAR j = IF (VAR i = i - 1) > 10 THEN j + i AND 1 OR 0.5 ELSE j - 0.25'
+        )
+        assert variables['j'] == -1.75
+        error, variables, _ = self.run_both(
+            ['VAR a = 5', 'VAR b = 0'], 'WHILE (VAR a = a - 1) >= 0 THEN WHILE (VAR b = b + 1) < 800 * (5 - a) THEN 0'
+        )
+        assert error is None and variables['a'] == -1 and variables['b'] == 4000
+
+    def test_optimized_loop(self):
+        session = Session()
+        session.run('VAR k = 3')
+        session.run('VAR n = 2000')
+        assert session.run('WHILE n > 0 THEN VAR n = n - k * 2 + 5', optimize=True) == (None, None)
+        assert session.run('n')[0].value == 0
+
+
+class TestBenchmark:
+    def test_suite(self):
+        workload = Workload('sum', lambda size: ' + '.join(['x'] * size), [2, 4], [8], setup=lambda size: ('VAR x = 1',))
+        suite = run_suite([workload], report=lambda line: None)
+        assert [(result['size'], result['phase']) for result in suite['results']][:4] == [
+            (2, 'lex'), (2, 'parse'), (2, 'interpret'), (2, 'end_to_end')]
+        assert len(suite['results']) == 8 and suite['meta']['engine'] == 'tree'
+        assert all(result['median_s'] > 0 and result['peak_bytes'] > 0 for result in suite['results'])
+
+        full = run_suite([workload], full=True, engine='vm', memory=False, report=lambda line: None)
+        assert {result['size'] for result in full['results']} == {8}
+        assert full['results'][3]['engine'] == 'vm' and full['results'][3]['peak_bytes'] is None
+
+    def test_too_deep_is_skipped(self, monkeypatch):
+        monkeypatch.setattr(benchmark, 'RECURSION_LIMIT', 0)
+        limit = sys.getrecursionlimit()
+        workload = Workload('chain', lambda size: '1' + '+1' * size, [limit * 2], [])
+        suite = run_suite([workload], memory=False, report=lambda line: None)
+        assert [result.get('skipped') for result in suite['results']] == [None, None, 'RecursionError', 'RecursionError']
+        assert sys.getrecursionlimit() == limit and not regressions(suite, suite)
+
+    def test_regressions(self):
+        def suite(*medians):
+            return {'results': [{'workload': 'w', 'size': size, 'phase': 'lex', 'engine': 'tree', 'median_s': median}
+                                for size, median in enumerate(medians)]}
+        found = regressions(suite(1.05, 1.5, 0.5), suite(1.0, 1.0, 1.0))
+        assert [(result['size'], round(slowdown, 2)) for result, slowdown in found] == [(1, 0.5)]
+        assert regressions(suite(1.05), suite(1.0), threshold=0.01)
+
+
+class GeneratedScript:
+    # A file object whose text is made as it is read, so the script itself takes no memory
+    def __init__(self, lines, line):
+        self.remaining = lines
+        self.line = line
+
+    def read(self, size):
+        count = min(self.remaining, max(size // len(self.line), 1))
+        self.remaining -= count
+        return self.line * count
+
+
+class TestStreaming:
+    def test_one_result_per_line(self):
+        script = io.StringIO("VAR x = 2\n\nx * 3\r\nx + nope\n1 +\nx - 1")
+        outcomes = list(run_stream(script, context=make_context()))
+        assert [result and result.value for result, _ in outcomes] == [2, 6, None, None, 1]
+        assert [type(error) for _, error in outcomes] == [type(None), type(None), RTError, InvalidSyntaxError,
+                                                          type(None)]
+
+    def test_lines_keep_their_line_numbers(self):
+        script = io.StringIO("1\n2 + $\n3")
+        error = list(run_stream(script, chunk_size=2, context=make_context()))[1][1]
+        assert error.pos_start.ln == 1 and error.pos_start.col == 4
+        assert error.as_string().endswith("Line 2\n\n2 + $\n    ^")
+
+    def test_lex_error_wins_over_syntax_error(self):
+        _, error = list(run_stream(io.StringIO("1 + + ) $"), context=make_context()))[0]
+        _, expected = run_isolated("1 + + ) $")
+        assert type(error) is type(expected) and error.details == expected.details
+
+    @staticmethod
+    def peak_memory(lines):
+        context = make_context()
+        run_isolated("VAR x = 0", context=context)
+        tracemalloc.start()
+        for _, error in run_stream(GeneratedScript(lines, "VAR x = x + 1\n"), chunk_size=4096, context=context):
+            assert error is None
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert context.symbol_table.get("x").value == lines
+        return peak
+
+    def test_memory_stays_bounded(self):
+        # ten times the script, nowhere near ten times the memory
+        assert self.peak_memory(3000) < 1.5 * self.peak_memory(300)
+
+
+class EngineChecks:
+    ENGINE = 'tree'
+
+    def test_same_results_as_tree(self):
+        for program in PROGRAMS:
+            expected, _ = run_isolated(program)
+            result, error = run_isolated(program, self.ENGINE)
+            assert error is None, program
+            assert (result and result.value) == (expected and expected.value), program
+
+    def test_while_loop(self):
+        context = make_context()
+        run_isolated("VAR x=1000", self.ENGINE, context)
+        _, error = run_isolated("WHILE x>0 THEN VAR x=x-1", self.ENGINE, context)
+        assert error is None
+        result, error = run_isolated("x", self.ENGINE, context)
+        assert result.value == 0, error
+
+    def test_div_by_zero(self):
+        _, error = run_isolated("6/(3-3)", self.ENGINE)
+        assert isinstance(error, RTError) and error.details == "Division by zero"
+        _, expected = run_isolated("6/(3-3)")
+        assert error.pos_start.idx == expected.pos_start.idx
+
+    def test_undefined_variable(self):
+        _, error = run_isolated("1+nope", self.ENGINE)
+        assert isinstance(error, RTError) and error.details == "'nope' is not defined"
+
+    def test_variable_without_value(self):
+        _, error = run_isolated("(VAR a = WHILE 0 THEN 1) AND a", self.ENGINE)
+        assert isinstance(error, RTError) and error.details == "'a' is not defined"
+
+    def test_maximum_result(self):
+        _, error = run_isolated("2147483647 + 1", self.ENGINE)
+        assert isinstance(error, StackOverFlowError) and error.details == "Result is too big"
+
+    def test_too_many_variables_assigned(self):
+        _, error = run_isolated("(VAR w=1) + (VAR x=2) + (VAR y=3) + (VAR z=4)", self.ENGINE)
+        assert isinstance(error, TooManyVariablesError) and error.details == "Too Many Variables Assigned"
+
+
+class TestBytecodeEngine(EngineChecks):
+    ENGINE = 'vm'
+
+
+class TestClosureEngine(EngineChecks):
+    ENGINE = 'closure'
+
+
+class TestTranspiledEngine(EngineChecks):
+    ENGINE = 'python'
+
+    def test_error_points_to_source(self):
+        _, error = run_isolated("1 + (2 * nope)", self.ENGINE)
+        assert error.pos_start.idx == 9 and error.pos_end.idx == 13
+        assert "1 + (2 * nope)" in error.as_string()
+
+    def test_compiled_once_per_tree(self):
+        session = Session()
+        assert session.run("VAR y = 6 * 7", self.ENGINE)[0].value == 42
+        program = transpiled_programs[parse("VAR y = 6 * 7")[0]]
+        assert session.run("VAR y = 6 * 7", self.ENGINE)[0].value == 42
+        assert transpiled_programs[parse("VAR y = 6 * 7")[0]] is program
+
+
+class TestUnboxedEngine(EngineChecks):
+    ENGINE = 'unboxed'
+
+
+class TestStackEngine(EngineChecks):
+    ENGINE = 'stack'
+
+    def test_deeper_than_the_recursion_limit(self):
+        size = sys.getrecursionlimit() * 5
+        context = make_context()
+        result, error = run_isolated('1' + '+1' * size, self.ENGINE, context)
+        assert error is None and result.value == size + 1
+        _, error = run_isolated('(' * size + 'nope' + ')' * size + '+1', self.ENGINE, context)
+        assert error.details == "'nope' is not defined" and error.pos_start.idx == size
+
+
+class TestCompactEngine(EngineChecks):
+    ENGINE = 'compact'
+
+    def test_deeper_than_the_recursion_limit(self):
+        size = sys.getrecursionlimit() * 5
+        context = make_context()
+        result, error = run_isolated('1' + '+1' * size, self.ENGINE, context)
+        assert error is None and result.value == size + 1
+        _, error = run_isolated('(' * size + 'nope' + ')' * size + '+1', self.ENGINE, context)
+        assert error.details == "'nope' is not defined" and error.pos_start.idx == size
+
+    def test_loop_invariants(self):
+        session = Session()
+        session.run("VAR x = 0")
+        session.run("VAR y = 5")
+        text = "WHILE x < 20 THEN VAR x = IF x > y * 2 THEN x + y * 3 ELSE x + 1"
+        _, error = session.run(text, self.ENGINE, optimize=True)
+        assert error is None and session.symbol_table.get("x").value == 26
+
+    def test_flattened_once_per_tree(self):
+        session = Session()
+        assert session.run("VAR y = 6 * 7", self.ENGINE)[0].value == 42
+        tree = compact_trees[parse("VAR y = 6 * 7")[0]]
+        assert session.run("VAR y = 6 * 7", self.ENGINE)[0].value == 42
+        assert compact_trees[parse("VAR y = 6 * 7")[0]] is tree
+
+    def test_smaller_than_the_tree(self):
+        text = ' + '.join(f'(x * {i} - y / 2)' for i in range(2000))
+        tracemalloc.start()
+        node, _ = parse(text, cache=False)
+        tree_bytes = tracemalloc.get_traced_memory()[0]
+        tree = CompactTree.from_node(node)
+        del node
+        compact_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(tree) == 8 * 2000 - 1 and compact_bytes * 5 < tree_bytes
@@ -1,7 +1,28 @@
+import mmap
+import os
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from weakref import WeakKeyDictionary
+
+from components.closures import ClosureCompiler
+from components.compact import CompactInterpreter, CompactTree
+from components.compiler import Compiler
+from components.errors import ErrorRecord
 from components.interpeter import Interpreter
-from components.tokenizer import Lexer
+from components.tokenizer import RegexLexer, Source, stream_lines, DEFAULT_CHUNK_SIZE
+from components.transpiler import Transpiler
+from components.parse_cache import ParseCache
 from components.parser import Parser
+from components.profiler import Profile
+from components.scheduler import Task
+from components.stack_interpreter import StackInterpreter
 from components.number import Number
+from components.optimizer import optimize_ast
+from components.unboxed import UnboxedInterpreter
+from components.vectorized import VectorizedEvaluator
+from components.vm import VirtualMachine
 
 
 class Context:
@@ -13,45 +34,321 @@ class Context:
 
 
 class SymbolTable:
+    # Values live in an array; `slots` maps each name to its index. Slots never move once given out,
+    # so compiled code can keep them, and `version` tells it when a new name may have changed a lookup.
     def __init__(self):
-        self.symbols = {}
+        self.slots = {}
+        self.values = []
         self.parent = None
+        self.own_version = 0
 
     def __len__(self):
-        return len(self.symbols)
+        return len(self.slots)
+
+    @property
+    def version(self):
+        return self.own_version + (self.parent.version if self.parent else 0)
 
     def get(self, name):
-        value = self.symbols.get(name, None)
+        slot = self.slots.get(name)
+        value = self.values[slot] if slot is not None else None
         if value is None and self.parent:
             return self.parent.get(name)
         return value
 
     def set(self, name, value):
-        self.symbols[name] = value
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.define(name)
+        self.values[slot] = value
+
+    def slot_of(self, name):
+        return self.slots.get(name)
+
+    def define(self, name):
+        self.slots[name] = len(self.values)
+        self.values.append(None)
+        self.own_version += 1
+        return self.slots[name]
+
 
+def new_symbol_table():
+    symbol_table = SymbolTable()
+    symbol_table.set("FALSE", Number.FALSE)
+    symbol_table.set("TRUE", Number.TRUE)
+    return symbol_table
 
-global_symbol_table = SymbolTable()
-global_symbol_table.set("FALSE", Number(0))
-global_symbol_table.set("TRUE", Number(1))
 
+parse_cache = ParseCache()
+CHUNKS_PER_WORKER = 4
+
+
+def parse(text, cache=True):
+    # cache: True for the shared parse_cache, False for none, or a ParseCache of one's own
+    if cache is True:
+        cache = parse_cache
+    elif cache is False:
+        cache = None
+    if cache is not None:
+        cached = cache.get(text)
+        if cached is not None:
+            return cached
 
-def run(text):
     # Generate tokens
-    lexer = Lexer(text)
+    lexer = RegexLexer(text)
     tokens, error = lexer.generate_tokens()
-    if error:
-        return None, error
 
     # Generate AST
-    parser = Parser(tokens)
-    ast = parser.parse()
-    if ast.error:
-        return None, ast.error
-
-    # Run program
-    interpreter = Interpreter()
-    context = Context('<program>')
-    context.symbol_table = global_symbol_table
-    result = interpreter.visit(ast.node, context)
-
-    return result.value, result.error
+    node = None
+    if not error:
+        ast = Parser(tokens).parse()
+        node, error = ast.node, ast.error
+
+    if cache is not None:
+        cache.put(text, node, error)
+    return node, error
+
+
+def interpret(node, context):
+    return Interpreter().run(node, context)
+
+
+def interpret_unboxed(node, context):
+    return UnboxedInterpreter().run(node, context)
+
+
+def interpret_stack(node, context):
+    return StackInterpreter().run(node, context)
+
+
+def execute_bytecode(node, context, compiled=None):
+    # compiled once per parsed tree, so slot links survive across runs of the same source. The links
+    # belong to one symbol table at a time, so every session keeps its own compiled programs, and
+    # without a session's the tree is compiled afresh.
+    if compiled is None:
+        return VirtualMachine().run(Compiler().compile(node), context)
+    bytecode = compiled.get(node)
+    if bytecode is None:
+        bytecode = compiled[node] = Compiler().compile(node)
+    return VirtualMachine().run(bytecode, context)
+
+
+def execute_closures(node, context):
+    return ClosureCompiler().compile(node)(context)
+
+
+transpiled_programs = WeakKeyDictionary()
+
+
+def execute_transpiled(node, context):
+    # transpiled once per parsed tree; unlike bytecode a transpiled program keeps no links into a
+    # symbol table, so every session shares them
+    program = transpiled_programs.get(node)
+    if program is None:
+        program = transpiled_programs[node] = Transpiler().compile(node)
+    return program.run(context)
+
+
+compact_trees = WeakKeyDictionary()
+
+
+def interpret_compact(node, context):
+    # flattened once per parsed tree and, like transpiled programs, shared by every session
+    tree = compact_trees.get(node)
+    if tree is None:
+        tree = compact_trees[node] = CompactTree.from_node(node)
+    return CompactInterpreter().run(tree, context)
+
+
+ENGINES = {
+    'tree': interpret,
+    'unboxed': interpret_unboxed,
+    'stack': interpret_stack,
+    'compact': interpret_compact,
+    'vm': execute_bytecode,
+    'closure': execute_closures,
+    'python': execute_transpiled,
+}
+
+
+def check_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}")
+
+
+class Session:
+    # A symbol table, its context and the caches tied to it. Sessions share no mutable state, so they
+    # run in parallel threads without a common lock; runs within one session take its own lock
+
+    def __init__(self, symbol_table=None, cache=True):
+        self.symbol_table = new_symbol_table() if symbol_table is None else symbol_table
+        self.context = Context('<program>')
+        self.context.symbol_table = self.symbol_table
+        self.cache = cache
+        self.compiled_programs = WeakKeyDictionary()
+        self.engines = dict(ENGINES, vm=partial(execute_bytecode, compiled=self.compiled_programs))
+        self.lock = threading.RLock()
+
+    def run(self, text, engine='tree', optimize=False):
+        check_engine(engine)
+
+        node, error = parse(text, self.cache)
+        if error:
+            return None, error
+        if optimize:
+            node = optimize_ast(node)
+
+        # Run program
+        with self.lock:
+            result = self.engines[engine](node, self.context)
+
+        return result.value, result.error
+
+    def profile(self, text, optimize=False):
+        # runs text on the tree interpreter and returns (value, error, Profile)
+        profile = Profile()
+        node, error = parse(text, self.cache)
+        if error:
+            return None, error, profile
+        if optimize:
+            node = optimize_ast(node)
+        with self.lock:
+            result = Interpreter(profile).run(node, self.context)
+        return result.value, result.error, profile
+
+    def submit(self, scheduler, text, step_budget=None, time_budget=None, optimize=False):
+        # queues text on a Scheduler to run in this session in slices between other programs
+        node, error = parse(text, self.cache)
+        if error:
+            return Task.failed(error)
+        if optimize:
+            node = optimize_ast(node)
+        return scheduler.submit(node, self.context, step_budget, time_budget)
+
+    def run_program(self, text, engine='tree', optimize=False):
+        check_engine(engine)
+
+        statements, error = parse_program(text)
+        if error:
+            return [(None, error)]
+        with self.lock:
+            return list(execute_statements(statements, self.engines[engine], optimize, self.context))
+
+
+default_session = Session()
+global_symbol_table = default_session.symbol_table
+
+
+def run(text, engine='tree', optimize=False):
+    return default_session.run(text, engine, optimize)
+
+
+def parse_program(text, source=None):
+    # Lexes and parses a whole multi-statement program in one pass; node is the list of statements
+    lexer = RegexLexer(text, source, program=True)
+    tokens = lexer.iter_tokens()
+    ast = Parser(tokens).parse_program()
+    for _ in tokens:
+        # a syntax error stops the parser early, but a lex error further on still takes precedence
+        pass
+    if lexer.error:
+        return None, lexer.error
+    return ast.node, ast.error
+
+
+def execute_statements(statements, execute, optimize, context, lock=nullcontext()):
+    for node in statements:
+        if optimize:
+            node = optimize_ast(node)
+        with lock:
+            result = execute(node, context)
+        yield result.value, result.error
+
+
+def run_target(context):
+    # (context, engines, lock): without a context of the caller's, runs go to the default session and
+    # take its lock like run() does; a context of the caller's is the caller's to guard
+    if context is None:
+        return default_session.context, default_session.engines, default_session.lock
+    return context, ENGINES, nullcontext()
+
+
+def run_program(text, engine='tree', optimize=False, context=None):
+    # One (value, error) pair per statement, like a run() each; a lex or syntax error anywhere
+    # stops the program before anything runs and is returned alone
+    check_engine(engine)
+    statements, error = parse_program(text)
+    if error:
+        return [(None, error)]
+    context, engines, lock = run_target(context)
+    with lock:
+        return list(execute_statements(statements, engines[engine], optimize, context))
+
+
+def run_file(path, engine='tree', optimize=False, context=None):
+    # The script is memory-mapped and lexed straight from the mapping instead of being read into a str
+    with open(path, 'rb') as script:
+        try:
+            mapped = mmap.mmap(script.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped, and has no statements to run
+            return []
+    # not closed here: error and result positions keep pointing into the mapping, which is
+    # unmapped once the last of them is gone
+    return run_program(mapped, engine, optimize, context)
+
+
+def run_stream(reader, engine='tree', optimize=False, chunk_size=DEFAULT_CHUNK_SIZE, context=None):
+    # Yields a (value, error) pair per statement as each line runs; tokens go straight from the
+    # lexer into the parser, so memory stays bounded by the longest line
+    check_engine(engine)
+    context, engines, lock = run_target(context)
+
+    for ln, line in stream_lines(reader, chunk_size):
+        if not line.strip():
+            continue
+
+        statements, error = parse_program(line, Source(line, first_line=ln))
+        if error:
+            yield None, error
+            continue
+        yield from execute_statements(statements, engines[engine], optimize, context, lock)
+
+
+def run_detached(text, engine='tree', optimize=False):
+    # Runs one program of a batch in a session of its own, and returns a result that pickles cheaply:
+    # a bare Number and an ErrorRecord, neither holding on to the context
+    value, error = Session().run(text, engine, optimize)
+    if error:
+        return None, ErrorRecord.from_error(error)
+    return None if value is None else Number.box(value.value), None
+
+
+def run_many(sources, workers=None, engine='tree', optimize=False, chunksize=None):
+    # Runs independent programs on a process pool, each in a fresh session, and returns their
+    # (value, error) pairs in input order; sent CHUNKS_PER_WORKER chunks per worker unless chunksize is given
+    check_engine(engine)
+    sources = list(sources)
+    run_one = partial(run_detached, engine=engine, optimize=optimize)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(sources) <= 1:
+        return [run_one(text) for text in sources]
+
+    if chunksize is None:
+        chunksize = max(1, len(sources) // (workers * CHUNKS_PER_WORKER))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(run_one, sources, chunksize=chunksize))
+
+
+def evaluate_columns(text, columns, optimize=False, context=None):
+    # Evaluates text for every row of columns, NumPy arrays by variable name; error is only a parse
+    # error, failures of single rows are in the VectorResult
+    node, error = parse(text)
+    if error:
+        return None, error
+    if optimize:
+        node = optimize_ast(node)
+    context, _, lock = run_target(context)
+    with lock:
+        return VectorizedEvaluator().run(node, columns, context), None
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import itertools
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from components.errors import ErrorRecord
+from runner import Session, ENGINES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BATCH = 256
+DEFAULT_WORKERS = 4
+MAX_SESSIONS = 1024
+
+
+def error_fields(error):
+    record = ErrorRecord.from_error(error)
+    return {
+        'type': record.error_type,
+        'name': record.error_name,
+        'details': record.details,
+        'start': record.pos_start.idx if record.pos_start else None,
+        'end': record.pos_end.idx if record.pos_end else None,
+        'text': record.as_string(),
+    }
+
+
+def bad_request(request_id, details):
+    return {'id': request_id, 'value': None, 'error': {'type': 'BadRequest', 'name': 'BadRequest',
+                                                       'details': details, 'start': None, 'end': None,
+                                                       'text': details}}
+
+
+class SessionWorker:
+    # Runs the requests of one session in the order they arrived. Requests that queue up while a batch
+    # runs are coalesced into the next one, which goes to the thread pool as a single job.
+    def __init__(self, server, session):
+        self.session = session
+        self.queue = asyncio.Queue()
+        self.running = False
+        self.task = asyncio.create_task(self.run(server))
+
+    @property
+    def idle(self):
+        return not self.running and self.queue.empty()
+
+    async def run(self, server):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < server.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            server.batches += 1
+            server.requests += len(batch)
+
+            self.running = True
+            try:
+                responses = await loop.run_in_executor(
+                    server.executor, server.evaluate_group, self.session, [request for request, _, _ in batch]
+                )
+            finally:
+                self.running = False
+
+            writers = set()
+            for (_, writer, answered), response in zip(batch, responses):
+                if not writer.is_closing():
+                    writer.write(response)
+                    writers.add(writer)
+                answered.set_result(None)
+            for writer in writers:
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+
+class EvaluationServer:
+    """Evaluates programs sent as newline-delimited JSON over TCP or a Unix socket.
+
+    A request is {"id": ..., "program": "...", "engine": "tree", "optimize": false, "session": "name"},
+    and its response {"id": ..., "value": number or null, "error": null or {...}}. Requests naming a
+    session share that warm Session across connections, up to max_sessions of them; the others run in
+    a session of their connection. Every session has a worker of its own, so a slow program only holds
+    up the requests queued behind it in its session."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_batch=MAX_BATCH, max_sessions=MAX_SESSIONS):
+        self.sessions = OrderedDict()
+        self.max_batch = max_batch
+        self.max_sessions = max_sessions
+        # threads rather than processes: a session's symbol table lives in this process, and the GIL
+        # is released every switch interval, so the event loop keeps moving bytes while programs run
+        self.executor = ThreadPoolExecutor(workers)
+        self.server = None
+        self.batches = 0
+        self.requests = 0
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for worker in self.sessions.values():
+            worker.task.cancel()
+        self.executor.shutdown(wait=False)
+
+    def named_session(self, name):
+        worker = self.sessions.get(name)
+        if worker is None:
+            if len(self.sessions) >= self.max_sessions:
+                # evicts the least recently used session with nothing queued or running
+                idle = next((key for key, candidate in self.sessions.items() if candidate.idle), None)
+                if idle is not None:
+                    self.sessions.pop(idle).task.cancel()
+            worker = self.sessions[name] = SessionWorker(self, Session())
+        self.sessions.move_to_end(name)
+        return worker
+
+    async def handle_connection(self, reader, writer):
+        connection_worker = SessionWorker(self, Session())
+        pending = set()
+        try:
+            while line := await reader.readline():
+                self.accept(line, writer, connection_worker, pending)
+            # the client may have only closed its side: its answers are still owed
+            await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            connection_worker.task.cancel()
+            writer.close()
+
+    def accept(self, line, writer, connection_worker, pending):
+        # queues one request line on the worker of its session
+        if not line.strip():
+            return
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or not isinstance(request.get('program'), str):
+                raise ValueError('a request is an object with a "program" string')
+        except ValueError as error:
+            writer.write(json.dumps(bad_request(None, str(error))).encode() + b'\n')
+            return
+
+        name = request.get('session')
+        worker = connection_worker if name is None else self.named_session(name)
+        answered = asyncio.get_running_loop().create_future()
+        pending.add(answered)
+        answered.add_done_callback(pending.discard)
+        worker.queue.put_nowait((request, writer, answered))
+
+    @staticmethod
+    def evaluate_group(session, requests):
+        # runs on a worker thread; the responses are encoded here as well, off the event loop
+        return [json.dumps(EvaluationServer.evaluate(request, session)).encode() + b'\n' for request in requests]
+
+    @staticmethod
+    def evaluate(request, session):
+        request_id = request.get('id')
+        engine = request.get('engine', 'tree')
+        if engine not in ENGINES:
+            return bad_request(request_id, f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}")
+
+        try:
+            value, error = session.run(request['program'], engine, bool(request.get('optimize')))
+        except Exception as crash:  # pylint: disable=broad-exception-caught
+            # one broken program mustn't take the batch, or the server, down with it
+            return {'id': request_id, 'value': None, 'error': {
+                'type': type(crash).__name__, 'name': 'InternalError', 'details': str(crash),
+                'start': None, 'end': None, 'text': f'InternalError: {crash}'
+            }}
+        return {
+            'id': request_id,
+            'value': None if value is None else value.value,
+            'error': None if error is None else error_fields(error),
+        }
+
+
+class EvaluationClient:
+    """Client for EvaluationServer. Requests can be sent concurrently from many tasks over one
+    connection; responses are matched back to them by id."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}
+        self.listener = asyncio.create_task(self.listen())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def evaluate(self, program, engine='tree', optimize=False, session=None):
+        # returns (value, error), error being the server's error object or None
+        request_id = next(self.ids)
+        request = {'id': request_id, 'program': program, 'engine': engine, 'optimize': optimize}
+        if session is not None:
+            request['session'] = session
+
+        response = self.waiting[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        answer = await response
+        return answer['value'], answer['error']
+
+    async def listen(self):
+        try:
+            while line := await self.reader.readline():
+                answer = json.loads(line)
+                response = self.waiting.pop(answer['id'], None)
+                if response and not response.done():
+                    response.set_result(answer)
+        finally:
+            for response in self.waiting.values():
+                if not response.done():
+                    response.set_exception(ConnectionError('The server closed the connection'))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.listener.cancel()
+
+
+async def serve(host, port, path, workers):
+    server = EvaluationServer(workers)
+    await server.start(host, port, path)
+    print(f'Serving on {path or server.address}')
+    await server.server.serve_forever()
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Evaluation server speaking newline-delimited JSON')
+    arguments.add_argument('--host', default=DEFAULT_HOST)
+    arguments.add_argument('--port', type=int, default=DEFAULT_PORT)
+    arguments.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    arguments.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    options = arguments.parse_args()
+    asyncio.run(serve(options.host, options.port, options.unix, options.workers))